@@ -12,8 +12,12 @@ Features:
 - Streams requests from file, to avoid running out of memory for giant jobs
 - Makes requests concurrently, to maximize throughput
 - Throttles request and token usage, to stay under rate limits
+- Backs off adaptively on rate limit errors (AIMD), per endpoint
+- Spreads requests over several deployments, each with its own budget
 - Retries failed requests up to {max_attempts} times, to avoid missing data
 - Logs errors, to diagnose problems with requests
+- Writes results from a single buffered writer, so lines never interleave
+- Resumes interrupted runs without resending finished requests
 
 Example command to call script:
 ```
@@ -56,6 +60,37 @@ Inputs:
 - max_attempts : int, optional
     - number of times to retry a failed request before giving up
     - if omitted, will default to 5
+- base_url : str, optional
+    - endpoint to send requests to instead of AZURE_OPENAI_ENDPOINT from .env
+    - e.g. the url of a local benchmarks/mock_openai_server.py for load testing
+    - if omitted, will use the Azure endpoint
+- endpoints_filepath : str, optional
+    - json file listing several deployments to spread requests over, each with its own rate limits
+    - e.g., [{"name": "east", "base_url": "https://east.openai.azure.com", "model": "gpt4", "max_requests_per_minute": 600}]
+    - missing keys default to the arguments above, so by default there is one endpoint
+- max_requests_in_flight : int, optional
+    - most requests awaiting a response at once; more connections than the client keeps alive (100) cost CPU
+    - should be at least max_requests_per_minute / 60 * the API's latency in seconds
+    - if omitted, will default to 100
+- resume : bool, optional
+    - skip requests whose result (or errors) is already in save_filepath, e.g. after a crash
+    - requests are matched by metadata.row_id, or by a hash of the request if there is none
+    - progress is checkpointed to {save_filepath}.checkpoint after every fsync, so resuming starts
+      reading requests_filepath where every earlier request was done instead of at the start
+    - failed requests count as done, delete their lines from save_filepath to retry them
+    - if omitted, results are appended to save_filepath and every request is sent again
+- cache_filepath : str, optional
+    - sqlite3 completion cache shared with the other question generators (see utils/llm_cache.py)
+    - requests already in the cache are answered from it without calling the API or using the budget
+    - requests are matched by their model and prompt, not by the endpoint they are sent to
+    - if omitted, will default to LLM_CACHE from .env or the environment, and no cache if that is unset
+- token_count_workers : int, optional
+    - processes counting the tokens of requests ahead of the main loop, in chunks of 1000 lines
+    - worth it only when counting can't keep up with max_requests_per_minute, e.g. very long prompts
+    - if omitted, will default to 0 (tokens are counted as requests are sent)
+- fsync_interval : float, optional
+    - seconds between fsyncs of the results file, results are flushed to the OS after every batch
+    - if omitted, will default to 5
 - logging_level : int, optional
     - level of logging to use; higher numbers will log fewer messages
     - 40 = ERROR; will log only when requests fail after all retries
@@ -67,37 +102,66 @@ Inputs:
 The script is structured as follows:
     - Imports
     - Define main()
+        - With resume, index the results already saved and skip to the checkpoint
+        - Read requests from file, and process them (process_api_requests also takes other streams, see pipeline.py)
+    - Define process_api_requests()
         - Initialize things
         - In main loop:
-            - Get next request if one is not already waiting for capacity
-            - Update available token & request capacity
-            - If enough capacity available, call API
-            - The loop pauses if a rate limit error is hit
+            - Get next request if one is not already waiting for capacity, skipping saved ones
+            - Answer it from the completion cache if it is there
+            - Sleep until an endpoint's token & request buckets have capacity (see utils/rate_limit.py)
+            - Call API on that endpoint
+            - Rate limit errors shrink that endpoint's budget, successes grow it back
             - The loop breaks when no tasks remain
+        - Flush and close the results file
     - Define dataclasses
         - StatusTracker (stores script metadata counters; only one instance is created)
         - APIRequest (stores API inputs, outputs, metadata; one method to call API)
+        - Endpoint (client, deployment and rate limiter of one endpoint)
+    - Define Checkpoint (offset in the requests file up to which everything is saved)
+    - Define ResultWriter (owns the results file; requests queue results to it)
     - Define functions
+        - load_endpoints (creates the endpoints from the arguments or a json file)
+        - request_key (row_id or hash identifying a request across runs)
+        - load_saved_requests (indexes the requests already in the results file)
         - api_endpoint_from_url (extracts API endpoint from request URL)
-        - append_to_jsonl (writes to results file)
-        - num_tokens_consumed_from_request (bigger function to infer token usage from request)
+        - TokenCounter (counts chat request tokens, caching shared prompt prefixes)
+        - num_tokens_consumed_from_request (infers token usage from request)
+        - read_requests (reads the requests file, optionally counting tokens in worker processes)
         - task_id_generator_function (yields 0, 1, 2, ...)
     - Run main()
 """
 
 import argparse  # for running script from command line
 import asyncio  # for running API calls concurrently
+import collections  # for the chunks of requests being token counted
+import functools  # for caching token counters
+import hashlib  # for identifying requests without a row_id
 import json  # for saving results to a jsonl file
 import logging  # for logging rate limit warnings and other messages
+import os  # for fsyncing the results file
 import time  # for sleeping after rate limit is hit
+from concurrent.futures import ProcessPoolExecutor  # for counting tokens in parallel
 from dataclasses import (  # for storing API inputs, outputs, and metadata
     dataclass, field)
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
 # imports
 import openai
 import tiktoken  # for counting tokens
-from dotenv import dotenv_values
+
+from convert_path_to_query import LLM_PROMPT
+from utils.llm_cache import CompletionCache
+from utils.openai_helpers import get_client, open_default_cache
+from utils.rate_limit import RateLimiter, Scheduler, retry_after_seconds
+
+# chat format overhead, as in the OpenAI cookbook's num_tokens_from_messages
+TOKENS_PER_MESSAGE = 3  # <|start|>{role/name}\n{content}<|end|>\n
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3  # every reply is primed with <|start|>assistant<|message|>
+# completion tokens budgeted for requests without max_tokens; the limiters are
+# corrected with the actual usage of every response
+DEFAULT_MAX_TOKENS = 15
 
 
 async def process_api_requests_from_file(
@@ -108,30 +172,99 @@ async def process_api_requests_from_file(
     token_encoding_name: str,
     max_attempts: int,
     logging_level: int,
+    base_url: Optional[str] = None,
+    fsync_interval: float = 5.0,
+    endpoints_filepath: Optional[str] = None,
+    max_requests_in_flight: int = 100,
+    resume: bool = False,
+    cache_filepath: Optional[str] = None,
+    token_count_workers: int = 0,
 ):
-    # get Azure OpenAI client
-    secrets = dotenv_values(".env")
-    api_key = secrets["AZURE_OPENAI_KEY"]
-    azure_endpoint = secrets["AZURE_OPENAI_ENDPOINT"]
-    if azure_endpoint is None or api_key is None:
-        raise Exception(".env values not set - see generate.py header for info")
-    endpoint = openai.AzureOpenAI(
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-        api_version="2024-02-15-preview",
-    )
-
     """Processes API requests in parallel, throttling to stay under rate limits."""
-    # constants
-    seconds_to_pause_after_rate_limit_error = 15
-    seconds_to_sleep_each_loop = (
-        0.001  # 1 ms limits max throughput to 1,000 requests per second
-    )
-
     # initialize logging
     logging.basicConfig(level=logging_level)
     logging.debug(f"Logging initialized at level {logging_level}")
 
+    checkpoint = Checkpoint(
+        save_filepath + ".checkpoint", requests_filepath
+    )  # how far requests_filepath is done, saved with the results
+    saved_requests = set()  # keys of requests already in save_filepath
+    if resume:
+        saved_requests = load_saved_requests(save_filepath)
+        checkpoint.read_offset = checkpoint.load(save_filepath)
+        logging.info(
+            f"Resuming: {len(saved_requests)} requests already saved, "
+            f"starting at byte {checkpoint.read_offset} of {requests_filepath}"
+        )
+
+    # initialize file reading
+    executor = (
+        ProcessPoolExecutor(token_count_workers) if token_count_workers > 0 else None
+    )  # counts tokens of requests ahead of the main loop
+    try:
+        with open(requests_filepath, "rb") as file:
+            # read requests one at a time, by line so the offsets can be checkpointed
+            file.seek(checkpoint.read_offset)
+            requests = read_requests(
+                file,
+                token_encoding_name,
+                executor=executor,
+                n_chunks_ahead=max(token_count_workers, 1),
+            )
+            logging.debug("File opened")
+            await process_api_requests(
+                requests,
+                save_filepath=save_filepath,
+                max_requests_per_minute=max_requests_per_minute,
+                max_tokens_per_minute=max_tokens_per_minute,
+                token_encoding_name=token_encoding_name,
+                max_attempts=max_attempts,
+                base_url=base_url,
+                fsync_interval=fsync_interval,
+                endpoints_filepath=endpoints_filepath,
+                max_requests_in_flight=max_requests_in_flight,
+                cache_filepath=cache_filepath,
+                checkpoint=checkpoint,
+                saved_requests=saved_requests,
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+async def process_api_requests(
+    requests: AsyncIterator[Tuple[dict, Optional[int], Optional[int], Optional[int]]],
+    save_filepath: str,
+    max_requests_per_minute: float,
+    max_tokens_per_minute: float,
+    token_encoding_name: str,
+    max_attempts: int,
+    base_url: Optional[str] = None,
+    fsync_interval: float = 5.0,
+    endpoints_filepath: Optional[str] = None,
+    max_requests_in_flight: int = 100,
+    cache_filepath: Optional[str] = None,
+    checkpoint: Optional["Checkpoint"] = None,
+    saved_requests: Set[str] = frozenset(),
+):
+    """Processes a stream of API requests in parallel, throttling to stay under rate limits.
+
+    `requests` yields (request_json, tokens, line_offset, line_end) tuples, as
+    `read_requests` does for a requests file; a request's tokens are counted
+    here if `None`. The offsets are only used by `checkpoint`, streams which
+    aren't read from a file (see pipeline.py) pass `None`. A request is only
+    pulled from `requests` once the previous one is sent, so a generator
+    producing them is paced by the rate limits.
+    """
+    # get Azure OpenAI clients, or a local server with base_url, each with its own budget
+    endpoints = load_endpoints(
+        endpoints_filepath, base_url, max_requests_per_minute, max_tokens_per_minute
+    )
+    scheduler = Scheduler({name: e.limiter for name, e in endpoints.items()})
+    # a full bucket would otherwise start all its requests at once, more than
+    # the client's connection pool can serve efficiently
+    requests_in_flight = asyncio.Semaphore(max_requests_in_flight)
+
     # initialize trackers
     queue_of_requests_to_retry = asyncio.Queue()
     task_id_generator = (
@@ -141,124 +274,126 @@ async def process_api_requests_from_file(
         StatusTracker()
     )  # single instance to track a collection of variables
     next_request = None  # variable to hold the next request to call
-
-    # initialize available capacity counts
-    available_request_capacity = max_requests_per_minute
-    available_token_capacity = max_tokens_per_minute
-    last_update_time = time.time()
+    writer = ResultWriter(
+        save_filepath, fsync_interval=fsync_interval, checkpoint=checkpoint
+    )  # single owner of the results file
+    cache = open_default_cache(cache_filepath)  # None without a cache
 
     # initialize flags
-    file_not_finished = True  # after file is empty, we'll skip reading it
+    requests_not_finished = True  # after requests run out, we'll skip reading them
     logging.debug(f"Initialization complete.")
 
-    # initialize file reading
-    with open(requests_filepath) as file:
-        # `requests` will provide requests one at a time
-        requests = file.__iter__()
-        logging.debug(f"File opened. Entering main loop")
+    writer.start()
+    try:
+        logging.debug("Entering main loop")
         while True:
             # get next request (if one is not already waiting for capacity)
             if next_request is None:
                 if not queue_of_requests_to_retry.empty():
                     next_request = queue_of_requests_to_retry.get_nowait()
+                elif requests_not_finished:
+                    # get new request
+                    entry = await anext(requests, None)
+                    if entry is None:
+                        # if requests run out, set flag to stop reading them
+                        logging.debug("Requests exhausted")
+                        requests_not_finished = False
+                        continue
+                    request_json, tokens, line_offset, line_end = entry
+                    if checkpoint is not None:
+                        checkpoint.read_offset = line_end
+                    metadata = request_json.pop("metadata", None)
+                    if request_key(request_json, metadata) in saved_requests:
+                        # saved by an earlier run
+                        status_tracker.num_tasks_skipped += 1
+                        continue
+                    if tokens is None:
+                        tokens = num_tokens_consumed_from_request(
+                            request_json, token_encoding_name
+                        )
+                    next_request = APIRequest(
+                        task_id=next(task_id_generator),
+                        request_json=request_json,
+                        token_consumption=tokens,
+                        attempts_left=max_attempts,
+                        metadata=metadata,
+                    )
+                    if checkpoint is not None:
+                        checkpoint.pending[next_request.task_id] = line_offset
+                    status_tracker.num_tasks_started += 1
                     logging.debug(
-                        f"Retrying request {next_request.task_id}: {next_request}"
+                        f"Reading request {next_request.task_id}: {next_request}"
                     )
-                elif file_not_finished:
-                    try:
-                        # get new request
-                        request_json = json.loads(next(requests))
-                        next_request = APIRequest(
-                            task_id=next(task_id_generator),
-                            request_json=request_json,
-                            token_consumption=num_tokens_consumed_from_request(
-                                request_json, token_encoding_name
-                            ),
-                            attempts_left=max_attempts,
-                            metadata=request_json.pop("metadata", None),
-                            endpoint=endpoint,
-                        )
-                        status_tracker.num_tasks_started += 1
-                        status_tracker.num_tasks_in_progress += 1
-                        logging.debug(
-                            f"Reading request {next_request.task_id}: {next_request}"
-                        )
-                    except StopIteration:
-                        # if file runs out, set flag to stop reading it
-                        logging.debug("Read file exhausted")
-                        file_not_finished = False
-
-            # update available capacity
-            current_time = time.time()
-            seconds_since_update = current_time - last_update_time
-            available_request_capacity = min(
-                available_request_capacity
-                + max_requests_per_minute * seconds_since_update / 60.0,
-                max_requests_per_minute,
-            )
-            available_token_capacity = min(
-                available_token_capacity
-                + max_tokens_per_minute * seconds_since_update / 60.0,
-                max_tokens_per_minute,
-            )
-            last_update_time = current_time
-
-            # if enough capacity available, call API
-            if next_request:
-                next_request_tokens = next_request.token_consumption
-                if (
-                    available_request_capacity >= 1
-                    and available_token_capacity >= next_request_tokens
-                ):
-                    # update counters
-                    available_request_capacity -= 1
-                    available_token_capacity -= next_request_tokens
-                    next_request.attempts_left -= 1
-
-                    # call API
-                    asyncio.create_task(
-                        next_request.call_api(
-                            retry_queue=queue_of_requests_to_retry,
-                            save_filepath=save_filepath,
-                            status_tracker=status_tracker,
-                        )
+                    if cache is not None:
+                        response_dict = cache.get(next_request.cache_params())
+                        if response_dict is not None:
+                            # generated by an earlier run, no need to schedule it
+                            next_request.save(writer, response_dict)
+                            status_tracker.num_tasks_cached += 1
+                            status_tracker.num_tasks_succeeded += 1
+                            next_request = None
+                            continue
+                    status_tracker.num_tasks_in_progress += 1
+                elif status_tracker.num_tasks_in_progress == 0:
+                    # if all tasks are finished, break
+                    break
+                else:
+                    # sleep until a request fails and needs a retry, or the last one finishes
+                    next_request = await queue_of_requests_to_retry.get()
+                if next_request is None:
+                    continue  # woken up by the last request finishing
+                if next_request.result:
+                    logging.debug(
+                        f"Retrying request {next_request.task_id}: {next_request}"
                     )
-                    next_request = None  # reset next_request to empty
-
-            # if all tasks are finished, break
-            if status_tracker.num_tasks_in_progress == 0:
-                break
 
-            # main loop sleeps briefly so concurrent tasks can run
-            await asyncio.sleep(seconds_to_sleep_each_loop)
-
-            # if a rate limit error was hit recently, pause to cool down
-            seconds_since_rate_limit_error = (
-                time.time() - status_tracker.time_of_last_rate_limit_error
-            )
-            if seconds_since_rate_limit_error < seconds_to_pause_after_rate_limit_error:
-                remaining_seconds_to_pause = (
-                    seconds_to_pause_after_rate_limit_error
-                    - seconds_since_rate_limit_error
-                )
-                await asyncio.sleep(remaining_seconds_to_pause)
-                # ^e.g., if pause is 15 seconds and final limit was hit 5 seconds ago
-                logging.warn(
-                    f"Pausing to cool down until {time.ctime(status_tracker.time_of_last_rate_limit_error + seconds_to_pause_after_rate_limit_error)}"
+            # sleep until a connection is free and some endpoint has capacity, then call API
+            await requests_in_flight.acquire()
+            name = await scheduler.acquire(next_request.token_consumption)
+            next_request.attempts_left -= 1
+            task = asyncio.create_task(
+                next_request.call_api(
+                    endpoint=endpoints[name],
+                    retry_queue=queue_of_requests_to_retry,
+                    writer=writer,
+                    status_tracker=status_tracker,
+                    cache=cache,
                 )
-
-        # after finishing, log final status
+            )
+            task.add_done_callback(lambda _: requests_in_flight.release())
+            next_request = None  # reset next_request to empty
+    finally:
+        # flush results already received, even if the loop failed
+        await writer.close()
+        if cache is not None:
+            logging.info(cache.report())
+            cache.close()
+
+    # after finishing, log final status
+    logging.info(
+        f"""Parallel processing complete. Results saved to {save_filepath}"""
+    )
+    minutes_elapsed = (time.time() - status_tracker.time_started) / 60.0
+    logging.info(
+        f"Achieved {status_tracker.num_tasks_started / minutes_elapsed:.1f} requests per minute "
+        f"(max_requests_per_minute={max_requests_per_minute})"
+    )
+    if status_tracker.num_tasks_cached > 0:
         logging.info(
-            f"""Parallel processing complete. Results saved to {save_filepath}"""
+            f"Answered {status_tracker.num_tasks_cached} requests from the completion cache"
+        )
+    if status_tracker.num_tasks_skipped > 0:
+        logging.info(
+            f"Skipped {status_tracker.num_tasks_skipped} requests already saved to {save_filepath}"
+        )
+    if status_tracker.num_tasks_failed > 0:
+        logging.warning(
+            f"{status_tracker.num_tasks_failed} / {status_tracker.num_tasks_started} requests failed. Errors logged to {save_filepath}."
+        )
+    if status_tracker.num_rate_limit_errors > 0:
+        logging.warning(
+            f"{status_tracker.num_rate_limit_errors} rate limit errors received. Consider running at a lower rate."
         )
-        if status_tracker.num_tasks_failed > 0:
-            logging.warning(
-                f"{status_tracker.num_tasks_failed} / {status_tracker.num_tasks_started} requests failed. Errors logged to {save_filepath}."
-            )
-        if status_tracker.num_rate_limit_errors > 0:
-            logging.warning(
-                f"{status_tracker.num_rate_limit_errors} rate limit errors received. Consider running at a lower rate."
-            )
 
 
 # dataclasses
@@ -272,10 +407,13 @@ class StatusTracker:
     num_tasks_in_progress: int = 0  # script ends when this reaches 0
     num_tasks_succeeded: int = 0
     num_tasks_failed: int = 0
+    num_tasks_skipped: int = 0  # already saved by an earlier run
+    num_tasks_cached: int = 0  # answered from the completion cache
     num_rate_limit_errors: int = 0
     num_api_errors: int = 0  # excluding rate limit errors, counted above
     num_other_errors: int = 0
-    time_of_last_rate_limit_error: int = 0  # used to cool off after hitting rate limits
+    time_of_last_rate_limit_error: int = 0
+    time_started: float = field(default_factory=time.time)  # for the achieved rate
 
 
 @dataclass
@@ -287,25 +425,44 @@ class APIRequest:
     token_consumption: int
     attempts_left: int
     metadata: dict
-    endpoint: openai.OpenAI
     result: List = field(default_factory=list)
 
+    def cache_params(self) -> dict:
+        """Parameters identifying the request in the completion cache."""
+        return {
+            "model": self.request_json["model"],
+            "messages": [{"role": "user", "content": self.request_json["prompt"]}],
+        }
+
+    def save(self, writer: "ResultWriter", response_dict: dict) -> None:
+        """Queues the request and its response to the results file."""
+        data = (
+            [self.request_json, response_dict, self.metadata]
+            if self.metadata
+            else [self.request_json, response_dict]
+        )
+        writer.write(data, self.task_id)
+
     async def call_api(
         self,
+        endpoint: "Endpoint",
         retry_queue: asyncio.Queue,
-        save_filepath: str,
+        writer: "ResultWriter",
         status_tracker: StatusTracker,
+        cache: Optional[CompletionCache] = None,
     ):
         """Calls the Azure OpenAI API and saves results."""
         logging.info(f"Starting request #{self.task_id}")
         error = None
 
         try:
-            response = self.endpoint.chat.completions.create(
-                model=self.request_json["model"],
+            response = await endpoint.client.chat.completions.create(
+                model=endpoint.model or self.request_json["model"],
                 messages=[{"role": "user", "content": self.request_json["prompt"]}],
             )
-            response_dict = response.to_dict()
+            response_dict = response.model_dump()
+            if cache is not None:
+                cache.put(self.cache_params(), response_dict)
 
         except openai.RateLimitError as e:
             status_tracker.time_of_last_rate_limit_error = time.time()
@@ -313,6 +470,12 @@ class APIRequest:
             status_tracker.num_api_errors -= (
                 1  # rate limit errors are counted separately
             )
+            # slow down only this endpoint, the others keep their budgets
+            endpoint.limiter.on_rate_limit(retry_after_seconds(e.response.headers))
+            logging.warning(
+                f"Request {self.task_id} rate limited by {endpoint.name}, "
+                f"slowing to {endpoint.limiter.requests_per_minute:.0f} requests per minute"
+            )
             error = e
 
         except Exception as e:
@@ -332,54 +495,344 @@ class APIRequest:
                     if self.metadata
                     else [self.request_json, [str(e) for e in self.result]]
                 )
-                append_to_jsonl(data, save_filepath)
+                writer.write(data, self.task_id)
                 status_tracker.num_tasks_in_progress -= 1
                 status_tracker.num_tasks_failed += 1
         else:
-            data = (
-                [self.request_json, response_dict, self.metadata]
-                if self.metadata
-                else [self.request_json, response_dict]
-            )
-            append_to_jsonl(data, save_filepath)
+            endpoint.limiter.on_success()
+            if response.usage is not None:
+                # replace the estimate with what the request actually used
+                endpoint.limiter.record_usage(
+                    self.token_consumption, response.usage.total_tokens
+                )
+            self.save(writer, response_dict)
             status_tracker.num_tasks_in_progress -= 1
             status_tracker.num_tasks_succeeded += 1
-            logging.debug(f"Request {self.task_id} saved to {save_filepath}")
+            logging.debug(f"Request {self.task_id} queued to {writer.filename}")
+        if status_tracker.num_tasks_in_progress == 0:
+            # wake the main loop so it can finish
+            retry_queue.put_nowait(None)
+
+
+@dataclass
+class Endpoint:
+    """A deployment to send requests to, with its own rate limits."""
+
+    name: str
+    client: openai.AsyncOpenAI
+    limiter: RateLimiter
+    model: Optional[str] = None  # deployment name, overrides the request's model
+
+
+@dataclass
+class Checkpoint:
+    """Offset in the requests file before which every request is saved."""
+
+    filepath: str
+    requests_filepath: str
+    read_offset: int = 0  # end of the last line read from the requests file
+    pending: Dict[int, int] = field(
+        default_factory=dict
+    )  # line offset of every request read but not yet written, by task id
+
+    @property
+    def resume_offset(self) -> int:
+        return min(self.pending.values(), default=self.read_offset)
+
+    def save(self, resume_offset: int, results_size: int) -> None:
+        """Atomically replace the checkpoint file."""
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, "w") as f:
+            json.dump(
+                {
+                    "requests_filepath": os.path.abspath(self.requests_filepath),
+                    "resume_offset": resume_offset,
+                    "results_size": results_size,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filepath, self.filepath)
+
+    def load(self, results_filepath: str) -> int:
+        """Read the saved resume offset, 0 if it doesn't match the files."""
+        if not os.path.exists(self.filepath):
+            return 0
+        with open(self.filepath) as f:
+            saved = json.load(f)
+        if saved["requests_filepath"] != os.path.abspath(self.requests_filepath):
+            logging.warning(
+                f"Ignoring checkpoint {self.filepath}, it is for {saved['requests_filepath']}"
+            )
+            return 0
+        results_size = (
+            os.path.getsize(results_filepath) if os.path.exists(results_filepath) else 0
+        )
+        if results_size < saved["results_size"]:
+            logging.warning(
+                f"Ignoring checkpoint {self.filepath}, {results_filepath} is shorter than when it was saved"
+            )
+            return 0
+        return min(saved["resume_offset"], os.path.getsize(self.requests_filepath))
+
+
+class ResultWriter:
+    """Appends results to a jsonl file from a single coroutine.
+
+    Requests hand their results to `write`, which only queues the serialized
+    line. The writer coroutine owns the one file handle, writes everything
+    queued so far in one call, flushes after every batch and fsyncs at most
+    every `fsync_interval` seconds. Lines are always written whole, so
+    concurrent requests can't interleave. After every fsync the checkpoint is
+    saved, so it never points past a result that isn't on disk.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        fsync_interval: float = 5.0,
+        max_batch_size: int = 1000,
+        checkpoint: Optional[Checkpoint] = None,
+    ):
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+        self.max_batch_size = max_batch_size
+        self.checkpoint = checkpoint
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self) -> None:
+        """Open the file and start the writer coroutine."""
+        self.task = asyncio.create_task(self.run())
+
+    def write(self, data, task_id: Optional[int] = None) -> None:
+        """Queue a json payload to be appended to the file."""
+        self.queue.put_nowait((json.dumps(data) + "\n", task_id))
+
+    async def close(self) -> None:
+        """Write everything queued, fsync and close the file."""
+        self.queue.put_nowait(None)  # sentinel, queued after every result
+        await self.task
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_fsync = time.time()
+        with open(self.filename, "a") as f:
+            done = False
+            while not done:
+                # wait for one line, then take whatever else is already queued
+                batch = [await self.queue.get()]
+                while len(batch) < self.max_batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                f.write("".join(line for line, _ in batch))
+                f.flush()
+                if self.checkpoint is not None:
+                    for _, task_id in batch:
+                        self.checkpoint.pending.pop(task_id, None)
+                if done or time.time() - last_fsync >= self.fsync_interval:
+                    # fsync blocks until the disk is done, keep it off the loop
+                    await loop.run_in_executor(None, os.fsync, f.fileno())
+                    last_fsync = time.time()
+                    if self.checkpoint is not None:
+                        await loop.run_in_executor(
+                            None,
+                            self.checkpoint.save,
+                            self.checkpoint.resume_offset,
+                            f.tell(),
+                        )
+                logging.debug(f"Wrote {len(batch)} results to {self.filename}")
 
 
 # functions
 
 
-def append_to_jsonl(data, filename: str) -> None:
-    """Append a json payload to the end of a jsonl file."""
-    json_string = json.dumps(data)
-    with open(filename, "a") as f:
-        f.write(json_string + "\n")
+def load_endpoints(
+    endpoints_filepath: Optional[str],
+    base_url: Optional[str],
+    max_requests_per_minute: float,
+    max_tokens_per_minute: float,
+) -> Dict[str, Endpoint]:
+    """Create the endpoints to send requests to.
+
+    Without `endpoints_filepath` there is a single endpoint. Otherwise the file
+    is a json list with one object per endpoint, with the optional keys
+    `name`, `base_url`, `model`, `max_requests_per_minute` and
+    `max_tokens_per_minute` (missing ones default to the arguments).
+    """
+    configs = [{}]
+    if endpoints_filepath is not None:
+        with open(endpoints_filepath) as f:
+            configs = json.load(f)
+    endpoints = {}
+    for i, config in enumerate(configs):
+        name = config.get("name", f"endpoint-{i}")
+        endpoints[name] = Endpoint(
+            name=name,
+            # retries are handled here, so every 429 reaches the limiter
+            client=get_client(
+                base_url=config.get("base_url", base_url),
+                use_async=True,
+                max_retries=0,
+            ),
+            limiter=RateLimiter(
+                config.get("max_requests_per_minute", max_requests_per_minute),
+                config.get("max_tokens_per_minute", max_tokens_per_minute),
+            ),
+            model=config.get("model"),
+        )
+    return endpoints
+
+
+def request_key(request_json: dict, metadata: Optional[dict]) -> str:
+    """Identify a request across runs, by its row_id or else by its content."""
+    if metadata and "row_id" in metadata:
+        return f"row_id:{metadata['row_id']}"
+    content = json.dumps(request_json, sort_keys=True)
+    return "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_saved_requests(save_filepath: str) -> Set[str]:
+    """Index the requests whose result or errors are already in the results file.
+
+    A partial last line, left by a crash mid-write, is truncated so new results
+    start on a fresh line.
+    """
+    saved = set()
+    if not os.path.exists(save_filepath):
+        return saved
+    with open(save_filepath, "rb+") as f:
+        end = 0  # end of the last complete line
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            row = json.loads(line)
+            saved.add(request_key(row[0], row[2] if len(row) > 2 else None))
+        if end < f.tell():
+            logging.warning(f"Truncating partial last line of {save_filepath}")
+            f.truncate(end)
+    return saved
+
+
+class TokenCounter:
+    """Counts the tokens of chat requests, for the rate limiters.
+
+    Understands both this repo's requests, whose flat `prompt` is sent as one
+    user message (see convert_path_to_query.py), and the API's `messages`.
+    Prompts mostly share a long instruction prefix, so the tokens of known
+    prefixes are counted once and only the rest of a prompt is encoded.
+    """
+
+    def __init__(self, token_encoding_name: str, prefixes=(LLM_PROMPT,)):
+        self.encoding = tiktoken.get_encoding(token_encoding_name)
+        # no token spans a newline followed by a non-space character, so a
+        # prefix ending in a newline can be counted on its own
+        self.prefixes = [
+            (prefix, len(self.encoding.encode_ordinary(prefix)))
+            for prefix in prefixes
+            if prefix.endswith("\n")
+        ]
+
+    def text_tokens(self, text: str) -> int:
+        """Number of tokens `text` encodes to."""
+        for prefix, prefix_tokens in self.prefixes:
+            if text.startswith(prefix) and not text[len(prefix) : len(prefix) + 1].isspace():
+                return prefix_tokens + len(
+                    self.encoding.encode_ordinary(text[len(prefix) :])
+                )
+        return len(self.encoding.encode_ordinary(text))
+
+    def __call__(self, request_json: dict) -> int:
+        """Tokens the request will use, prompt plus n * max_tokens."""
+        messages = request_json.get("messages")
+        if messages is None:
+            messages = [{"role": "user", "content": request_json["prompt"]}]
+        num_tokens = TOKENS_PER_REPLY
+        for message in messages:
+            num_tokens += TOKENS_PER_MESSAGE
+            for key, value in message.items():
+                num_tokens += self.text_tokens(value)
+                if key == "name":
+                    num_tokens += TOKENS_PER_NAME
+        max_tokens = request_json.get("max_tokens", DEFAULT_MAX_TOKENS)
+        return num_tokens + request_json.get("n", 1) * max_tokens
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(token_encoding_name: str) -> TokenCounter:
+    """One `TokenCounter` per encoding, loading an encoding is slow."""
+    return TokenCounter(token_encoding_name)
 
 
 def num_tokens_consumed_from_request(
     request_json: dict,
     token_encoding_name: str,
 ):
-    """Count the number of tokens in the request. Only supports completion and embedding requests."""
-    encoding = tiktoken.get_encoding(token_encoding_name)
-    # if completions request, tokens = prompt + n * max_tokens
-
-    # NOTE: we only care about completions
-    if True:  # if api_endpoint.endswith("completions"):
-        max_tokens = request_json.get("max_tokens", 15)
-        n = request_json.get("n", 1)
-        completion_tokens = n * max_tokens
-
-        # chat completions
-        num_tokens = 0
-        message = request_json["prompt"]
-        num_tokens += (
-            4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-        )
-        num_tokens += len(encoding.encode(message))
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens + completion_tokens
+    """Count the number of tokens in the request. Only supports chat completion requests."""
+    return get_token_counter(token_encoding_name)(request_json)
+
+
+def count_tokens_in_lines(lines: List[bytes], token_encoding_name: str) -> List[int]:
+    """Count the tokens of requests file lines, in a worker process."""
+    return [
+        num_tokens_consumed_from_request(json.loads(line), token_encoding_name)
+        for line in lines
+    ]
+
+
+async def read_requests(
+    file,
+    token_encoding_name: str,
+    executor: Optional[ProcessPoolExecutor] = None,
+    n_chunks_ahead: int = 1,
+    chunk_size: int = 1000,
+):
+    """Read the requests file line by line, counting tokens ahead in `executor`.
+
+    Yields (request_json, tokens, line_offset, line_end) from the current
+    position of `file`; tokens is `None` without an executor, for the caller
+    to count only the requests it sends. With one, chunks of lines are counted
+    in worker processes while earlier ones are being sent.
+    """
+    offset = file.tell()
+
+    def read_chunk():
+        nonlocal offset
+        chunk = []
+        for _ in range(chunk_size if executor is not None else 1):
+            line = file.readline()
+            if not line:
+                break
+            chunk.append((offset, line))
+            offset += len(line)
+        return chunk
+
+    pending = collections.deque()  # chunks with their token counts
+    while True:
+        while len(pending) < n_chunks_ahead:
+            chunk = read_chunk()
+            if not chunk:
+                break
+            counts = None
+            if executor is not None:
+                counts = asyncio.wrap_future(
+                    executor.submit(
+                        count_tokens_in_lines,
+                        [line for _, line in chunk],
+                        token_encoding_name,
+                    )
+                )
+            pending.append((chunk, counts))
+        if not pending:
+            return
+        chunk, counts = pending.popleft()
+        tokens = await counts if counts is not None else [None] * len(chunk)
+        for (line_offset, line), line_tokens in zip(chunk, tokens):
+            yield json.loads(line), line_tokens, line_offset, line_offset + len(line)
 
 
 def task_id_generator_function():
@@ -403,6 +856,13 @@ if __name__ == "__main__":
     parser.add_argument("--token_encoding_name", default="cl100k_base")
     parser.add_argument("--max_attempts", type=int, default=5)
     parser.add_argument("--logging_level", default=logging.INFO)
+    parser.add_argument("--base_url", default=None)
+    parser.add_argument("--fsync_interval", type=float, default=5.0)
+    parser.add_argument("--endpoints_filepath", default=None)
+    parser.add_argument("--max_requests_in_flight", type=int, default=100)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--cache_filepath", default=None)
+    parser.add_argument("--token_count_workers", type=int, default=0)
     args = parser.parse_args()
 
     if args.save_filepath is None:
@@ -418,6 +878,13 @@ if __name__ == "__main__":
             token_encoding_name=args.token_encoding_name,
             max_attempts=int(args.max_attempts),
             logging_level=int(args.logging_level),
+            base_url=args.base_url,
+            fsync_interval=args.fsync_interval,
+            endpoints_filepath=args.endpoints_filepath,
+            max_requests_in_flight=args.max_requests_in_flight,
+            resume=args.resume,
+            cache_filepath=args.cache_filepath,
+            token_count_workers=args.token_count_workers,
         )
     )
 
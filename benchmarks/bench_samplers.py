@@ -0,0 +1,401 @@
+"""Benchmark the path samplers on a synthetic knowledge graph.
+
+Runs every sampler on the same reproducibly generated graph (see
+`benchmarks/synthetic_kg.py`) and writes a JSON report which can be diffed
+between commits. Each sampler runs in its own process so peak RSS is measured
+per sampler.
+
+Reported per sampler:
+- `samples_per_sec`: full-length paths per second, excluding the time to load
+  the graph (reported separately as `load_seconds`)
+- `latency_ms`: p50/p99/mean/max time per sampled path
+- `peak_rss_mb`: peak resident memory of the sampler's process
+- `restart_rate`: restarts (dead ends) per returned path
+- `hop_degree_histograms`: per hop, counts of the in-degree of the item
+  reached, bucketed by powers of two
+
+Samplers:
+- `parallel_path_sampling`: `parallel_path_sampling.sample` on the sqlite3 db
+- `random_sample`: `graph/random_sample.sample` on the networkx pickle
+- `wikidata5m_random_walk`: `wikidata5m.samplers.RandomWalk` on the sqlite3 db
+- `engine_sqlite`/`engine_csr`: `utils.sampling.sample_path` over
+  `SQLiteBackend`/memory-mapped `CSRBackend`
+- `random_walk2`: `RandomWalk2.random_walk_batch`, only with `--yago-endpoint`
+  and `--yago-db` since it needs a running SPARQL endpoint
+
+Usage (from the repository root):
+`python -m benchmarks.bench_samplers OUT_JSON [--n-items N] [--n-edges N] [--samplers a b]`
+"""
+
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from benchmarks.synthetic_kg import KGConfig, write_pickle, write_sqlite
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLERS = [
+    "parallel_path_sampling",
+    "random_sample",
+    "wikidata5m_random_walk",
+    "engine_sqlite",
+    "engine_csr",
+    "random_walk2",
+]
+
+# (items, properties, restarts) of one sampled path
+Sample = Tuple[List[str], List[str], int]
+
+
+def _parallel_path_sampling(files: Dict[str, str], config: Dict) -> Callable[[], List[Sample]]:
+    from parallel_path_sampling import sample
+
+    def run():
+        log = []
+        path, props = sample(
+            files["db"],
+            config["n_hops"],
+            config["c"],
+            bad_prop_ids=set(config["bad_props"]),
+            log=log,
+        )
+        return [([i[0] for i in path], [p[0] for p in props], log.count("restarting"))]
+
+    return run
+
+
+def _random_sample(files: Dict[str, str], config: Dict) -> Callable[[], List[Sample]]:
+    from graph.random_sample import sample
+
+    with open(files["pickle"], "rb") as f:
+        G, _ = pickle.load(f)
+
+    def run():
+        log = []
+        path, props = sample(
+            G, config["n_hops"], config["c"], set(config["bad_props"]), log=log
+        )
+        return [(path, props, log.count("restarting"))]
+
+    return run
+
+
+def _wikidata5m_random_walk(files: Dict[str, str], config: Dict) -> Callable[[], List[Sample]]:
+    sys.path.insert(0, os.path.join(ROOT, "carter_experiments"))
+    from wikidata5m.filters import BadPropertyFilter
+    from wikidata5m.samplers import RandomWalk
+    from wikidata5m.utils import WikidataDB
+
+    sampler = RandomWalk(
+        WikidataDB(files["wikidata5m_db"]),
+        config["n_hops"],
+        property_filters=[BadPropertyFilter()],
+    )
+
+    def run():
+        # `RandomWalk` returns a short path on a dead end, count it as a restart
+        restarts = 0
+        while True:
+            claims = sampler.sample()
+            if len(claims) == config["n_hops"]:
+                break
+            restarts += 1
+        items = [claims[0].subject_id] + [c.target_id for c in claims]
+        return [(items, [c.property_id for c in claims], restarts)]
+
+    return run
+
+
+def _engine(kind: str):
+    def make(files: Dict[str, str], config: Dict) -> Callable[[], List[Sample]]:
+        from utils.backends import CSRBackend, SQLiteBackend
+        from utils.sampling import sample_path
+
+        if kind == "csr":
+            backend = CSRBackend.load(files["csr"], mmap=True)
+        else:
+            backend = SQLiteBackend(files["db"])
+        rng = np.random.default_rng(config["seed"])
+
+        def run():
+            log = []
+            path, props = sample_path(
+                backend,
+                config["n_hops"],
+                config["c"],
+                bad_prop_ids=set(config["bad_props"]),
+                rng=rng,
+                log=log,
+            )
+            return [(path, props, log.count("restarting"))]
+
+        return run
+
+    return make
+
+
+def _random_walk2(files: Dict[str, str], config: Dict) -> Callable[[], List[Sample]]:
+    from yago.db.yagodb import YagoDB
+    from yago.utils.random_walk2 import RandomWalk2
+
+    walker = RandomWalk2(YagoDB(files["yago_db"]), yago_endpoint_url=files["yago_endpoint"])
+    depth = config["n_hops"] + 1
+
+    def run():
+        df = walker.random_walk_batch(num_of_entities=config["batch_size"], depth=depth)
+        samples = []
+        for _, row in df.iterrows():
+            items = [row[f"entity{i}"] for i in range(depth)]
+            props = [row[f"predicate{i+1}"] for i in range(depth - 1)]
+            # rows where a hop found no neighbour are dead ends
+            restarts = int(any(x is None for x in items))
+            samples.append((items, props, restarts))
+        return samples
+
+    return run
+
+
+RUNNERS = {
+    "parallel_path_sampling": _parallel_path_sampling,
+    "random_sample": _random_sample,
+    "wikidata5m_random_walk": _wikidata5m_random_walk,
+    "engine_sqlite": _engine("sqlite"),
+    "engine_csr": _engine("csr"),
+    "random_walk2": _random_walk2,
+}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_sampler(name: str, files: Dict[str, str], config: Dict) -> Dict:
+    """Run one sampler and collect its metrics.
+
+    Meant to be run in a fresh process (see `main`), so `peak_rss_mb` only
+    includes this sampler.
+
+    Args:
+    - name: key of `RUNNERS`
+    - files: paths of the generated graph files
+    - config: benchmark config (`n_samples`, `n_hops`, `c`, `seed`, ...)
+
+    Returns:
+    - metrics and sampled paths
+    """
+    sys.path.insert(0, ROOT)
+    random.seed(config["seed"])
+    np.random.seed(config["seed"])
+
+    t = time.perf_counter()
+    run = RUNNERS[name](files, config)
+    load_seconds = time.perf_counter() - t
+
+    latencies, samples = [], []
+    t_start = time.perf_counter()
+    while len(samples) < config["n_samples"]:
+        t = time.perf_counter()
+        batch = run()
+        elapsed = time.perf_counter() - t
+        latencies.extend([elapsed / max(len(batch), 1)] * len(batch))
+        samples.extend(batch)
+    seconds = time.perf_counter() - t_start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "load_seconds": load_seconds,
+        "seconds": seconds,
+        "n_samples": len(samples),
+        "samples_per_sec": len(samples) / seconds if seconds else float("inf"),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "mean": float(latencies_ms.mean()),
+            "max": float(latencies_ms.max()),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "restart_rate": sum(s[2] for s in samples) / len(samples),
+        "paths": [(s[0], s[1]) for s in samples],
+    }
+
+
+def hop_degree_histograms(
+    paths: List[Tuple[List[str], List[str]]], in_degree: Dict[str, int]
+) -> List[List[List[int]]]:
+    """Histogram the in-degree of the item reached at every hop.
+
+    Args:
+    - paths: sampled `(items, properties)`
+    - in_degree: in-degree of each item id
+
+    Returns:
+    - per hop (0 = starting item), sorted `[min_degree, count]` pairs, where
+      a bucket holds degrees in `[min_degree, 2 * min_degree)` (or exactly 0)
+    """
+    n_positions = max((len(items) for items, _ in paths), default=0)
+    histograms = [dict() for _ in range(n_positions)]
+    for items, _ in paths:
+        for hop, item in enumerate(items):
+            if item not in in_degree:
+                continue
+            deg = in_degree[item]
+            bucket = 0 if deg == 0 else 2 ** int(math.log2(deg))
+            histograms[hop][bucket] = histograms[hop].get(bucket, 0) + 1
+    return [[[b, n] for b, n in sorted(h.items())] for h in histograms]
+
+
+def build_graph(out_dir: str, config: Dict) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """Generate the synthetic graph in every format the samplers need.
+
+    Args:
+    - out_dir: directory to write the files to
+    - config: benchmark config (`n_items`, `n_edges`, `n_props`, `seed`)
+
+    Returns:
+    - tuple of:
+        - paths of the generated files
+        - in-degree of each item id
+    """
+    from utils.backends import CSRBackend
+
+    kg_config = KGConfig(
+        n_items=config["n_items"],
+        n_edges=config["n_edges"],
+        n_props=config["n_props"],
+        seed=config["seed"],
+    )
+    files = {
+        "db": os.path.join(out_dir, "kg.db"),
+        "wikidata5m_db": os.path.join(out_dir, "kg_wikidata5m.db"),
+        "pickle": os.path.join(out_dir, "kg.pkl"),
+        "csr": os.path.join(out_dir, "csr"),
+    }
+    write_sqlite(kg_config, files["db"])
+    write_sqlite(kg_config, files["wikidata5m_db"], in_degree_column=False)
+    write_pickle(kg_config, files["pickle"])
+    csr = CSRBackend.from_sqlite(files["db"])
+    csr.save(files["csr"])
+    in_degree = dict(zip(csr.node_ids.tolist(), csr.in_degree.tolist()))
+    return files, in_degree
+
+
+def git_commit() -> str:
+    """Current commit of the repository, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def main(args):
+    config = {
+        "n_items": args.n_items,
+        "n_edges": args.n_edges,
+        "n_props": args.n_props,
+        "n_samples": args.n_samples,
+        "n_hops": args.n_hops,
+        "c": args.c,
+        "bad_props": args.bad_props.split(" "),
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+    }
+    samplers = args.samplers or [s for s in SAMPLERS if s != "random_walk2"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = args.graph_dir or tmp_dir
+        os.makedirs(out_dir, exist_ok=True)
+        print(f"generating graph in {out_dir}")
+        files, in_degree = build_graph(out_dir, config)
+        if args.yago_endpoint and args.yago_db:
+            files["yago_endpoint"] = args.yago_endpoint
+            files["yago_db"] = args.yago_db
+            if "random_walk2" not in samplers:
+                samplers.append("random_walk2")
+
+        results = {}
+        ctx = multiprocessing.get_context("spawn")
+        for name in samplers:
+            if name == "random_walk2" and "yago_db" not in files:
+                results[name] = {"skipped": "needs --yago-endpoint and --yago-db"}
+                continue
+            print(f"running {name}")
+            with ctx.Pool(1) as pool:
+                try:
+                    result = pool.apply(run_sampler, (name, files, config))
+                except Exception as e:
+                    results[name] = {"error": repr(e)}
+                    continue
+            paths = result.pop("paths")
+            result["hop_degree_histograms"] = hop_degree_histograms(paths, in_degree)
+            results[name] = result
+            print(
+                f"  {result['samples_per_sec']:.1f} samples/sec, "
+                f"p50 {result['latency_ms']['p50']:.2f} ms, "
+                f"p99 {result['latency_ms']['p99']:.2f} ms, "
+                f"peak rss {result['peak_rss_mb']:.0f} MB"
+            )
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": config,
+        "results": results,
+    }
+    with open(args.out_file, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"results written to {args.out_file}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("out_file", type=str, help="path to output json file")
+    parser.add_argument("--n-items", type=int, default=10000, help="number of items")
+    parser.add_argument("--n-edges", type=int, default=100000, help="number of claims")
+    parser.add_argument("--n-props", type=int, default=50, help="number of properties")
+    parser.add_argument("--n-samples", type=int, default=500, help="paths per sampler")
+    parser.add_argument(
+        "--n-hops", type=int, default=3, help="number of hops per sample"
+    )
+    parser.add_argument("--c", type=float, default=0.3, help="normalization parameter")
+    parser.add_argument(
+        "--bad-props",
+        type=str,
+        default="P31 P1343 P279",
+        help="bad properties, space-separated",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--samplers", type=str, nargs="*", choices=SAMPLERS, help="samplers to run"
+    )
+    parser.add_argument(
+        "--graph-dir", type=str, default=None, help="keep the generated graph here"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=10, help="batch size for random_walk2"
+    )
+    parser.add_argument("--yago-endpoint", type=str, default=None, help="YAGO SPARQL endpoint")
+    parser.add_argument("--yago-db", type=str, default=None, help="YAGO sqlite3 db")
+    args = parser.parse_args()
+    main(args)
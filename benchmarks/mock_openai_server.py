@@ -0,0 +1,346 @@
+"""Local stand-in for the OpenAI/Azure OpenAI chat completions API.
+
+Lets the LLM stages (`api_request_parallel_processor.py`, `generate.py`,
+`graph/generate_questions.py`, `utils/openai_helpers.py`) be load-tested and
+regression-tested offline. Every entry point takes a base URL (`--base-url`,
+or `OPENAI_BASE_URL` in `.env` for `utils/openai_helpers.py`) which replaces
+the Azure endpoint, so the real Azure client code path is exercised.
+
+Serves `POST .../chat/completions`, which covers both the OpenAI path
+(`/v1/chat/completions`) and the Azure one
+(`/openai/deployments/<model>/chat/completions?api-version=...`), and
+`GET /stats` for the counters below. Behaviour:
+- latency: drawn per request from `--latency`, one of `fixed:S`,
+  `uniform:LOW,HIGH`, `exponential:MEAN` or `lognormal:MEDIAN,SIGMA` (seconds)
+- 429s: returned with probability `--error-rate`, and for every request over
+  `--max-requests-per-minute` in a sliding 60 second window, with a
+  `Retry-After` header
+- answers: deterministic per prompt, picked by hash from `--answers` (a json
+  list of strings) or built from the prompt's last line
+- usage: `prompt_tokens`/`completion_tokens` estimated at ~4 characters per
+  token, so token budgets can be checked without tiktoken
+
+Usage (from the repository root):
+`python -m benchmarks.mock_openai_server [--port 8000] [--latency lognormal:0.8,0.5] [--error-rate 0.05]`
+
+then e.g. `python generate.py kg.db out.csv 100 --base-url http://127.0.0.1:8000`
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock server."""
+
+    latency: str = "fixed:0"
+    error_rate: float = 0.0
+    max_requests_per_minute: float = float("inf")
+    retry_after: float = 1.0
+    answers: Optional[List[str]] = None
+    seed: int = 0
+
+
+@dataclass
+class MockStats:
+    """Counters reported by `GET /stats`."""
+
+    requests: int = 0
+    completions: int = 0
+    rate_limited: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    started: float = field(default_factory=time.time)
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """Parse a latency distribution.
+
+    Args:
+    - spec: `fixed:S`, `uniform:LOW,HIGH`, `exponential:MEAN` or
+      `lognormal:MEDIAN,SIGMA`, in seconds
+    - rng: random generator to draw from
+
+    Returns:
+    - function drawing one latency in seconds
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "exponential" and len(values) == 1:
+        return lambda: rng.expovariate(1 / values[0]) if values[0] else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        return lambda: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"invalid latency distribution: {spec}")
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count, ~4 characters per token."""
+    return max(1, len(text) // 4)
+
+
+class MockOpenAIServer:
+    """Asyncio HTTP/1.1 server answering chat completion requests."""
+
+    def __init__(self, config: MockConfig):
+        """Instantiate the server, `start` binds it.
+
+        Args:
+        - config: behaviour of the server
+        """
+        self.config = config
+        self.stats = MockStats()
+        self._rng = random.Random(config.seed)
+        self._latency = parse_latency(config.latency, self._rng)
+        self._window: deque = deque()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start listening, port 0 picks a free port.
+
+        Returns:
+        - base url of the server
+        """
+        self._server = await asyncio.start_server(self._handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # clients keep idle connections alive, drop them
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def answer(self, prompt: str) -> str:
+        """Deterministic answer for a prompt."""
+        digest = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+        if self.config.answers:
+            return self.config.answers[digest % len(self.config.answers)]
+        lines = [line for line in prompt.strip().splitlines() if line.strip()]
+        subject = lines[-1].strip() if lines else "nothing"
+        return f"What is the answer to '{subject[:80]}'? (#{digest % 10000:04d})"
+
+    def _rate_limited(self) -> bool:
+        now = time.monotonic()
+        while self._window and now - self._window[0] >= 60.0:
+            self._window.popleft()
+        if len(self._window) >= self.config.max_requests_per_minute:
+            return True
+        if self._rng.random() < self.config.error_rate:
+            return True
+        self._window.append(now)
+        return False
+
+    async def _complete(self, path: str, body: bytes) -> Tuple[int, Dict]:
+        self.stats.requests += 1
+        if not path.endswith("/chat/completions"):
+            return 404, {"error": {"code": "404", "message": f"no route {path}"}}
+        try:
+            request = json.loads(body)
+            messages = request["messages"]
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": {"code": "400", "message": f"bad request: {e}"}}
+        if self._rate_limited():
+            self.stats.rate_limited += 1
+            return 429, {
+                "error": {
+                    "code": "429",
+                    "message": "Requests to the ChatCompletions operation have "
+                    "exceeded the rate limit of the mock server.",
+                }
+            }
+
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            await asyncio.sleep(max(self._latency(), 0.0))
+        finally:
+            self.stats.in_flight -= 1
+
+        prompt = "\n".join(str(m.get("content") or "") for m in messages)
+        content = self.answer(prompt)
+        # every message is wrapped in <im_start>{role}\n{content}<im_end>\n
+        prompt_tokens = 2 + sum(
+            count_tokens(str(m.get("content") or "")) + 4 for m in messages
+        )
+        completion_tokens = count_tokens(content)
+        self.stats.completions += 1
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.completion_tokens += completion_tokens
+        return 200, {
+            "id": f"chatcmpl-mock-{self.stats.completions}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # one connection, several requests while the client keeps it alive
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = target.split("?", 1)[0]
+
+                if method == "GET" and path == "/stats":
+                    status, payload = 200, asdict(self.stats)
+                elif method == "POST":
+                    status, payload = await self._complete(path, body)
+                else:
+                    status, payload = 404, {"error": {"code": "404", "message": path}}
+
+                data = json.dumps(payload).encode()
+                response = [
+                    f"HTTP/1.1 {status} {REASONS[status]}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(data)}",
+                ]
+                if status == 429:
+                    response.append(f"Retry-After: {self.config.retry_after:g}")
+                    response.append(
+                        f"retry-after-ms: {int(self.config.retry_after * 1000)}"
+                    )
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+
+@contextmanager
+def run_in_thread(
+    config: MockConfig, host: str = "127.0.0.1", port: int = 0
+) -> Iterator[MockOpenAIServer]:
+    """Run a server on its own event loop thread, e.g. inside a test.
+
+    Args:
+    - config: behaviour of the server
+    - host: interface to bind
+    - port: port to bind, a free one by default
+
+    Returns:
+    - the running server, its base url is `server.url`
+    """
+    server = MockOpenAIServer(config)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(host, port), loop).result()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+async def serve(config: MockConfig, host: str, port: int) -> None:
+    server = MockOpenAIServer(config)
+    url = await server.start(host, port)
+    print(f"mock OpenAI server listening on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        print(json.dumps(asdict(server.stats)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency",
+        type=str,
+        default="lognormal:0.8,0.5",
+        help="latency distribution, e.g. fixed:0.5, uniform:0.2,1.5, "
+        "exponential:0.8 or lognormal:0.8,0.5 (seconds)",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="probability of a 429"
+    )
+    parser.add_argument(
+        "--max-requests-per-minute",
+        type=float,
+        default=float("inf"),
+        help="answer 429 above this rate",
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="Retry-After of 429s"
+    )
+    parser.add_argument(
+        "--answers", type=str, default=None, help="json file with a list of answers"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    answers = None
+    if args.answers is not None:
+        with open(args.answers) as f:
+            answers = json.load(f)
+    config = MockConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        max_requests_per_minute=args.max_requests_per_minute,
+        retry_after=args.retry_after,
+        answers=answers,
+        seed=args.seed,
+    )
+    try:
+        asyncio.run(serve(config, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,441 @@
+"""Reproducible synthetic knowledge graphs for benchmarking.
+
+Generates a scale-free graph shaped like Wikidata5m, so pipelines can be
+benchmarked on a laptop or in CI without the multi-GB downloads:
+
+- out- and in-degrees follow power laws (finite Zipf over item ranks), with
+  the hubs spread over random ids
+- property frequencies follow a power law; a fraction of properties are
+  multi-valued (a subject has several targets for the same property)
+- every item is an instance (`P31`) of a class, and classes form a
+  `P279` subclass hierarchy, so the `P31`/`P279` hubs the samplers filter out
+  are present
+- `P1343` ("described by source") is the most frequent relation
+- a small fraction of items/properties have no name, as in the dump
+
+Claims are generated in fixed-size chunks seeded by `(seed, chunk index)`, so
+every output format sees the same graph without holding it in memory, and
+sizes from 10K to 50M edges are supported.
+
+Formats (`--formats`):
+- `sqlite`: the Wikidata5m sqlite3 schema (`items`/`claims`/`properties`),
+  with in-degree as the fourth column of `items` (`kg.db`) and without it for
+  `wikidata5m.utils.WikidataDB` (`kg_wikidata5m.db`)
+- `parse_graph`: the inputs of `graph/parse_graph.py`, a Wikidata5m triplet file
+  (`claims.txt`) and a `graph/parse_dump.py`-style dump (`parsed_dump.nt`)
+- `pickle`: the `(G, aliases)` pickle written by `graph/parse_graph.py`
+  (`kg.pkl`, only sensible for small graphs)
+- `ttl`: YAGO-style Turtle for `yago/db/insert_entities.py` (`kg.ttl`)
+
+Usage: `python -m benchmarks.synthetic_kg OUT_DIR [--n-items N] [--n-edges N] [--formats ...]`
+"""
+
+import os
+import pickle
+import sqlite3
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+INSTANCE_OF = "P31"
+SUBCLASS_OF = "P279"
+DESCRIBED_BY = "P1343"
+
+WIKIDATA_ENTITY = "http://www.wikidata.org/entity/"
+YAGO_RESOURCE = "http://yago-knowledge.org/resource/"
+
+FORMATS = ["sqlite", "parse_graph", "pickle", "ttl"]
+
+
+@dataclass
+class KGConfig:
+    """Parameters of a synthetic graph. The same config gives the same graph."""
+
+    n_items: int = 10000
+    n_edges: int = 100000
+    n_props: int = 50
+    n_classes: int = 0  # defaults to ~1% of items
+    out_zipf_s: float = 0.6  # rank exponent of subjects
+    in_zipf_s: float = 1.0  # rank exponent of targets (in-degree)
+    prop_zipf_s: float = 1.1  # rank exponent of relational properties
+    multi_valued_rate: float = 0.3  # fraction of properties which are multi-valued
+    missing_name_rate: float = 0.01  # fraction of items/properties without a name
+    seed: int = 0
+    chunk_size: int = 1000000
+
+    def __post_init__(self):
+        if not self.n_classes:
+            self.n_classes = max(2, self.n_items // 100)
+
+    def prop_ids(self) -> List[str]:
+        """Ids of all properties, `P31`/`P279`/`P1343` first."""
+        special = [INSTANCE_OF, SUBCLASS_OF, DESCRIBED_BY]
+        ids = list(special)
+        i = 1
+        while len(ids) < max(self.n_props, len(special) + 1):
+            if f"P{i}" not in special:
+                ids.append(f"P{i}")
+            i += 1
+        return ids
+
+    def multi_valued(self) -> np.ndarray:
+        """Whether each property in `prop_ids` is multi-valued."""
+        rng = np.random.default_rng([self.seed, 1])
+        flags = rng.random(len(self.prop_ids())) < self.multi_valued_rate
+        flags[:2] = [False, True]  # one class per item, several superclasses
+        flags[2] = True
+        return flags
+
+    def named(self, n: int, stream: int) -> np.ndarray:
+        """Whether each of `n` items (`stream=2`) or properties (`stream=3`) has a name."""
+        rng = np.random.default_rng([self.seed, stream])
+        flags = rng.random(n) >= self.missing_name_rate
+        if stream == 3:
+            flags[:3] = True
+        return flags
+
+
+def iter_claims(config: KGConfig) -> Iterator[np.ndarray]:
+    """Generate the claims of the graph in chunks.
+
+    Items are numbered `0 .. n_items - 1` (`Q0`, `Q1`, ...), the first
+    `n_classes` being the classes. Properties are numbered by their index in
+    `config.prop_ids()`.
+
+    Args:
+    - config: graph parameters
+
+    Returns:
+    - iterator of `(k, 3)` int64 arrays of `(subject, property, target)`,
+      `n_edges` claims in total (minus self-loops)
+    """
+    rng = np.random.default_rng([config.seed, 0])
+    out_perm = rng.permutation(config.n_items)
+    in_perm = rng.permutation(config.n_items)
+    class_perm = rng.permutation(config.n_classes)
+    multi_valued = config.multi_valued()
+    n_props = len(multi_valued)
+    out_cdf = _zipf_cdf(config.n_items, config.out_zipf_s)
+    in_cdf = _zipf_cdf(config.n_items, config.in_zipf_s)
+    class_cdf = _zipf_cdf(config.n_classes, config.in_zipf_s)
+    # P31/P279 are generated separately
+    prop_cdf = _zipf_cdf(n_props - 2, config.prop_zipf_s)
+
+    # P31 for (up to) every item, P279 for every class, the rest relational
+    n_instance = min(config.n_items, config.n_edges // 4)
+    n_subclass = min(config.n_classes, config.n_edges // 20)
+    n_relational = config.n_edges - n_instance - n_subclass
+
+    chunk = 0
+    for start in range(0, n_instance, config.chunk_size):
+        chunk_rng = np.random.default_rng([config.seed, 10, chunk])
+        subjects = np.arange(start, min(start + config.chunk_size, n_instance))
+        classes = class_perm[_draw(chunk_rng, class_cdf, len(subjects))]
+        yield _claims(subjects, 0, classes)
+        chunk += 1
+
+    sub_rng = np.random.default_rng([config.seed, 11])
+    subjects = np.arange(n_subclass)
+    parents = class_perm[_draw(sub_rng, class_cdf, n_subclass)]
+    yield _claims(subjects, 1, parents)
+
+    for chunk, start in enumerate(range(0, n_relational, config.chunk_size)):
+        chunk_rng = np.random.default_rng([config.seed, 12, chunk])
+        n = min(config.chunk_size, n_relational - start)
+        subjects = out_perm[_draw(chunk_rng, out_cdf, n)]
+        # P1343 is the most frequent relation
+        props = 2 + _draw(chunk_rng, prop_cdf, n)
+        # multi-valued properties get extra targets for the same subject
+        repeats = np.where(multi_valued[props], chunk_rng.geometric(0.5, n), 1)
+        subjects = np.repeat(subjects, repeats)[:n]
+        props = np.repeat(props, repeats)[:n]
+        targets = in_perm[_draw(chunk_rng, in_cdf, n)]
+        yield _claims(subjects, props, targets)
+
+
+def _zipf_cdf(n: int, s: float) -> np.ndarray:
+    """CDF of a finite Zipf distribution, `p(rank k) ~ k ** -s` for `k = 1 .. n`."""
+    cdf = np.cumsum(np.arange(1, n + 1, dtype=np.float64) ** -s)
+    return cdf / cdf[-1]
+
+
+def _draw(rng: np.random.Generator, cdf: np.ndarray, size: int) -> np.ndarray:
+    """Draw `size` ranks (0-indexed) from `cdf`."""
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def _claims(subjects: np.ndarray, props, targets: np.ndarray) -> np.ndarray:
+    """Stack claim columns, dropping self-loops."""
+    props = np.broadcast_to(props, subjects.shape)
+    claims = np.stack([subjects, props, targets], axis=1).astype(np.int64)
+    return claims[claims[:, 0] != claims[:, 2]]
+
+
+def generate_triples(
+    n_items: int,
+    n_edges: int,
+    n_props: int = 50,
+    seed: int = 0,
+    **kwargs,
+) -> List[Tuple[str, str, str]]:
+    """Generate all claims as string triples (for small graphs).
+
+    Args:
+    - n_items: number of items, ids are `Q0`, `Q1`, ...
+    - n_edges: number of claims
+    - n_props: number of properties
+    - seed: random seed
+    - kwargs: other `KGConfig` fields
+
+    Returns:
+    - list of `(subject, property, target)`
+    """
+    config = KGConfig(n_items=n_items, n_edges=n_edges, n_props=n_props, seed=seed, **kwargs)
+    prop_ids = config.prop_ids()
+    return [
+        (f"Q{s}", prop_ids[p], f"Q{o}")
+        for claims in iter_claims(config)
+        for s, p, o in claims.tolist()
+    ]
+
+
+def write_sqlite(config: KGConfig, path: str, in_degree_column: bool = True) -> None:
+    """Write the Wikidata5m sqlite3 db.
+
+    Args:
+    - config: graph parameters
+    - path: path of the db, overwritten if it exists
+    - in_degree_column: add the in-degree as the fourth column of `items`
+      (read by `generate.py`/`parallel_path_sampling.py`); the
+      `wikidata5m.utils.WikidataDB` helper expects it to be absent
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    curr = conn.cursor()
+    curr.execute("PRAGMA journal_mode = OFF")
+    curr.execute("PRAGMA synchronous = OFF")
+    curr.execute(
+        f"""
+        CREATE TABLE items (
+            item_id TEXT PRIMARY KEY,
+            item_alias TEXT NOT NULL,
+            item_description TEXT{', in_degree INTEGER' if in_degree_column else ''}
+        )
+    """
+    )
+    curr.execute(
+        """
+        CREATE TABLE properties (
+            property_id TEXT PRIMARY KEY,
+            property_alias TEXT NOT NULL
+        )
+    """
+    )
+    curr.execute(
+        """
+        CREATE TABLE claims (
+            claim_id INTEGER PRIMARY KEY,
+            subject_id TEXT,
+            property_id TEXT,
+            target_id TEXT
+        )
+    """
+    )
+    prop_ids = config.prop_ids()
+    in_degree = np.zeros(config.n_items, dtype=np.int64)
+    for claims in iter_claims(config):
+        in_degree += np.bincount(claims[:, 2], minlength=config.n_items)
+        curr.executemany(
+            "INSERT INTO claims (subject_id, property_id, target_id) VALUES (?, ?, ?)",
+            ((f"Q{s}", prop_ids[p], f"Q{o}") for s, p, o in claims.tolist()),
+        )
+    if in_degree_column:
+        curr.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?)",
+            (
+                (f"Q{i}", item_name(i), item_description(i), d)
+                for i, d in enumerate(in_degree.tolist())
+            ),
+        )
+    else:
+        curr.executemany(
+            "INSERT INTO items VALUES (?, ?, ?)",
+            ((f"Q{i}", item_name(i), item_description(i)) for i in range(config.n_items)),
+        )
+    curr.executemany(
+        "INSERT INTO properties VALUES (?, ?)",
+        ((p, property_name(p)) for p in prop_ids),
+    )
+    curr.execute("CREATE INDEX claims_subject_index ON claims(subject_id)")
+    curr.execute("CREATE INDEX claims_target_index ON claims(target_id)")
+    conn.commit()
+    conn.close()
+
+
+def write_parse_graph_inputs(config: KGConfig, claim_path: str, dump_path: str) -> None:
+    """Write the inputs of `graph/parse_graph.py`.
+
+    Args:
+    - config: graph parameters
+    - claim_path: Wikidata5m-style tab separated triplet file
+    - dump_path: names/descriptions in the N-Triples format kept by
+      `graph/parse_dump.py`; items/properties without a name are left out
+    """
+    prop_ids = config.prop_ids()
+    with open(claim_path, "w") as f:
+        for claims in iter_claims(config):
+            f.write(
+                "".join(f"Q{s}\t{prop_ids[p]}\tQ{o}\n" for s, p, o in claims.tolist())
+            )
+
+    def lines(entity_id: str, name: str, description: str) -> str:
+        subject = f"<{WIKIDATA_ENTITY}{entity_id}>"
+        return (
+            f'{subject} <http://schema.org/name> "{name}"@en .\n'
+            f'{subject} <http://schema.org/description> "{description}"@en .\n'
+        )
+
+    with open(dump_path, "w") as f:
+        named_props = config.named(len(prop_ids), 3)
+        for p, named in zip(prop_ids, named_props):
+            if named:
+                f.write(lines(p, property_name(p), f"description of {property_name(p)}"))
+        named_items = config.named(config.n_items, 2)
+        for start in range(0, config.n_items, config.chunk_size):
+            f.write(
+                "".join(
+                    lines(f"Q{i}", item_name(i), item_description(i))
+                    for i in range(start, min(start + config.chunk_size, config.n_items))
+                    if named_items[i]
+                )
+            )
+
+
+def write_pickle(config: KGConfig, path: str) -> None:
+    """Write the `(G, aliases)` pickle produced by `graph/parse_graph.py`.
+
+    Args:
+    - config: graph parameters
+    - path: path of the pickle
+    """
+    import networkx as nx
+
+    prop_ids = config.prop_ids()
+    G = nx.DiGraph()
+    for claims in iter_claims(config):
+        G.add_edges_from(
+            (f"Q{s}", f"Q{o}", {"id": prop_ids[p]}) for s, p, o in claims.tolist()
+        )
+    aliases = {
+        node: {"name": item_name(int(node[1:])), "description": item_description(int(node[1:]))}
+        for node in G.nodes
+    }
+    for p in prop_ids:
+        aliases[p] = {"name": property_name(p), "description": f"description of {property_name(p)}"}
+    with open(path, "wb") as f:
+        pickle.dump((G, aliases), f)
+
+
+def write_ttl(config: KGConfig, path: str) -> None:
+    """Write YAGO-style Turtle, one `subject predicate object .` per line.
+
+    Items are `yago:Q<i>` and properties `yago:P<i>`, with an `rdfs:label` per
+    item, which is the line format read by `yago/db/insert_entities.py`.
+
+    Args:
+    - config: graph parameters
+    - path: path of the ttl file
+    """
+    prop_ids = config.prop_ids()
+    with open(path, "w") as f:
+        f.write(f"@prefix yago: <{YAGO_RESOURCE}> .\n")
+        f.write("@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n")
+        for claims in iter_claims(config):
+            f.write(
+                "".join(
+                    f"yago:Q{s} yago:{prop_ids[p]} yago:Q{o} .\n"
+                    for s, p, o in claims.tolist()
+                )
+            )
+        for start in range(0, config.n_items, config.chunk_size):
+            f.write(
+                "".join(
+                    f'yago:Q{i} rdfs:label "{item_name(i).replace(" ", "_")}"@en .\n'
+                    for i in range(start, min(start + config.chunk_size, config.n_items))
+                )
+            )
+
+
+def item_name(i: int) -> str:
+    return f"item {i}"
+
+
+def item_description(i: int) -> str:
+    return f"description of item {i}"
+
+
+def property_name(property_id: str) -> str:
+    return {
+        INSTANCE_OF: "instance of",
+        SUBCLASS_OF: "subclass of",
+        DESCRIBED_BY: "described by source",
+    }.get(property_id, f"property {property_id[1:]}")
+
+
+def main(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    config = KGConfig(
+        n_items=args.n_items,
+        n_edges=args.n_edges,
+        n_props=args.n_props,
+        multi_valued_rate=args.multi_valued_rate,
+        seed=args.seed,
+    )
+    formats = args.formats or ["sqlite", "parse_graph"]
+    if "sqlite" in formats:
+        print("writing sqlite")
+        write_sqlite(config, os.path.join(args.out_dir, "kg.db"))
+        write_sqlite(
+            config, os.path.join(args.out_dir, "kg_wikidata5m.db"), in_degree_column=False
+        )
+    if "parse_graph" in formats:
+        print("writing parse_graph inputs")
+        write_parse_graph_inputs(
+            config,
+            os.path.join(args.out_dir, "claims.txt"),
+            os.path.join(args.out_dir, "parsed_dump.nt"),
+        )
+    if "pickle" in formats:
+        print("writing pickle")
+        write_pickle(config, os.path.join(args.out_dir, "kg.pkl"))
+    if "ttl" in formats:
+        print("writing ttl")
+        write_ttl(config, os.path.join(args.out_dir, "kg.ttl"))
+    print(f"wrote {args.n_edges} claims to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("out_dir", type=str, help="directory for the generated files")
+    parser.add_argument("--n-items", type=int, default=10000, help="number of items")
+    parser.add_argument("--n-edges", type=int, default=100000, help="number of claims")
+    parser.add_argument("--n-props", type=int, default=50, help="number of properties")
+    parser.add_argument(
+        "--multi-valued-rate",
+        type=float,
+        default=0.3,
+        help="fraction of multi-valued properties",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="*",
+        choices=FORMATS,
+        help="formats to write, defaults to sqlite and parse_graph",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -1,9 +1,21 @@
+import os
 import sqlite3
+import sys
 
 import streamlit as st
 
 from sample import sample, generate
 
+# utils/ lives in the repository root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.openai_helpers import open_default_cache
+
+
+@st.cache_resource
+def get_cache():
+    """Completion cache from 'LLM_CACHE', opened once per server."""
+    return open_default_cache()
+
 
 db = sqlite3.connect('knowledge_graph.db')
 cursor = db.cursor()
@@ -42,5 +54,5 @@ if submit:
             ct.write(f'**Prop:** {prop[0]}, {prop[1][:80]}')
         ct.write(f'**Item {len(path)+1}:** {path[-1][0]}, {path[-1][1][:80]}')
         
-        ct.markdown(f'**Generated Question:** *{generate(path, props)}*')
+        ct.markdown(f'**Generated Question:** *{generate(path, props, cache=get_cache())}*')
         it += 1
@@ -100,12 +100,14 @@ def sample(
     return path, properties
 
 
-def generate(path: List[Tuple[str, ...]], properties: List[Tuple[str, ...]]) -> str:
+def generate(path: List[Tuple[str, ...]], properties: List[Tuple[str, ...]], cache=None) -> str:
     """Generate a question from a sample.
 
     Args:
     - path: a sampled path
     - properties: sampled properties
+    - cache: completion cache (`utils.llm_cache.CompletionCache`) to answer
+      from, prompts aren't cached by default
 
     Returns:
     - question generated from GPT-4
@@ -129,7 +131,10 @@ For instance, given the starting item: "Barack Obama" and the hops "Born in stat
 Sample:
 """ + sample
     client = OpenAI()
-    chat_completion = client.chat.completions.create(
+    create = client.chat.completions.create
+    if cache is not None:
+        create = lambda **params: cache.create(client, **params)
+    chat_completion = create(
         messages=[
             {
                 "role": "user",
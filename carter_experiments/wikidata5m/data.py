@@ -1,58 +1,150 @@
-"""Data classes for Wikidata5m."""
+"""Data classes for Wikidata5m.
 
+`Item`, `Property` and `Claim` are named tuples: no per-instance `__dict__`,
+compared and hashed by value (so sets of claims dedupe equal claims), and
+built from database rows in bulk with `from_rows`. `ClaimBatch` holds many
+claims as columns instead of one object per claim.
+"""
+from typing import Iterable, Iterator, List, NamedTuple, Sequence, Tuple
 
-class Item:
-    """Wikidata5m item."""
+import numpy as np
 
-    def __init__(self, id: str, alias: str, desc: str):
-        """Instantiate the item.
 
-        Args:
-        - id: ID of the item
-        - alias: alias of the item
-        - desc: description of the item
-        """
-        self.id: str = id
-        self.alias: str = alias
-        self.desc: str = desc
+class Item(NamedTuple):
+    """Wikidata5m item.
+
+    Fields:
+    - id: ID of the item
+    - alias: alias of the item
+    - desc: description of the item
+    """
+    id: str
+    alias: str
+    desc: str
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> List['Item']:
+        """Build items from `items` rows."""
+        return list(map(cls._make, rows))
 
     def __str__(self) -> str:
         return f'Item: {self.id}. {self.alias}'
 
 
-class Property:
-    """Wikidata5m property."""
+class Property(NamedTuple):
+    """Wikidata5m property.
 
-    def __init__(self, id: str, alias: str):
-        """Instantiate the property.
+    Fields:
+    - id: ID of the property
+    - alias: alias of the property
+    """
+    id: str
+    alias: str
 
-        Args:
-        - id: ID of the property
-        - alias: alias of the property
-        """
-        self.id: str = id
-        self.alias: str = alias
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> List['Property']:
+        """Build properties from `properties` rows."""
+        return list(map(cls._make, rows))
 
     def __str__(self) -> str:
         return f'Property: {self.id}. {self.alias}'
 
 
-class Claim:
-    """Wikidata5m claim."""
+class Claim(NamedTuple):
+    """Wikidata5m claim.
 
-    def __init__(self, id: int, subject_id: str, property_id: str, target_id: str):
-        """Instantiate the claim.
+    Fields:
+    - id: ID of the claim in the database
+    - subject_id: ID of the subject `Item` of the claim
+    - property_id: ID of the `Property` of the claim
+    - target_id: ID of the target `Item` of the claim
+    """
+    id: int
+    subject_id: str
+    property_id: str
+    target_id: str
 
-        Args:
-        - id: ID of the claim in the database
-        - subject: ID of the subject `Item` of the claim
-        - property: ID of the `Property` of the claim
-        - target: ID of the target `Item` of the claim
-        """
-        self.id: int = id
-        self.subject_id: str = subject_id
-        self.property_id: str = property_id
-        self.target_id: str = target_id
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> List['Claim']:
+        """Build claims from `claims` rows."""
+        return list(map(cls._make, rows))
 
     def __str__(self) -> str:
         return f'subject: {self.subject_id}, Property: {self.property_id}, Target: {self.target_id}'
+
+
+class ClaimBatch:
+    """Claims stored as columns: an int64 array of claim ids and object
+    arrays of subject, property and target ids (about 32 bytes per claim,
+    the id strings are shared with the rows they came from).
+
+    Indexing with an int returns a `Claim`; indexing with a mask, slice or
+    index array returns a smaller `ClaimBatch`.
+    """
+
+    __slots__ = ('ids', 'subject_ids', 'property_ids', 'target_ids')
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        subject_ids: np.ndarray,
+        property_ids: np.ndarray,
+        target_ids: np.ndarray,
+    ):
+        """Wrap the columns, which must have the same length."""
+        self.ids = ids
+        self.subject_ids = subject_ids
+        self.property_ids = property_ids
+        self.target_ids = target_ids
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple[int, str, str, str]]) -> 'ClaimBatch':
+        """Build the batch from `claims` rows, e.g. a `fetchall()`."""
+        if not rows:
+            empty = np.array([], dtype=object)
+            return cls(np.array([], dtype=np.int64), empty, empty, empty)
+        ids, subject_ids, property_ids, target_ids = zip(*rows)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(subject_ids, dtype=object),
+            np.array(property_ids, dtype=object),
+            np.array(target_ids, dtype=object),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Claim(
+                int(self.ids[index]),
+                self.subject_ids[index],
+                self.property_ids[index],
+                self.target_ids[index],
+            )
+        return ClaimBatch(
+            self.ids[index],
+            self.subject_ids[index],
+            self.property_ids[index],
+            self.target_ids[index],
+        )
+
+    def __iter__(self) -> Iterator[Claim]:
+        return map(
+            Claim._make,
+            zip(
+                self.ids.tolist(),
+                self.subject_ids.tolist(),
+                self.property_ids.tolist(),
+                self.target_ids.tolist(),
+            ),
+        )
+
+    def nbytes(self) -> int:
+        """Memory used by the columns, not counting the id strings."""
+        return (
+            self.ids.nbytes
+            + self.subject_ids.nbytes
+            + self.property_ids.nbytes
+            + self.target_ids.nbytes
+        )
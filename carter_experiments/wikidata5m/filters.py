@@ -2,18 +2,19 @@
 
 Ideally we'll add more filters if they makes sense.
 """
-from wikidata5m.utils import Property, PropertyFilter
+from wikidata5m.utils import PropertyFilter
 
 
 class BadPropertyFilter(PropertyFilter):
-    """Filter for manually-picked bad properties."""
+    """Filter for manually-picked bad properties.
 
-    def check(self, property: Property) -> bool:
-        id = property.id
-        return id not in [
-            'P31', # Instance of. Too vague
-            'P279', # Subclass of. Also vague
-        ]
+    Static: the samplers exclude these properties in the claims query.
+    """
+
+    excluded_ids = frozenset([
+        'P31', # Instance of. Too vague
+        'P279', # Subclass of. Also vague
+    ])
 
 # TODO: other filters
 # - prevent superclass property
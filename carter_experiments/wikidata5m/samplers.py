@@ -2,7 +2,7 @@
 from typing import Iterable, List
 import random
 
-from wikidata5m.utils import Sampler, ItemFilter, PropertyFilter, WikidataDB
+from wikidata5m.utils import Sampler, ItemFilter, PropertyFilter, WikidataDB, compile_filters
 from wikidata5m.data import Claim
 
 
@@ -32,9 +32,18 @@ class RandomWalk(Sampler):
         self._db = db
         self._num_claims = num_claims
         self._rp = restart_prob
-        self._item_filters = item_filters
-        self._property_filters = property_filters
+        self._item_filters = list(item_filters)
+        self._property_filters = list(property_filters)
         self._reversed = reversed
+        # static filters become one condition of the claims query, only the
+        # dynamic ones are checked on each candidate
+        self._query = compile_filters(
+            self._item_filters,
+            self._property_filters,
+            'subject_id' if reversed else 'target_id',
+        )
+        if reversed:
+            self._db.create_target_index()
 
     def sample(self) -> List[Claim]:
         """Sample via Random Walk with given params.
@@ -47,21 +56,33 @@ class RandomWalk(Sampler):
             if all([f.check(curr_item) for f in self._item_filters]):
                 break
         claims = []
+        query = self._query
+        curr_id = curr_item.id
         while len(claims) < self._num_claims:
             if self._reversed:
-                linked_claims = list(self._db.claims_from_target(curr_item.id))
+                linked_claims = self._db.claim_batch_from_target(curr_id, query.where, query.params)
             else:
-                linked_claims = list(self._db.claims_from_subject(curr_item.id))
-            random.shuffle(linked_claims)
+                linked_claims = self._db.claim_batch_from_subject(curr_id, query.where, query.params)
+            # shuffle positions, claims are only built when looked at
+            order = list(range(len(linked_claims)))
+            random.shuffle(order)
             no_valid_claim = True # TODO: better handling
-            for sample_claim in linked_claims:
-                sample_item = self._db.get_item(sample_claim.target_id)
-                sample_prop = self._db.get_property(sample_claim.property_id)
-                if all([f.check(sample_item) for f in self._item_filters]) and all([f.check(sample_prop) for f in self._property_filters]):
-                    claims.append(sample_claim)
-                    curr_item = sample_item
-                    no_valid_claim = False
-                    break
+            for i in order:
+                sample_claim = linked_claims[i]
+                # reversed walks move to the subject of the incoming claim
+                sample_id = sample_claim.subject_id if self._reversed else sample_claim.target_id
+                if query.item_filters:
+                    sample_item = self._db.get_item(sample_id)
+                    if not all(f.check(sample_item) for f in query.item_filters):
+                        continue
+                if query.property_filters:
+                    sample_prop = self._db.get_property(sample_claim.property_id)
+                    if not all(f.check(sample_prop) for f in query.property_filters):
+                        continue
+                claims.append(sample_claim)
+                curr_id = sample_id
+                no_valid_claim = False
+                break
             if no_valid_claim:
                 break
         if self._reversed:
@@ -1,11 +1,11 @@
 """Utilities for Wikidata5m."""
-from typing import Set, List
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
 from abc import ABC
 import sqlite3
 
 from openai import OpenAI
 
-from wikidata5m.data import Item, Property, Claim
+from wikidata5m.data import Item, Property, Claim, ClaimBatch
 
 
 class WikidataDB:
@@ -78,7 +78,24 @@ class WikidataDB:
         self._curr.execute('''
             SELECT * FROM claims WHERE subject_id = ?
         ''', (subject_id,))
-        return {Claim(*row) for row in self._curr.fetchall()}
+        return set(Claim.from_rows(self._curr.fetchall()))
+
+    def claim_batch_from_subject(self, subject_id: str, where: str = '', params: Sequence = ()) -> ClaimBatch:
+        """Get outgoing claims relating to an item, as columns.
+
+        Args:
+        - subject_id: ID of the `Item` to get outgoing claims from
+        - where: extra SQL condition on the claims, e.g. `FilterQuery.where`
+        - params: parameters of `where`
+
+        Returns:
+        - `ClaimBatch` of the claims where `subject_id` is the subject, in
+          database order
+        """
+        self._curr.execute('''
+            SELECT * FROM claims WHERE subject_id = ?
+        ''' + (f'AND ({where})' if where else ''), (subject_id, *params))
+        return ClaimBatch.from_rows(self._curr.fetchall())
 
     def random_item(self) -> Item:
         """Get a random item from the database.
@@ -91,9 +108,23 @@ class WikidataDB:
         ''', ())
         return Item(*self._curr.fetchone())
 
+    def create_target_index(self) -> None:
+        """Index claims by target, so `claims_from_target` doesn't scan the
+        whole table. Does nothing on a read-only database."""
+        try:
+            self._curr.execute('''
+                CREATE INDEX IF NOT EXISTS claims_target_index ON claims(target_id)
+            ''')
+            self._conn.commit()
+        except sqlite3.OperationalError as e:
+            if 'readonly' not in str(e):
+                raise
+
     def claims_from_target(self, target_id: str) -> Set[Claim]:
         """Get incoming claims relating to an item.
 
+        Call `create_target_index` once first on a large database.
+
         Args:
         - target_id: ID of the `Item` to get incoming claims from
 
@@ -103,7 +134,24 @@ class WikidataDB:
         self._curr.execute('''
             SELECT * FROM claims WHERE target_id = ?
         ''', (target_id,))
-        return {Claim(*row) for row in self._curr.fetchall()}
+        return set(Claim.from_rows(self._curr.fetchall()))
+
+    def claim_batch_from_target(self, target_id: str, where: str = '', params: Sequence = ()) -> ClaimBatch:
+        """Get incoming claims relating to an item, as columns.
+
+        Args:
+        - target_id: ID of the `Item` to get incoming claims from
+        - where: extra SQL condition on the claims, e.g. `FilterQuery.where`
+        - params: parameters of `where`
+
+        Returns:
+        - `ClaimBatch` of the claims where `target_id` is the target, in
+          database order
+        """
+        self._curr.execute('''
+            SELECT * FROM claims WHERE target_id = ?
+        ''' + (f'AND ({where})' if where else ''), (target_id, *params))
+        return ClaimBatch.from_rows(self._curr.fetchall())
 
     def close(self) -> None:
         """Close the connection to the database."""
@@ -121,8 +169,42 @@ class Sampler(ABC):
         raise NotImplemented()
 
 
+def id_set_condition(column: str, ids: Optional[FrozenSet[str]]) -> Optional[Tuple[str, tuple]]:
+    """SQL condition rejecting the rows where `column` is in `ids`.
+
+    Returns:
+    - `(sql, params)`, or `None` if `ids` is `None`
+    """
+    if ids is None:
+        return None
+    if not ids:
+        return '1', ()
+    ids = tuple(sorted(ids))
+    return f'{column} NOT IN ({", ".join("?" * len(ids))})', ids
+
+
 class ItemFilter(ABC):
-    """Filter for `Item`s when sampling."""
+    """Filter for `Item`s when sampling.
+
+    Static filters set `excluded_ids` (or override `sql_condition`), so the
+    samplers apply them in the claims query instead of loading and checking
+    every candidate `Item`. Dynamic filters only implement `check`.
+    """
+
+    # IDs of the items rejected by a static filter
+    excluded_ids: Optional[FrozenSet[str]] = None
+
+    def sql_condition(self, column: str) -> Optional[Tuple[str, tuple]]:
+        """SQL condition on the claims column holding the item ID.
+
+        Args:
+        - column: `subject_id` or `target_id`
+
+        Returns:
+        - `(sql, params)` keeping the claims whose item passes the filter, or
+          `None` if the filter is dynamic
+        """
+        return id_set_condition(column, self.excluded_ids)
 
     def check(self, item: Item) -> bool:
         """Pass an `Item` through the filter.
@@ -133,11 +215,29 @@ class ItemFilter(ABC):
         Returns:
         - boolean if `item` passes the filter
         """
+        if self.excluded_ids is not None:
+            return item.id not in self.excluded_ids
         raise NotImplemented()
 
 
 class PropertyFilter(ABC):
-    """Filter for `Property`s when sampling."""
+    """Filter for `Property`s when sampling.
+
+    Static filters set `excluded_ids` (or override `sql_condition`), see
+    `ItemFilter`.
+    """
+
+    # IDs of the properties rejected by a static filter
+    excluded_ids: Optional[FrozenSet[str]] = None
+
+    def sql_condition(self, column: str = 'property_id') -> Optional[Tuple[str, tuple]]:
+        """SQL condition on the property column of the claims.
+
+        Returns:
+        - `(sql, params)` keeping the claims whose property passes the
+          filter, or `None` if the filter is dynamic
+        """
+        return id_set_condition(column, self.excluded_ids)
 
     def check(self, property: Property) -> bool:
         """Pass a `Propery` through the filter.
@@ -148,9 +248,62 @@ class PropertyFilter(ABC):
         Returns:
         - boolean if `property` passes the filter
         """
+        if self.excluded_ids is not None:
+            return property.id not in self.excluded_ids
         raise NotImplemented()
 
 
+class FilterQuery(NamedTuple):
+    """Filters compiled for a claims query.
+
+    Fields:
+    - where: SQL condition combining the static filters (empty if none)
+    - params: parameters of `where`
+    - item_filters: dynamic item filters, to `check` in Python
+    - property_filters: dynamic property filters, to `check` in Python
+    """
+    where: str
+    params: tuple
+    item_filters: List[ItemFilter]
+    property_filters: List[PropertyFilter]
+
+
+def compile_filters(
+    item_filters: Iterable[ItemFilter],
+    property_filters: Iterable[PropertyFilter],
+    item_column: str,
+) -> FilterQuery:
+    """Compile the static filters into one SQL condition on the claims.
+
+    Args:
+    - item_filters: filters of the items the walk moves to
+    - property_filters: filters of the claim properties
+    - item_column: claims column of the item the walk moves to,
+      `target_id` (forward) or `subject_id` (reversed)
+
+    Returns:
+    - the `FilterQuery`
+    """
+    conditions, params = [], []
+    dynamic_items, dynamic_props = [], []
+    for f in item_filters:
+        condition = f.sql_condition(item_column)
+        if condition is None:
+            dynamic_items.append(f)
+        else:
+            conditions.append(condition[0])
+            params.extend(condition[1])
+    for f in property_filters:
+        condition = f.sql_condition('property_id')
+        if condition is None:
+            dynamic_props.append(f)
+        else:
+            conditions.append(condition[0])
+            params.extend(condition[1])
+    where = ' AND '.join(f'({c})' for c in conditions)
+    return FilterQuery(where, tuple(params), dynamic_items, dynamic_props)
+
+
 def get_openai_response(prompt: str) -> str:
     """Get a GPT-4 response.
 
@@ -2,13 +2,22 @@
 
 Will write a JSONL file which can be used with the parallel processing script
 from the OpenAI cookbook.
+
+Aliases of every item and property in the input are loaded from the database
+up front, in bulk, so prompts are built without a query per row. With
+`--n-processes`, prompts for very large inputs are built in parallel. The
+input can also be a Parquet path file (`utils/path_store.py`).
 """
 
 import argparse
 import csv
 import json
 import sqlite3
-from typing import List
+from itertools import islice
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Set, Tuple
+
+from utils.path_store import is_path_file, iter_paths
 
 LLM_PROMPT = """You will be given a starting item and a sequence of relationships, as hops, leading to an answer. You need to convert this information into a question, asking what the final item would be after all of the hops. Only respond with the question, nothing else. The info for each item and property are multiple aliases, but only include on name for each.
 
@@ -24,44 +33,208 @@ Sample:
 """
 
 
+# ids per query, below SQLite's default limit of 999 parameters
+CHUNK_SIZE = 900
+
+# aliases used by worker processes, set by `init_worker`
+worker_aliases: Tuple[Dict[str, str], Dict[str, str]] = ({}, {})
+
+
 def main(args):
+    in_file_path = args.__dict__["in-file"]
     db = sqlite3.connect(args.database)
     curr = db.cursor()
-    with open(args.__dict__["in-file"], "r") as in_file:
-        reader = csv.reader(in_file)
-        with open(args.__dict__["out-file"], "w") as out_file:
-            for i, line in enumerate(reader):
-                items = [
-                    line[0],
-                    line[len(line) // 2],
-                ]  # we only use first and last item
-                properties = line[1 + len(line) // 2 :]
-                prop_desc = []
-                for prop in properties:
-                    curr.execute(
-                        "SELECT property_alias FROM properties where property_id = ?",
-                        (prop,),
-                    )
-                    prop_desc.append(curr.fetchone()[0])
-                item_desc = []
-                for item in items:
-                    curr.execute(
-                        "SELECT item_alias FROM items where item_id = ?",
-                        (item,),
-                    )
-                    item_desc.append(curr.fetchone()[0])
-                prompt = create_prompt(item_desc, prop_desc)
-                example = json.dumps(
-                    {
-                        "model": args.model,
-                        "prompt": prompt,
-                        "metadata": {
-                            "row_id": i + 1,  # we one-index here
-                            "in_file": args.__dict__["in-file"],
-                        },
-                    }
+
+    # resolve every id once, instead of once per row
+    item_ids = set()
+    prop_ids = set()
+    for line in read_lines(in_file_path):
+        items, properties = split_line(line)
+        item_ids.update(items)
+        prop_ids.update(properties)
+    item_aliases = load_aliases(curr, "items", "item_id", "item_alias", item_ids)
+    prop_aliases = load_aliases(
+        curr, "properties", "property_id", "property_alias", prop_ids
+    )
+    db.close()
+
+    reader = read_lines(in_file_path)
+    with open(args.__dict__["out-file"], "w") as out_file:
+        if args.n_processes > 1:
+            # workers inherit the aliases instead of receiving them per chunk
+            with Pool(
+                args.n_processes,
+                initializer=init_worker,
+                initargs=(item_aliases, prop_aliases),
+            ) as pool:
+                chunks = pool.imap(
+                    create_examples_in_worker,
+                    (
+                        (start, lines, args.model, in_file_path)
+                        for start, lines in chunked(reader, args.chunk_size)
+                    ),
+                )
+                for examples in chunks:
+                    out_file.writelines(examples)
+        else:
+            out_file.writelines(
+                create_examples(
+                    enumerate(reader),
+                    item_aliases,
+                    prop_aliases,
+                    args.model,
+                    in_file_path,
                 )
-                out_file.write(example + "\n")
+            )
+
+
+def read_lines(in_file_path: str) -> Iterable[List[str]]:
+    """Stream the sampled paths of a csv or Parquet path file as csv rows."""
+    if is_path_file(in_file_path):
+        yield from iter_paths(in_file_path)
+        return
+    with open(in_file_path, "r") as in_file:
+        yield from csv.reader(in_file)
+
+
+def split_line(line: List[str]) -> Tuple[List[str], List[str]]:
+    """Split a sampled path into the items and properties used in its prompt.
+
+    Args:
+    - line: csv row of item ids followed by property ids
+
+    Returns:
+    - tuple of:
+        - first and last item ids
+        - property ids
+    """
+    items = [
+        line[0],
+        line[len(line) // 2],
+    ]  # we only use first and last item
+    properties = line[1 + len(line) // 2 :]
+    return items, properties
+
+
+def load_aliases(
+    curr: sqlite3.Cursor, table: str, id_column: str, alias_column: str, ids: Set[str]
+) -> Dict[str, str]:
+    """Look up the aliases of many ids, with one query per chunk of ids.
+
+    Args:
+    - curr: cursor to the Wikidata5m database
+    - table: table to look up in
+    - id_column: id column of the table
+    - alias_column: alias column of the table
+    - ids: ids to look up
+
+    Returns:
+    - aliases by id, ids missing from the table are left out
+    """
+    aliases = {}
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start : start + CHUNK_SIZE]
+        curr.execute(
+            f"SELECT {id_column}, {alias_column} FROM {table} "
+            f"WHERE {id_column} IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        aliases.update(curr.fetchall())
+    return aliases
+
+
+def create_examples(
+    lines: Iterable[Tuple[int, List[str]]],
+    item_aliases: Dict[str, str],
+    prop_aliases: Dict[str, str],
+    model: str,
+    in_file_path: str,
+) -> Iterable[str]:
+    """Create the JSONL requests for sampled paths.
+
+    Args:
+    - lines: csv rows with their 0-indexed row numbers
+    - item_aliases: aliases by item id
+    - prop_aliases: aliases by property id
+    - model: OpenAI model to request
+    - in_file_path: input file, recorded in the metadata
+
+    Returns:
+    - one JSON line per row
+    """
+    for i, line in lines:
+        example = json.dumps(
+            create_request(i, line, item_aliases, prop_aliases, model, in_file_path)
+        )
+        yield example + "\n"
+
+
+def create_request(
+    i: int,
+    line: List[str],
+    item_aliases: Dict[str, str],
+    prop_aliases: Dict[str, str],
+    model: str,
+    in_file_path: str,
+) -> dict:
+    """Create the request for one sampled path.
+
+    Args:
+    - i: 0-indexed row number of the path
+    - line: item ids followed by property ids
+    - item_aliases: aliases by item id
+    - prop_aliases: aliases by property id
+    - model: OpenAI model to request
+    - in_file_path: input file, recorded in the metadata
+
+    Returns:
+    - request for the parallel processor
+    """
+    items, properties = split_line(line)
+    prompt = create_prompt(
+        [item_aliases[item] for item in items],
+        [prop_aliases[prop] for prop in properties],
+    )
+    return {
+        "model": model,
+        "prompt": prompt,
+        "metadata": {
+            "row_id": i + 1,  # we one-index here
+            "in_file": in_file_path,
+        },
+    }
+
+
+def chunked(
+    reader: Iterable[List[str]], chunk_size: int
+) -> Iterable[Tuple[int, List[List[str]]]]:
+    """Split csv rows into chunks, with the row number each chunk starts at."""
+    reader = iter(reader)
+    start = 0
+    while True:
+        lines = list(islice(reader, chunk_size))
+        if not lines:
+            return
+        yield start, lines
+        start += len(lines)
+
+
+def init_worker(item_aliases: Dict[str, str], prop_aliases: Dict[str, str]) -> None:
+    global worker_aliases
+    worker_aliases = (item_aliases, prop_aliases)
+
+
+def create_examples_in_worker(
+    chunk: Tuple[int, List[List[str]], str, str]
+) -> List[str]:
+    """`create_examples` for one chunk of rows, in a worker process."""
+    start, lines, model, in_file_path = chunk
+    return list(
+        create_examples(
+            enumerate(lines, start), *worker_aliases, model, in_file_path
+        )
+    )
 
 
 def create_prompt(path: List[str], properties: List[str]) -> str:
@@ -95,5 +268,17 @@ if __name__ == "__main__":
         default="gpt4-turbo-0125",
         help="OpenAI model to use during generation",
     )
+    parser.add_argument(
+        "--n-processes",
+        type=int,
+        default=1,
+        help="processes building prompts, for very large inputs",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="rows per chunk handed to a process",
+    )
     args = parser.parse_args()
     main(args)
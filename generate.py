@@ -1,11 +1,24 @@
 """Generate QA examples from Wikidata5m.
 
 Requires Wikidata5m sqlite3 db locally and a .env file with 'AZURE_OPENAI_KEY'
-and 'AZURE_OPENAI_ENDPOINT' set. See the Azure instance for reference.
+and 'AZURE_OPENAI_ENDPOINT' set. See the Azure instance for reference. With
+`--base-url`, requests go to that endpoint instead (e.g.
+`benchmarks/mock_openai_server.py`) and the key is optional.
 
 Writes generated samples to a CSV file with the header format:
 GENERATED_QUESTION, ITEM_1, ITEM_2, ..., ITEM_N_HOPS+1, PROP_1, PROP_2, PROP_N_HOPS
 
+Generation is pipelined: `--n-samplers` threads sample paths into a bounded
+queue, `--concurrency` coroutines turn them into questions under the
+`--max-requests-per-minute`/`--max-tokens-per-minute` budget, and a writer
+emits rows as they finish (or in sampling order with `--ordered`). Sampling
+and generation overlap, so throughput is bounded by the API quota instead of
+by one LLM call per row.
+
+With `--cache` (or 'LLM_CACHE' in .env), prompts generated before are answered
+from a completion cache shared with the other generators
+(`utils/llm_cache.py`) without using the budget.
+
 Usage: `python3 generate.py DATABASE OUT_FILE N_SAMPLES [args]`
 
 - Use `python3 generate.py -h` for additional help.
@@ -13,17 +26,50 @@ Usage: `python3 generate.py DATABASE OUT_FILE N_SAMPLES [args]`
     - Simple generation of 10 examples: `python3 generate.py knowledge_graph.db out.csv 10`
     - Generate with 4 hops and c=0.5:
       `python3 generate.py knowledge_graph.db out.csv 5 --n-hops 4 --c 0.5`
+    - 50 requests in flight, at most 600 requests per minute:
+      `python3 generate.py knowledge_graph.db out.csv 1000 --concurrency 50 --max-requests-per-minute 600`
 """
 
+import asyncio
 import csv
 import sqlite3
+import threading
 from argparse import ArgumentParser
 from collections import Counter
-from typing import List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 import numpy as np
-from dotenv import dotenv_values
-from openai import AzureOpenAI, OpenAI
+from openai import APITimeoutError, AsyncOpenAI, OpenAI, RateLimitError
+
+from utils.llm_cache import CompletionCache
+from utils.openai_helpers import get_client, open_default_cache
+from utils.rate_limit import RateLimiter, retry_after_seconds
+
+PROMPT = """
+You will be given a starting item and a sequence of relationships, as hops, leading to an answer. You need to convert this information into a question, asking what the final item would be after all of the hops. Only respond with the question, nothing else.
+
+Note that the hops follow, in the sequence:
+
+STARTING ITEM -> hop1 -> hop2 -> ... -> hopn -> FINAL ITEM
+
+Ensure that your question asks about the final items with the proper hop relationship directions and orderings.
+
+For instance, given the starting item: "Barack Obama" and the hops "Born in state", "Capital city", you might respond: "What is the capital of the state which Barack Obama was born in?"
+
+Sample: """
+
+
+class EmptyResponseError(Exception):
+    """The model answered without content (e.g. a filtered completion)."""
+
+
+# generation errors worth a new sample; anything else (authentication,
+# configuration, ...) would fail again, so it stops the pipeline
+RESAMPLE_ERRORS = (RateLimitError, APITimeoutError, asyncio.TimeoutError, EmptyResponseError)
+
+# completion tokens budgeted per request by the rate limiter, questions are short
+COMPLETION_TOKENS = 64
 
 
 def sample(
@@ -134,11 +180,32 @@ def sample(
     return path, properties
 
 
+def create_prompt(
+    path: List[Tuple[str, ...]], properties: List[Tuple[str, ...]]
+) -> str:
+    """Create the question generation prompt for a sample.
+
+    Args:
+    - path: a sampled path
+    - properties: sampled properties
+
+    Returns:
+    - prompt for the sample
+    """
+    example = []
+    example.append(f"Starting item: {path[0][1]}")
+    for i, prop in enumerate(properties):
+        example.append(f"Hop {i+1}: {prop[1]}")
+    sample = "\n".join(example)
+    return PROMPT + sample
+
+
 def generate(
     path: List[Tuple[str, ...]],
     properties: List[Tuple[str, ...]],
     client: OpenAI,
     model: str = "gpt4-turbo-0125",
+    cache: Optional[CompletionCache] = None,
 ) -> str:
     """Generate a question from a sample.
 
@@ -147,95 +214,255 @@ def generate(
     - properties: sampled properties
     - client: OpenAI client to generate from
     - model: OpenAI model to use for generation
+    - cache: completion cache to answer from, if any
 
     Returns:
     - question generated from GPT-4
     """
-    example = []
-    example.append(f"Starting item: {path[0][1]}")
-    for i, prop in enumerate(properties):
-        example.append(f"Hop {i+1}: {prop[1]}")
-    sample = "\n".join(example)
-    prompt = (
-        """
-You will be given a starting item and a sequence of relationships, as hops, leading to an answer. You need to convert this information into a question, asking what the final item would be after all of the hops. Only respond with the question, nothing else.
-
-Note that the hops follow, in the sequence:
+    params = {
+        "messages": [
+            {
+                "role": "user",
+                "content": create_prompt(path, properties),
+            }
+        ],
+        "model": model,
+    }
+    if cache is not None:
+        chat_completion = cache.create(client, **params)
+    else:
+        chat_completion = client.chat.completions.create(**params)
+    response = chat_completion.choices[0].message.content
+    if response is None:
+        raise EmptyResponseError("OpenAI response was None")
+    return response
 
-STARTING ITEM -> hop1 -> hop2 -> ... -> hopn -> FINAL ITEM
 
-Ensure that your question asks about the final items with the proper hop relationship directions and orderings.
+async def agenerate(
+    path: List[Tuple[str, ...]],
+    properties: List[Tuple[str, ...]],
+    client: AsyncOpenAI,
+    limiter: RateLimiter,
+    model: str = "gpt4-turbo-0125",
+    max_attempts: int = 5,
+    cache: Optional[CompletionCache] = None,
+) -> str:
+    """Generate a question from a sample without blocking the event loop.
 
-For instance, given the starting item: "Barack Obama" and the hops "Born in state", "Capital city", you might respond: "What is the capital of the state which Barack Obama was born in?"
+    Args:
+    - path: a sampled path
+    - properties: sampled properties
+    - client: async OpenAI client to generate from
+    - limiter: rate limiter shared by all concurrent requests
+    - model: OpenAI model to use for generation
+    - max_attempts: attempts before giving up on rate limit errors
+    - cache: completion cache to answer from, if any; hits don't use the
+      budget
 
-Sample: """
-        + sample
-    )
-    chat_completion = client.chat.completions.create(
-        messages=[
+    Returns:
+    - question generated from GPT-4
+    """
+    prompt = create_prompt(path, properties)
+    params = {
+        "messages": [
             {
                 "role": "user",
                 "content": prompt,
             }
         ],
-        model=model,
-    )
-    response = chat_completion.choices[0].message.content
-    if response is None:
-        raise Exception("OpenAI response was None")
-    return response
+        "model": model,
+    }
+    if cache is not None:
+        cached = cache.get(params)
+        if cached is not None:
+            response = cached["choices"][0]["message"]["content"]
+            if response is None:
+                raise EmptyResponseError("OpenAI response was None")
+            return response
+    # rough estimate (~4 characters per token) is enough for budgeting
+    tokens = len(prompt) // 4 + COMPLETION_TOKENS
+    for attempt in range(max_attempts):
+        await limiter.acquire(tokens)
+        try:
+            chat_completion = await client.chat.completions.create(**params)
+        except RateLimitError as e:
+            # slows every generator down, the next acquire waits it out
+            limiter.on_rate_limit(retry_after_seconds(e.response.headers))
+            if attempt == max_attempts - 1:
+                raise
+            continue
+        limiter.on_success()
+        if cache is not None:
+            cache.put(params, chat_completion.model_dump())
+        response = chat_completion.choices[0].message.content
+        if response is None:
+            raise EmptyResponseError("OpenAI response was None")
+        return response
 
 
 def main(args):
-    # connect to db
-    db = sqlite3.connect(args.database)
-    cursor = db.cursor()
-
-    # get Azure OpenAI client
-    secrets = dotenv_values(".env")
-    api_key = secrets["AZURE_OPENAI_KEY"]
-    azure_endpoint = secrets["AZURE_OPENAI_ENDPOINT"]
-    if azure_endpoint is None or api_key is None:
-        raise Exception(".env values not set - see generate.py header for info")
-    client = AzureOpenAI(
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-        api_version="2024-02-15-preview",
-    )
+    # get Azure OpenAI client, or a local server with --base-url
+    # agenerate retries itself, so every 429 reaches the rate limiter
+    client = get_client(base_url=args.base_url, use_async=True, max_retries=0)
+    cache = open_default_cache(args.cache)
+    try:
+        asyncio.run(run_pipeline(args, client, cache))
+    finally:
+        if cache is not None:
+            print(cache.report())
+            cache.close()
+
+
+async def run_pipeline(
+    args, client: AsyncOpenAI, cache: Optional[CompletionCache] = None
+) -> None:
+    """Sample, generate and write `args.n_samples` rows concurrently.
+
+    Stages:
+    - samplers: `args.n_samplers` threads (one sqlite3 connection each) fill a
+      queue of at most `args.queue_size` paths
+    - generators: `args.concurrency` coroutines call the LLM under a shared
+      `RateLimiter`
+    - writer: writes rows as they finish, or in sampling order if
+      `args.ordered`
+
+    Failed samples and generations are dropped and replaced by new samples.
+    The run stops with the error after `args.max_failures` failures in a row,
+    or at the first generation error not in `RESAMPLE_ERRORS`.
 
-    n_generated = 0
-    with open(args.out_file, "w") as f:
-        writer = csv.writer(f)
-        header = ["GENERATED_QUESTION"]
-        header += [f"ITEM_{i+1}" for i in range(args.n_hops + 1)]
-        header += [f"PROP_{i+1}" for i in range(args.n_hops)]
-        writer.writerow(header)
-
-        while n_generated < int(args.n_samples):
+    Args:
+    - args: parsed command line arguments
+    - client: async OpenAI client to generate from
+    - cache: completion cache to answer from, if any
+    """
+    n_samples = int(args.n_samples)
+    bad_prop_ids = set(args.bad_props.split(" "))
+    bad_item_ids = set(args.bad_items.split(" "))
+    limiter = RateLimiter(args.max_requests_per_minute, args.max_tokens_per_minute)
+    paths: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    rows: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    local = threading.local()
+
+    def sample_in_thread():
+        # sqlite3 connections can't be shared between threads
+        if not hasattr(local, "cursor"):
+            local.cursor = sqlite3.connect(args.database).cursor()
+        while True:
             log = []
             path, props = sample(
-                cursor,
+                local.cursor,
                 args.n_hops,
                 args.c,
-                bad_prop_ids=set(args.bad_props.split(" ")),
-                bad_item_ids=set(args.bad_items.split(" ")),
+                bad_prop_ids=bad_prop_ids,
+                bad_item_ids=bad_item_ids,
                 log=log,
             )
-
-            if "no possible" in log[-1]:
+            if "no possible" not in log[-1]:
+                return path, props
+
+    # samplers run until cancelled, the bounded queue stops them running ahead
+    state = {
+        "sampled": 0,
+        "started": 0,
+        "failed": 0,
+        "sampling_failures": 0,
+        "generation_failures": 0,
+    }
+
+    async def drop(seq, e, counter, stage) -> bool:
+        """Replace a failed row by a new sample, or pass the error on to the
+        writer after too many failures in a row.
+
+        Returns:
+        - whether the worker should stop
+        """
+        state[counter] += 1
+        if state[counter] >= args.max_failures:
+            await rows.put((seq, RuntimeError(f"{state[counter]} {stage}s failed in a row: {e}")))
+            return True
+        print(f"{stage.capitalize()} failed, resampling: {e}")
+        await rows.put((seq, None))
+        return False
+
+    async def sampler(executor):
+        while True:
+            seq = state["sampled"]
+            state["sampled"] += 1
+            try:
+                path, props = await loop.run_in_executor(executor, sample_in_thread)
+            except Exception as e:
+                if await drop(seq, e, "sampling_failures", "sampling"):
+                    return
                 continue
-
-            out = []
-            for item in path:
-                out.append(item[0])
-            for prop in props:
-                out.append(prop[0])
-
-            generation = generate(path, props, client)
-            out.insert(0, generation)
-            writer.writerow(out)
-            n_generated += 1
-            print(f"Generated: {n_generated}")
+            state["sampling_failures"] = 0
+            await paths.put((seq, path, props))
+
+    async def generator():
+        while True:
+            seq, path, props = await paths.get()
+            if state["started"] - state["failed"] >= n_samples:
+                # enough rows are already being generated, don't pay for more
+                await rows.put((seq, None))
+                continue
+            state["started"] += 1
+            try:
+                generation = await agenerate(
+                    path, props, client, limiter, model=args.model, cache=cache
+                )
+            except RESAMPLE_ERRORS as e:
+                state["failed"] += 1
+                if await drop(seq, e, "generation_failures", "generation"):
+                    return
+                continue
+            except Exception as e:
+                await rows.put((seq, e))
+                return
+            state["generation_failures"] = 0
+            out = [generation]
+            out += [item[0] for item in path]
+            out += [prop[0] for prop in props]
+            await rows.put((seq, out))
+
+    with ThreadPoolExecutor(max_workers=args.n_samplers) as executor:
+        workers = [
+            asyncio.create_task(sampler(executor)) for _ in range(args.n_samplers)
+        ]
+        workers += [asyncio.create_task(generator()) for _ in range(args.concurrency)]
+        try:
+            with open(args.out_file, "w") as f:
+                writer = csv.writer(f)
+                header = ["GENERATED_QUESTION"]
+                header += [f"ITEM_{i+1}" for i in range(args.n_hops + 1)]
+                header += [f"PROP_{i+1}" for i in range(args.n_hops)]
+                writer.writerow(header)
+
+                n_generated = 0
+                next_seq = 0
+                pending: Dict[int, Optional[List[str]]] = {}
+                while n_generated < n_samples:
+                    seq, out = await rows.get()
+                    if isinstance(out, Exception):
+                        raise out
+                    if args.ordered:
+                        # hold rows back until every earlier row is done
+                        pending[seq] = out
+                        ready = []
+                        while next_seq in pending:
+                            ready.append(pending.pop(next_seq))
+                            next_seq += 1
+                    else:
+                        ready = [out]
+                    for out in ready:
+                        if out is None or n_generated == n_samples:
+                            continue
+                        writer.writerow(out)
+                        n_generated += 1
+                        print(f"Generated: {n_generated}")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
 
 if __name__ == "__main__":
@@ -256,5 +483,49 @@ if __name__ == "__main__":
     parser.add_argument(
         "--bad-items", type=str, default="", help="bad items, space-separated"
     )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="gpt4-turbo-0125",
+        help="OpenAI model to use during generation",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=20, help="LLM requests in flight"
+    )
+    parser.add_argument(
+        "--n-samplers", type=int, default=4, help="number of sampling threads"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=100, help="sampled paths buffered for generation"
+    )
+    parser.add_argument(
+        "--max-requests-per-minute", type=float, default=600, help="request budget"
+    )
+    parser.add_argument(
+        "--max-tokens-per-minute", type=float, default=80000, help="token budget"
+    )
+    parser.add_argument(
+        "--max-failures",
+        type=int,
+        default=20,
+        help="samples or generations failing in a row before giving up",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="write rows in sampling order instead of as they finish",
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=None,
+        help="endpoint replacing AZURE_OPENAI_ENDPOINT, e.g. a local mock server",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="sqlite3 completion cache, defaults to LLM_CACHE from .env",
+    )
     args = parser.parse_args()
     main(args)
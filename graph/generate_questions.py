@@ -2,21 +2,31 @@
 
 - Requires data pickle db locally and a .env file with 'AZURE_OPENAI_KEY' and
   'AZURE_OPENAI_ENDPOINT' set. See the Azure instance for reference.
+- `--base_url` (or 'OPENAI_BASE_URL' in .env) sends requests to another
+  endpoint instead, e.g. a local `benchmarks/mock_openai_server.py`.
+- `--cache` (or 'LLM_CACHE' in .env) answers prompts generated before from a completion cache shared
+  with the other generators (`utils/llm_cache.py`), so re-runs don't pay for
+  them again.
 - Writes generated samples to a CSV file with format: INPUT_LINE_NUMER, QUESTION, PROMPT
     - 0-indexed
+    - rows are written as they finish, not in input order
+- At most `--max_in_flight` requests run at once on `--n_workers` threads; a
+  new one starts whenever one finishes, so a slow or rate limited request
+  doesn't hold back the others.
 - Usage: `python3 generate.py DATA_PICKLE OUT_FILE N_SAMPLES [args]`
 - Use `python3 generate.py -h` for additional help.
 """
 
+import os
 import pickle
+import sys
 import time
 from argparse import ArgumentParser
-from typing import Dict, List
+from typing import List, Mapping
 import csv
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from dotenv import dotenv_values
-from openai import AzureOpenAI, OpenAI, RateLimitError
+from openai import OpenAI, RateLimitError
 
 
 PROMPT = """You will be given a starting item and a sequence of relationships, as hops, leading to an answer. Convert this information into a question, asking what the final item would be after all of the hops. Only respond with the question, nothing else. Do not include the final item in the question. Try to keep the questions coherent and intelligible.
@@ -32,84 +42,103 @@ For instance, given the starting item: "Barack Obama" and the hops "Born in stat
 Sequence:
 """
 
+# aliases by id (`utils/alias_store.py`), loaded once in `main` and shared by
+# all worker threads
+aliases: Mapping = {}
+
 def main(args):
-    # get Azure OpenAI client
+    global aliases
+
+    # utils/ lives in the repository root, one level up
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.alias_store import open_aliases
+    from utils.openai_helpers import get_client, open_default_cache
+
+    # get Azure OpenAI client, or a local server with --base_url
     print('creating OpenAI client')
-    secrets = dotenv_values(".env")
-    api_key = secrets["AZURE_OPENAI_KEY"]
-    azure_endpoint = secrets["AZURE_OPENAI_ENDPOINT"]
-    if azure_endpoint is None or api_key is None:
-        raise Exception(".env values not set")
-    client = AzureOpenAI(
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-        api_version="2024-02-15-preview",
-    )
+    client = get_client(base_url=args.base_url)
+    cache = open_default_cache(args.cache)
 
     print('loading pickled data')
     with open(args.pickle_file, "rb") as f:
         _, aliases = pickle.load(f)
+    aliases = open_aliases(aliases)
 
     with open(args.sample_file, 'r') as in_file:
         reader = csv.reader(in_file)
         with open(args.out_file, 'w') as out_file:
             writer = csv.writer(out_file)
             t = time.time()
-            arguments = []
-            for i, line in enumerate(reader):
-                try:
+            n_done = 0
+            pending = set()
+
+            def write_done(futures):
+                nonlocal n_done, t
+                for future in futures:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f'exception: {e}')
+                        result = None
+                    if result is not None:
+                        writer.writerow(result)
+                    n_done += 1
+                    if n_done % args.batch_size == 0:
+                        print(f'iter: {n_done}, {time.time() - t}')
+                        t = time.time()
+
+            with ThreadPoolExecutor(max_workers=args.n_workers) as executor:
+                for i, line in enumerate(reader):
                     n_items = args.n_hops + 1
                     items = line[:n_items]
                     props = line[n_items:2 * n_items - 1]
-                    arguments.append((i, items, props, aliases, client))
-                    if (i+1) % args.batch_size == 0:
-                        with ThreadPoolExecutor() as executor:
-                            futures = executor.map(lambda x: generate(*x), arguments)
-                            for future in futures:
-                                if future is not None:
-                                    writer.writerow(future)
-                        arguments = []
-                        print(f'iter: {i+1}, {time.time() - t}')
-                        t = time.time()
-                except Exception as e:
-                    print(f'exception: {e}')
-            with ThreadPoolExecutor() as executor:
-                futures = executor.map(lambda x: generate(*x), arguments)
-                for future in futures:
-                    if future is not None:
-                        writer.writerow((future))
+                    if len(pending) >= args.max_in_flight:
+                        # wait for a free slot, writing whatever finished
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        write_done(done)
+                    pending.add(executor.submit(generate, i, items, props, client, cache))
+                done, _ = wait(pending)
+                write_done(done)
+    if cache is not None:
+        print(cache.report())
+        cache.close()
 
 
 def generate(
     i: int,
     items: List[str],
     props: List[str],
-    aliases: Dict[str, Dict[str, str]],
     client: OpenAI,
+    cache=None,
     max_requests: int = 5,
     ):
     example = PROMPT
     example += f'STARTING ITEM: name: {aliases[items[0]]["name"]}\n'
-    for i, hop in enumerate(props):
-        example += f'HOP {i+1}: name: {aliases[hop]["name"]}, description: {aliases[hop].get("description", "")}\n'
+    for j, hop in enumerate(props):
+        hop_aliases = aliases[hop]
+        example += f'HOP {j+1}: name: {hop_aliases["name"]}, description: {hop_aliases.get("description", "")}\n'
     example += f'FINAL ITEM: name: {aliases[items[-1]]["name"]}'
 
     attempts = 1
     while True:
-        response = openai_request(example, client)
+        response = openai_request(example, client, cache=cache)
         if response['response'] is not None:
             return i, response['response'], example
         elif response['status'] == 'ratelimit':
             if attempts == max_requests:
                 return None
             time.sleep(2 ** attempts)
+            attempts += 1
         else:
             return None
 
 
-def openai_request(prompt, client, model='gpt4-turbo-0125'):
+def openai_request(prompt, client, model='gpt4-turbo-0125', cache=None):
+    create = client.chat.completions.create
+    if cache is not None:
+        create = lambda **params: cache.create(client, **params)
     try:
-        chat_completion = client.chat.completions.create(
+        chat_completion = create(
             messages=[
                 {
                     "role": "user",
@@ -133,6 +162,10 @@ if __name__ == '__main__':
     parser.add_argument('sample_file', type=str, help='sampled path file')
     parser.add_argument('out_file', type=str, help='output file')
     parser.add_argument('n_hops', type=int, help='number of hops in sampled file')
-    parser.add_argument('--batch_size', type=int, default=100, help='number of examples per batched request')
+    parser.add_argument('--batch_size', type=int, default=100, help='number of examples between progress reports')
+    parser.add_argument('--n_workers', type=int, default=32, help='threads sending requests')
+    parser.add_argument('--max_in_flight', type=int, default=64, help='requests submitted but not yet written at most')
+    parser.add_argument('--base_url', type=str, default=None, help='endpoint replacing AZURE_OPENAI_ENDPOINT, e.g. a local mock server')
+    parser.add_argument('--cache', type=str, default=None, help='sqlite3 completion cache, defaults to LLM_CACHE from .env')
     args = parser.parse_args()
     main(args)
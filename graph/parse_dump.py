@@ -2,32 +2,148 @@
 
 - Dump can be found at `https://dumps.wikimedia.org/wikidatawiki/entities/`
   under: `latest-truthy.nt*`
+- Keeps the lines with an English `http://schema.org/name` or
+  `http://schema.org/description`, in dump order.
+- The dump is read in `--block_size` byte blocks, filtered by `--n_processes`
+  worker processes with bytes searches rather than line by line.
+- `.bz2` and `.gz` dumps are read directly, decompressed by `lbzip2`/`pbzip2`
+  or `pigz` when installed (in parallel, on `--n_processes` threads), else by
+  Python's `bz2`/`gzip`.
+- `--claim_file` only keeps the names and descriptions of the ids in a
+  Wikidata5m claim file, the only ones `parse_graph.py` uses.
+- Usage: `python3 parse_dump.py DUMP OUT_FILE [--claim_file CLAIM_FILE]`
 """
 
 from argparse import ArgumentParser
+from multiprocessing import Pool
+import os
+import re
+import shutil
+import subprocess
 import time
+from typing import IO, Iterator, Optional, Set
+
+ENTITY_PREFIX = b'<http://www.wikidata.org/entity/'
+FIELD_PATTERN = re.compile(rb'http://schema\.org/(?:name|description)')
+
+# external parallel decompressors, by file extension, with their thread option
+DECOMPRESSORS = {
+    '.bz2': [('lbzip2', '-n'), ('pbzip2', '-p')],
+    '.gz': [('pigz', '-p')],
+}
+
+# ids to keep, inherited by the worker processes
+keep_ids: Optional[Set[bytes]] = None
+
+
+def load_claim_ids(claim_file: str) -> Set[bytes]:
+    """Items and properties of a Wikidata5m (tab separated) claim file."""
+    ids = set()
+    with open(claim_file, 'rb') as f:
+        for line in f:
+            ids.update(line.rstrip(b'\r\n').split(b'\t'))
+    return ids
+
+
+def open_dump(path: str, n_threads: int) -> IO[bytes]:
+    """Open the dump as a binary stream, decompressing `.bz2` and `.gz` files."""
+    for extension, commands in DECOMPRESSORS.items():
+        if not path.endswith(extension):
+            continue
+        for command, threads_option in commands:
+            if shutil.which(command) is not None:
+                process = subprocess.Popen(
+                    [command, '-dc', threads_option, str(n_threads), path],
+                    stdout=subprocess.PIPE,
+                )
+                return process.stdout
+        if extension == '.bz2':
+            import bz2
+            return bz2.open(path, 'rb')
+        import gzip
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_blocks(dump: IO[bytes], block_size: int) -> Iterator[bytes]:
+    """Read blocks of about `block_size` bytes, each ending at a line end."""
+    rest = b''
+    while True:
+        data = dump.read(block_size)
+        if not data:
+            break
+        block = rest + data
+        end = block.rfind(b'\n') + 1
+        if end == 0:
+            rest = block
+            continue
+        rest = block[end:]
+        yield block[:end]
+    if rest:
+        yield rest + b'\n'
+
+
+def filter_block(block: bytes):
+    """Keep the English name and description lines of a block.
+
+    Returns:
+    - (kept lines, number of lines in the block, number of lines kept)
+    """
+    kept = []
+    end = 0
+    for match in FIELD_PATTERN.finditer(block):
+        if match.start() < end:
+            # line kept already
+            continue
+        start = block.rfind(b'\n', 0, match.start()) + 1
+        end = block.find(b'\n', match.end()) + 1
+        line = block[start:end]
+        if b'@en ' not in line:
+            continue
+        if keep_ids is not None:
+            if not line.startswith(ENTITY_PREFIX):
+                continue
+            key = line[len(ENTITY_PREFIX):line.find(b'>')]
+            if key not in keep_ids:
+                continue
+        kept.append(line)
+    return b''.join(kept), block.count(b'\n'), len(kept)
 
 
 def main(args):
-    with open(args.out_file, 'w') as out_file:
-        with open(args.dump, 'r') as dump:
-            allowed = 0
-            per = 10000000
-            t = time.time()
-            for i, line in enumerate(dump):
-                if 'http://schema.org/name' in line or 'http://schema.org/description' in line:
-                    if '@en ' in line:
-                        allowed += 1
-                        out_file.write(line)
-                if (i+1) % per == 0:
-                    print(f'examples: {i+1}, allowed ratio: {(allowed / per):.8f}')
-                    print(f'took: {(time.time() - t):.2f} seconds')
-                    t = time.time()
-                    allowed = 0
+    global keep_ids
+    if args.claim_file is not None:
+        print('loading claim ids')
+        keep_ids = load_claim_ids(args.claim_file)
+        print(f'{len(keep_ids)} ids')
+
+    dump = open_dump(args.dump, args.n_processes)
+    # workers fork after `keep_ids` is set, so they share it
+    with open(args.out_file, 'wb') as out_file, Pool(args.n_processes) as pool:
+        n_lines = 0
+        allowed = 0
+        t = time.time()
+        # imap returns the blocks in order, so the output keeps the dump order
+        blocks = pool.imap(filter_block, read_blocks(dump, args.block_size))
+        for i, (lines, n_block_lines, n_kept) in enumerate(blocks):
+            out_file.write(lines)
+            n_lines += n_block_lines
+            allowed += n_kept
+            if (i + 1) % args.print_every == 0:
+                print(f'examples: {n_lines}, allowed: {allowed}')
+                print(f'took: {(time.time() - t):.2f} seconds')
+                t = time.time()
+    dump.close()
+    print(f'examples: {n_lines}, allowed: {allowed}')
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
-    parser.add_argument('dump', type=str, help='wikidata truthy dump')
+    parser.add_argument('dump', type=str, help='wikidata truthy dump, optionally .bz2 or .gz')
     parser.add_argument('out_file', type=str, help='out file for parsed data')
+    parser.add_argument('--claim_file', type=str, default=None, help='only keep ids in this Wikidata5m claim file')
+    parser.add_argument('--n_processes', type=int, default=os.cpu_count(), help='filtering processes (and decompression threads)')
+    parser.add_argument('--block_size', type=int, default=16 * 1024 * 1024, help='bytes of the dump per block')
+    parser.add_argument('--print_every', type=int, default=100, help='blocks between progress reports')
     args = parser.parse_args()
     main(args)
@@ -1,81 +1,129 @@
 """Script to convert Wikidata5m download to pickled NetworkX graph and aliases.
 
-- Converts to a NetworkX DiGraph and dictionary of relation aliases.
+- Converts to a NetworkX DiGraph and a compact alias store of names and
+  descriptions (`utils/alias_store.py`), pickled as plain arrays; load it
+  with `utils.alias_store.open_aliases`, which also accepts the dicts of
+  older pickles.
+- `--format pickle` (default) keeps one claim per (subject, target) pair, as
+  a DiGraph does; `--multigraph` pickles a MultiDiGraph with every claim
+  instead, and `--format csr` saves `utils.backends.CSRBackend` arrays (all
+  claims, per-node out- and in-edge lists, memory-mappable) to the `out_file`
+  directory, with a `utils/degree_store.py` degree table for weighted
+  sampling. `--dedup` drops repeated identical claims.
+- Claims are read into integer-encoded edge arrays (`utils/edge_arrays.py`)
+  and pruned with masks before the graph is built.
+- The parsed dump is split into `--chunk_size` byte chunks, parsed by
+  `--n_processes` worker processes.
 - Use `parse_dump.py` to parse a Wikidata dump before running this script
 - Wikidata5m download: https://deepgraphlearning.github.io/project/wikidata5m
 - We use the "raw" (wikidata5m_all_triplet.txt) split for claims!
 """
 
 import argparse
+import os
 import pickle
+import sys
 
 import networkx as nx
+import numpy as np
+
+# utils/ lives in the repository root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.alias_store import parse_alias_dump
+from utils.backends import CSRBackend
+from utils.degree_store import DEFAULT_C_VALUES, DegreeStore
+from utils.edge_arrays import decode_codes, first_seen, is_item, read_claim_codes
 
 
 def main(args):
-    # add claims to graph
-    print('adding claims to graph')
-    G = nx.DiGraph()
-    elements = set()
-    with open(args.claim_file, "r") as f:
-        for line in f:
-            s, p, o = line[:-1].split("\t")
-            elements.add(s)
-            elements.add(o)
-            elements.add(p)
-            G.add_edges_from([(s, o, {"id": p})])
+    # read claims into integer-encoded edge arrays
+    print('reading claims')
+    subjects, props, targets = read_claim_codes(args.claim_file)
+    # every node, in the order the graph used to add them
+    nodes = first_seen(np.stack((subjects, targets), axis=1).ravel())
+    elements = np.concatenate((nodes, np.unique(props)))
+    print(f'{len(subjects)} claims, {len(nodes)} nodes')
 
     # get names and descriptions
     print('getting names and descriptions')
-    aliases = {}
-    with open(args.parsed_dump, 'r') as f:
-        for i, line in enumerate(f):
-            splits = line.split('>')
-            key = splits[0][32:]
-            field = splits[1][20:]
-            value = splits[-1][2:-7].encode('utf-8').decode('unicode_escape')
-            if key in elements:
-                props = aliases.get(key, {})
-                props[field] = value
-                aliases[key] = props
-            if (i+1) % args.print_every == 0:
-                print(f'{((i+1) / 1000000):.1f}M lines parsed')
-    
-    # remove any properties or aliases which don't have a name
-    bad_edges = set()
-    removed = 0
-    for e in elements:
-        if e not in aliases:
-            if e[0] == 'P':
-                bad_edges.add(e)
-            elif e[0] == 'Q':
-                removed += 1
-                G.remove_node(e)
-            else:
-                raise Exception('Element which starts with not P or Q')
-    print(f'removed {removed} nodes')
-
-    to_remove = set()
-    removed = 0
-    for u, v, data in G.edges(data=True):
-        if data['id'] in bad_edges:
-            to_remove.add((u, v))
-    for u, v in to_remove:
-        removed += 1
-        G.remove_edge(u, v)
-    print(f'removed {removed} edges')
+    aliases = parse_alias_dump(
+        args.parsed_dump,
+        keep=set(decode_codes(elements)),
+        n_processes=args.n_processes,
+        chunk_size=args.chunk_size,
+    )
+    print(f'{len(aliases)} aliases, {aliases.nbytes() / 1e6:.1f} MB')
+
+    # remove any items which don't have a name, and claims with them or with
+    # a property which doesn't have a name
+    keep_nodes = aliases.contains_codes(nodes) | ~is_item(nodes)
+    print(f'removed {np.count_nonzero(~keep_nodes)} nodes')
+    keep_edges = (
+        (aliases.contains_codes(subjects) | ~is_item(subjects))
+        & (aliases.contains_codes(targets) | ~is_item(targets))
+        & aliases.contains_codes(props)
+    )
+    subjects, props, targets = (
+        subjects[keep_edges], props[keep_edges], targets[keep_edges]
+    )
+    print(f'removed {np.count_nonzero(~keep_edges)} edges')
+
+    if args.format == 'csr':
+        save_csr(args, aliases, nodes[keep_nodes], subjects, props, targets)
+        return
+
+    # build the graph from the pruned arrays
+    print('building graph')
+    G = nx.MultiDiGraph() if args.multigraph else nx.DiGraph()
+    G.add_nodes_from(decode_codes(nodes[keep_nodes]))
+    triples = zip(decode_codes(subjects), decode_codes(props), decode_codes(targets))
+    if args.multigraph and args.dedup:
+        # keyed by property, so repeated identical claims collapse
+        G.add_edges_from((s, o, p, {"id": p}) for s, p, o in triples)
+    else:
+        G.add_edges_from((s, o, {"id": p}) for s, p, o in triples)
+    print(f'{G.number_of_nodes()} nodes, {G.number_of_edges()} edges')
 
     # save the graph and aliases!
     print('saving data!')
     with open(args.out_file, "wb") as f:
-        pickle.dump((G, aliases), f)
+        pickle.dump((G, aliases.to_state()), f)
+
+
+def save_csr(args, aliases, nodes, subjects, props, targets):
+    """Save the pruned claims as a `CSRBackend` directory, every claim kept."""
+    print('building CSR arrays')
+    # number nodes in order of first appearance, as in the pickled graph
+    node_order = np.argsort(nodes)
+    sorted_nodes = nodes[node_order]
+    prop_codes = np.unique(props)
+    csr = CSRBackend.from_arrays(
+        np.array(decode_codes(nodes), dtype=str),
+        np.array(decode_codes(prop_codes), dtype=str),
+        node_order[np.searchsorted(sorted_nodes, subjects)],
+        np.searchsorted(prop_codes, props),
+        node_order[np.searchsorted(sorted_nodes, targets)],
+        labels={k: v["name"] for k, v in aliases.items() if "name" in v},
+        dedup=args.dedup,
+    )
+    print(f'{len(csr.node_ids)} nodes, {len(csr.targets)} edges')
+    csr.degrees = DegreeStore.from_csr(csr, args.c_values)
+    csr.build_in_index()
+
+    print('saving data!')
+    csr.save(args.out_file)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('parsed_dump', type=str, help='parsed dump of wikidata')
     parser.add_argument("claim_file", type=str, help="file of Wikidata5m claims")
-    parser.add_argument("out_file", type=str, help="location to store pickled output")
-    parser.add_argument('--print_every', type=int, default=1000000, help='how often to printupdates')
+    parser.add_argument("out_file", type=str, help="location to store pickled output (a directory for --format csr)")
+    parser.add_argument('--format', type=str, default='pickle', choices=['pickle', 'csr'], help='pickled NetworkX graph, or CSRBackend arrays')
+    parser.add_argument('--multigraph', action='store_true', help='pickle a MultiDiGraph, keeping parallel claims')
+    parser.add_argument('--c_values', type=float, nargs='+', default=list(DEFAULT_C_VALUES), help='values of c to precompute sampling weights for (--format csr)')
+    parser.add_argument('--dedup', action='store_true', help='drop repeated identical claims')
+    parser.add_argument('--n_processes', type=int, default=os.cpu_count(), help='processes parsing the dump')
+    parser.add_argument('--chunk_size', type=int, default=64 * 1024 * 1024, help='bytes of the dump per parsing task')
     args = parser.parse_args()
     main(args)
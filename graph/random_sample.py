@@ -4,19 +4,32 @@
 - `c` is a hyperparameter representing the dampening of common nodes sampling
     - `c` = 1 will have each node weighed by inverse in-degree
     - `c` = 0 is uniform sampling
+- `--degrees CSR_DIR` takes the sampling weights from the degree store of a
+  `parse_graph.py --format csr` directory instead of computing them from the
+  pickle
+- an output file ending in `.parquet` is written as a typed path file
+  (`utils/path_store.py`, needs `pyarrow`) instead of csv
 - Run `python random_sample.py -h` to get all options
 - For 3-hop paths on my Macbook Air, ~10 examples are generated per second
 """
 
 import csv
+import os
 import pickle
 import random
+import sys
 from argparse import ArgumentParser
-from typing import List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 import networkx as nx
 import numpy as np
 
+# utils/ lives in the repository root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.backends import CSRBackend
+from utils.degree_store import DegreeStore
+from utils.path_store import PathWriter, is_path_file
+
 
 def sample(
     G: nx.DiGraph,
@@ -24,6 +37,9 @@ def sample(
     c: float,
     bad_prop_ids: Set[str] = set(),
     bad_item_ids: Set[str] = set(),
+    log: Optional[List[str]] = None,
+    weights: Optional[Dict[str, float]] = None,
+    reverse: bool = False,
 ) -> Tuple[List[Tuple[str, ...]], ...]:
     """Samples.
 
@@ -33,12 +49,21 @@ def sample(
     - c: constant for the sampling
     - bad_prop_ids: property ids to avoid sampling
     - bad_item_ids: item ids to avoid sampling
+    - log: where to store logging messages
+    - weights: precomputed `in_degree ** -c` of every node (see
+      `degree_weights`), looked up instead of computed at every hop
+    - reverse: answer-first, walk incoming claims back from a random answer;
+      the path is returned in forward order
 
     Returns:
     - tuple of:
         - list of sampled items
         - list of properties connecting them
     """
+    if log is None:
+        # no logging will be returned
+        log = []
+
     # get random initial item
     initial_item = random.choice(list(G.nodes))
 
@@ -48,12 +73,18 @@ def sample(
     properties = []
     prop_ids = set()
 
+    # claims as (this item, next item, data), whichever way we walk
+    if reverse:
+        linked = lambda n: ((v, u, d) for u, v, d in G.in_edges(n, data=True))
+    else:
+        linked = lambda n: G.out_edges(n, data=True)
+
     # get path
     for _ in range(n_hops):
         # get all outgoing claims
         outgoing_claims = [
             claim
-            for claim in G.out_edges(prev_id, data=True)
+            for claim in linked(prev_id)
             if claim[2]["id"] not in prop_ids and claim[2]["id"] not in bad_prop_ids
         ]  # remove duplicate and bad relations
 
@@ -66,19 +97,27 @@ def sample(
         # ensure we aren't at a dead end
         if not outgoing_claims:
             # HACK: restart - just call itself again
+            log.append("restarting")
             return sample(
                 G,
                 n_hops,
                 c,
                 bad_prop_ids,
                 bad_item_ids,
+                log,
+                weights,
+                reverse,
             )
 
         # get probs
-        in_deg = np.array(
-            [x[1] for x in G.in_degree([claim[1] for claim in outgoing_claims])]
-        )
-        in_deg = in_deg**-c
+        if weights is not None:
+            in_deg = np.array([weights[claim[1]] for claim in outgoing_claims])
+        else:
+            in_deg = np.array(
+                [x[1] for x in G.in_degree([claim[1] for claim in outgoing_claims])]
+            )
+            # answer-first walks reach claim subjects with no incoming claims
+            in_deg = np.maximum(in_deg, 1).astype(np.float64) ** -c
         probs = in_deg / np.sum(in_deg)
 
         # sample
@@ -91,9 +130,27 @@ def sample(
         properties.append(outgoing_claims[idx][2]["id"])
         prop_ids.add(outgoing_claims[idx][2]["id"])
 
+    if reverse:
+        return path[::-1], properties[::-1]
     return path, properties
 
 
+def degree_weights(G: nx.DiGraph, c: float) -> Dict[str, float]:
+    """Sampling weight `in_degree ** -c` of every node, computed once."""
+    nodes, in_deg = zip(*G.in_degree()) if len(G) else ((), ())
+    weights = np.maximum(np.array(in_deg, dtype=np.float64), 1.0) ** -c
+    return dict(zip(nodes, weights.tolist()))
+
+
+def store_weights(csr_dir: str, c: float) -> Dict[str, float]:
+    """Sampling weight of every node, read from the degree store of a CSR
+    directory (computed from its arrays if the directory has none)."""
+    csr = CSRBackend.load(csr_dir, mmap=True)
+    degrees = csr.degrees if csr.degrees is not None else DegreeStore.from_csr(csr, [c])
+    weights = degrees.weight(np.arange(len(csr.node_ids)), c)
+    return dict(zip(np.asarray(csr.node_ids).tolist(), weights.tolist()))
+
+
 def main(args):
     print('loading pickle')
     with open(args.pickle, "rb") as f:
@@ -102,34 +159,62 @@ def main(args):
     bad_props = set(args.bad_props.split(' '))
     bad_items = set(args.bad_items.split(' '))
 
+    if args.degrees is not None:
+        weights = store_weights(args.degrees, args.c)
+    else:
+        weights = degree_weights(G, args.c)
+
+    if is_path_file(args.out_file):
+        metadata = {
+            "sampler": "random_sample",
+            "c": args.c,
+            "bad_prop_ids": sorted(bad_props),
+            "bad_item_ids": sorted(bad_items),
+            "reverse": args.reverse,
+        }
+        path_writer = PathWriter(args.out_file, args.n_hops, metadata=metadata)
+        writerow, close = path_writer.write_row, path_writer.close
+    else:
+        csvfile = open(args.out_file, "w", newline="")
+        writerow, close = csv.writer(csvfile).writerow, csvfile.close
+
     print('starting sampling')
-    with open(args.out_file, "w") as f:
-        writer = csv.writer(f)
+    try:
         for i in range(args.n_samples):
             try:
                 items, relations = sample(
                     G,
-                    3,
-                    0.3,
+                    args.n_hops,
+                    args.c,
                     bad_props,
                     bad_items,
+                    weights=weights,
+                    reverse=args.reverse,
                 )
-                writer.writerow(items + relations)
+                writerow(items + relations)
                 if args.print_every > 0 and (i + 1) % args.print_every == 0:
                     print(f"iteration: {i+1}")
             except Exception as e:
                 print(e)
+    finally:
+        close()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("pickle", type=str, help="pickled data file")
-    parser.add_argument("out_file", type=str, help="path to output csv file")
+    parser.add_argument("out_file", type=str, help="path to output csv (or .parquet) file")
     parser.add_argument("n_samples", type=int, help="number of samples to generate")
     parser.add_argument(
         "--n-hops", type=int, default=3, help="number of hops per sample"
     )
     parser.add_argument("--c", type=float, default=0.3, help="normalization parameter")
+    parser.add_argument(
+        "--degrees",
+        type=str,
+        default=None,
+        help="CSR directory (parse_graph.py --format csr) whose degree store gives the weights",
+    )
     parser.add_argument(
         "--bad-props",
         type=str,
@@ -142,5 +227,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "--print-every", type=int, default=-1, help="how often to print updates"
     )
+    parser.add_argument(
+        "--reverse", action="store_true", help="sample answer-first, walking incoming claims"
+    )
     args = parser.parse_args()
     main(args)
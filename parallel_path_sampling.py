@@ -1,16 +1,33 @@
 """Sample paths from a DB.
 
 Used for getting question paths before generating questions.
+
+- `--backend sqlite|csr` runs the shared sampling engine (`utils/sampling.py`)
+  instead of `sample`; build a CSR directory with `python -m utils.backends`
+- an output file ending in `.parquet` is written as a typed path file
+  (`utils/path_store.py`, needs `pyarrow`) instead of csv
+- `--reverse` (with `--backend`) samples answer-first: it picks the answer,
+  then walks backwards along incoming claims; `--answer-c C` (csr only) picks
+  answers in proportion to `in_degree ** -C` instead of uniformly
+- `--report REPORT_JSON` keeps streaming sketches of the sampled items,
+  properties and in-degrees (`utils/sketches.py`) and writes their summary,
+  to compare `c` values without reloading the paths
 """
 
 import csv
 import sqlite3
+import threading
 from argparse import ArgumentParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Optional, Set, Tuple
 
 import numpy as np
 
+from utils.backends import CSRBackend, SQLiteBackend
+from utils.path_store import PathWriter, is_path_file
+from utils.sampling import degree_item_picker, sample_path
+from utils.sketches import SamplingDiagnostics
+
 
 def sample(
     db_path: str,
@@ -97,6 +114,7 @@ def sample(
         # sample
         if not len(probs):
             # HACK: restart - just call itself again
+            log.append("restarting")
             conn.close()
             return sample(
                 db_path,
@@ -126,49 +144,158 @@ def sample(
     return path, properties
 
 
+def _legacy_task(sample_args):
+    """Task running `sample`, returning the path's rows, property rows and
+    in-degrees (the fourth column of the item rows)."""
+    path, properties = sample(**sample_args)
+    return path, properties, [item[3] for item in path]
+
+
 def process_and_write_to_csv(
     db_path: str,
     output_csv: str,
     num_samples: int,
     batch_size: int,
     n_workers: int,
+    backend: Optional[str] = None,
+    report: Optional[str] = None,
+    answer_c: Optional[float] = None,
     **sample_args
 ):
-    def task(sample_args):
-        path, properties = sample(**sample_args)
-        return path, properties
+    if backend is not None:
+        task = _backend_task(
+            backend,
+            db_path,
+            with_degrees=report is not None,
+            answer_c=answer_c,
+            reverse=sample_args.get("reverse", False),
+        )
+    else:
+        task = _legacy_task
+
+    diagnostics = None
+    if report is not None:
+        diagnostics = SamplingDiagnostics(
+            {
+                "sampler": "parallel_path_sampling",
+                "backend": backend,
+                "n_hops": sample_args.get("n_hops"),
+                "c": sample_args.get("c"),
+            }
+        )
+
+    if is_path_file(output_csv):
+        metadata = {
+            "sampler": "parallel_path_sampling",
+            "backend": backend,
+            "c": sample_args.get("c"),
+            "bad_prop_ids": sorted(sample_args.get("bad_prop_ids", [])),
+            "bad_item_ids": sorted(sample_args.get("bad_item_ids", [])),
+            "reverse": sample_args.get("reverse", False),
+            "answer_c": answer_c,
+        }
+        path_writer = PathWriter(output_csv, sample_args["n_hops"], metadata=metadata)
+        writerow, close = path_writer.write_row, path_writer.close
+    else:
+        csvfile = open(output_csv, "w", newline="")
+        writerow, close = csv.writer(csvfile).writerow, csvfile.close
 
     with ThreadPoolExecutor(max_workers=n_workers) as executor:
-        futures = []
-        for i in range(0, num_samples, batch_size):
-            batch_futures = [
-                executor.submit(task, {"db_path": db_path, **sample_args})
-                for _ in range(min(batch_size, num_samples - i))
-            ]
-            futures.extend(batch_futures)
-            print(len(futures))
-
-            with open(output_csv, "w", newline="") as csvfile:
-                csv_writer = csv.writer(csvfile)
-                for future in as_completed(futures):
+        n_submitted = 0
+        try:
+            for i in range(0, num_samples, batch_size):
+                batch_futures = [
+                    executor.submit(task, {"db_path": db_path, **sample_args})
+                    for _ in range(min(batch_size, num_samples - i))
+                ]
+                n_submitted += len(batch_futures)
+                print(n_submitted)
+
+                for future in as_completed(batch_futures):
                     try:
-                        path, props = future.result()
-                        out = []
-                        for item in path:
-                            out.append(item[0])
-                        for prop in props:
-                            out.append(prop[0])
-                        csv_writer.writerow(out)
+                        path, props, *in_degrees = future.result()
+                        items = [item if backend else item[0] for item in path]
+                        prop_ids = [prop if backend else prop[0] for prop in props]
+                        writerow(items + prop_ids)
+                        if diagnostics is not None:
+                            diagnostics.observe(items, prop_ids, *in_degrees)
                     except KeyboardInterrupt as e:
                         raise e
                     except Exception:
                         pass
+        finally:
+            close()
+            if diagnostics is not None:
+                diagnostics.save(report)
+
+
+def _backend_task(
+    backend: str,
+    db_path: str,
+    with_degrees: bool = False,
+    answer_c: Optional[float] = None,
+    reverse: bool = False,
+):
+    """Task running the shared sampling engine (`utils/sampling.py`).
+
+    Args:
+    - backend: `sqlite` (one connection per worker thread) or `csr` (one
+      memory-mapped graph shared by all workers)
+    - db_path: sqlite3 db or CSR directory
+    - with_degrees: also return the in-degrees of the path's items
+    - answer_c: for reverse walks over csr, pick answers in proportion to
+      `in_degree ** -answer_c`
+    - reverse: the walks follow incoming claims; over sqlite the target
+      index is built here, once, before the workers connect
+
+    Returns:
+    - task taking the `sample` kwargs and returning the ids of a sampled path
+      (items, properties), plus the in-degrees with `with_degrees`
+    """
+    start_item = None
+    if backend == "csr":
+        graph = CSRBackend.load(db_path, mmap=True)
+        if answer_c is not None:
+            start_item = degree_item_picker(graph, answer_c)
+
+        def get_graph():
+            return graph
+
+    elif backend == "sqlite":
+        if answer_c is not None:
+            raise ValueError("answer_c needs the csr backend")
+        if reverse:
+            with SQLiteBackend(db_path) as db:
+                db.create_target_index()
+        local = threading.local()
+
+        def get_graph():
+            if not hasattr(local, "graph"):
+                local.graph = SQLiteBackend(db_path)
+            return local.graph
+
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+    def task(sample_args):
+        sample_args = dict(sample_args)
+        sample_args.pop("db_path")
+        path, properties = sample_path(
+            get_graph(), start_item=start_item, **sample_args
+        )
+        if with_degrees:
+            return path, properties, get_graph().in_degrees(path).tolist()
+        return path, properties
+
+    return task
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("database", type=str, help="path to Wikidata5m database")
-    parser.add_argument("out_file", type=str, help="path to output csv file")
+    parser.add_argument(
+        "out_file", type=str, help="path to output csv (or .parquet) file"
+    )
     parser.add_argument("n_samples", type=int, help="number of samples to generate")
     parser.add_argument(
         "--n-hops", type=int, default=3, help="number of hops per sample"
@@ -180,6 +307,13 @@ if __name__ == "__main__":
         "--n-workers", type=int, default=10, help="number of workers in generation"
     )
     parser.add_argument("--c", type=float, default=0.3, help="normalization parameter")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default=None,
+        choices=["sqlite", "csr"],
+        help="run the shared sampling engine over this backend (database is a CSR directory for csr)",
+    )
     parser.add_argument(
         "--bad-props",
         type=str,
@@ -189,7 +323,29 @@ if __name__ == "__main__":
     parser.add_argument(
         "--bad-items", type=str, default="", help="bad items, space-separated"
     )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="json file for a sampling diagnostics report",
+    )
+    parser.add_argument(
+        "--reverse",
+        action="store_true",
+        help="sample answer-first, walking incoming claims (needs --backend)",
+    )
+    parser.add_argument(
+        "--answer-c",
+        type=float,
+        default=None,
+        help="with --reverse, weigh answers by in_degree ** -answer_c (csr only)",
+    )
     args = parser.parse_args()
+    if args.reverse and args.backend is None:
+        parser.error("--reverse needs --backend")
+    if args.answer_c is not None and not args.reverse:
+        parser.error("--answer-c needs --reverse")
+    reverse_args = {"reverse": True, "answer_c": args.answer_c} if args.reverse else {}
 
     process_and_write_to_csv(
         args.database,
@@ -197,8 +353,11 @@ if __name__ == "__main__":
         args.n_samples,
         args.batch_size,
         args.n_workers,
+        backend=args.backend,
+        report=args.report,
         n_hops=args.n_hops,
         c=args.c,
         bad_prop_ids=set(args.bad_props.split(" ")),
         bad_item_ids=set(args.bad_items.split(" ")),
+        **reverse_args,
     )
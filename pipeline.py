@@ -0,0 +1,273 @@
+"""Build QA examples in one streaming run: sample paths, create prompts, call the API.
+
+Does what `parallel_path_sampling.py`, `convert_path_to_query.py` and
+`api_request_parallel_processor.py` do one after another, without the
+intermediate files: sampled paths go straight to prompt creation and on to the
+request scheduler, which pulls them only as fast as the rate limits allow.
+Sampling threads run at most `--queue-size` paths ahead.
+
+- Aliases are looked up when an id is first seen and kept in memory.
+- `--paths-file` and `--requests-file` tee the sampled paths (csv, as written
+  by `parallel_path_sampling.py`) and the requests (jsonl, as written by
+  `convert_path_to_query.py`) to disk as they stream by. If a run is
+  interrupted, finish it with
+  `python api_request_parallel_processor.py --requests_filepath REQUESTS_FILE --save_filepath SAVE_FILE --resume`.
+- The processor's options (rate limits, endpoints, cache, ...) are the same.
+
+Usage: `python3 pipeline.py DATABASE SAVE_FILE N_SAMPLES [args]`
+
+- Use `python3 pipeline.py -h` for additional help.
+- Examples:
+    - 1000 questions from a sqlite3 db:
+      `python3 pipeline.py knowledge_graph.db results.jsonl 1000`
+    - from a CSR graph, keeping the requests:
+      `python3 pipeline.py graph_csr results.jsonl 1000 --backend csr --alias-db knowledge_graph.db --requests-file requests.jsonl`
+"""
+
+import asyncio
+import csv
+import json
+import logging
+import sqlite3
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from api_request_parallel_processor import process_api_requests
+from convert_path_to_query import create_request, load_aliases, split_line
+from parallel_path_sampling import _backend_task, sample
+
+
+async def sample_paths(
+    db_path: str,
+    n_samples: int,
+    n_workers: int,
+    queue_size: int,
+    backend: Optional[str] = None,
+    **sample_args,
+) -> AsyncIterator[List[str]]:
+    """Sample paths in worker threads, as `parallel_path_sampling.py` does.
+
+    Args:
+    - db_path: sqlite3 db, or CSR directory for the csr backend
+    - n_samples: number of paths to sample
+    - n_workers: sampling threads
+    - queue_size: paths sampled ahead of the consumer at most
+    - backend: `sqlite` or `csr` to use the shared sampling engine, the
+      original `sample` by default
+    - sample_args: passed to the sampler (`n_hops`, `c`, ...)
+
+    Returns:
+    - csv rows of the paths: item ids followed by property ids, in the order
+      they finish; failed samples are dropped
+    """
+    if backend is not None:
+        task = _backend_task(backend, db_path)
+    else:
+        task = lambda args: sample(**args)
+    sample_args = {"db_path": db_path, **sample_args}
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = set()
+        n_submitted = 0
+        try:
+            while n_submitted < n_samples or pending:
+                while n_submitted < n_samples and len(pending) < queue_size:
+                    pending.add(loop.run_in_executor(executor, task, sample_args))
+                    n_submitted += 1
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    try:
+                        path, props = future.result()
+                    except Exception as e:
+                        logging.warning(f"Sampling failed: {e}")
+                        continue
+                    out = []
+                    for item in path:
+                        out.append(item if backend else item[0])
+                    for prop in props:
+                        out.append(prop if backend else prop[0])
+                    yield out
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+async def stream_requests(
+    paths: AsyncIterator[List[str]],
+    alias_db: str,
+    model: str,
+    paths_file: Optional[str] = None,
+    requests_file: Optional[str] = None,
+) -> AsyncIterator[Tuple[dict, None, None, None]]:
+    """Turn sampled paths into requests for `process_api_requests`.
+
+    Args:
+    - paths: csv rows of sampled paths
+    - alias_db: sqlite3 db with the `items` and `properties` tables
+    - model: OpenAI model to request
+    - paths_file: csv file to tee the paths to, if any
+    - requests_file: jsonl file to tee the requests to, if any
+
+    Returns:
+    - (request_json, None, None, None), the processor counts the tokens
+    """
+    db = sqlite3.connect(alias_db)
+    curr = db.cursor()
+    item_aliases: Dict[str, str] = {}
+    prop_aliases: Dict[str, str] = {}
+    # line buffered, so the tees hold every request sent if the run dies
+    paths_out = open(paths_file, "w", newline="", buffering=1) if paths_file else None
+    requests_out = open(requests_file, "w", buffering=1) if requests_file else None
+    try:
+        paths_writer = csv.writer(paths_out) if paths_out else None
+        i = 0
+        async for line in paths:
+            items, properties = split_line(line)
+            missing = [item for item in items if item not in item_aliases]
+            if missing:
+                item_aliases.update(
+                    load_aliases(curr, "items", "item_id", "item_alias", set(missing))
+                )
+            missing = [prop for prop in properties if prop not in prop_aliases]
+            if missing:
+                prop_aliases.update(
+                    load_aliases(
+                        curr,
+                        "properties",
+                        "property_id",
+                        "property_alias",
+                        set(missing),
+                    )
+                )
+            request = create_request(
+                i, line, item_aliases, prop_aliases, model, paths_file or "stream"
+            )
+            i += 1
+            if paths_writer is not None:
+                paths_writer.writerow(line)
+            if requests_out is not None:
+                requests_out.write(json.dumps(request) + "\n")
+            yield request, None, None, None
+    finally:
+        for f in (paths_out, requests_out):
+            if f is not None:
+                f.close()
+        db.close()
+
+
+async def main(args):
+    logging.basicConfig(level=args.logging_level)
+    paths = sample_paths(
+        args.database,
+        args.n_samples,
+        args.n_workers,
+        args.queue_size,
+        backend=args.backend,
+        n_hops=args.n_hops,
+        c=args.c,
+        bad_prop_ids=set(args.bad_props.split(" ")),
+        bad_item_ids=set(args.bad_items.split(" ")),
+    )
+    requests = stream_requests(
+        paths,
+        args.alias_db or args.database,
+        args.model,
+        paths_file=args.paths_file,
+        requests_file=args.requests_file,
+    )
+    await process_api_requests(
+        requests,
+        save_filepath=args.save_file,
+        max_requests_per_minute=args.max_requests_per_minute,
+        max_tokens_per_minute=args.max_tokens_per_minute,
+        token_encoding_name=args.token_encoding_name,
+        max_attempts=args.max_attempts,
+        base_url=args.base_url,
+        endpoints_filepath=args.endpoints_file,
+        max_requests_in_flight=args.max_requests_in_flight,
+        cache_filepath=args.cache,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "database",
+        type=str,
+        help="path to Wikidata5m database (CSR directory for --backend csr)",
+    )
+    parser.add_argument("save_file", type=str, help="path to output jsonl file")
+    parser.add_argument("n_samples", type=int, help="number of paths to sample")
+    parser.add_argument(
+        "--n-hops", type=int, default=3, help="number of hops per sample"
+    )
+    parser.add_argument("--c", type=float, default=0.3, help="normalization parameter")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default=None,
+        choices=["sqlite", "csr"],
+        help="run the shared sampling engine over this backend",
+    )
+    parser.add_argument(
+        "--bad-props",
+        type=str,
+        default="P31 P1343 P279",
+        help="bad properties, space-separated",
+    )
+    parser.add_argument(
+        "--bad-items", type=str, default="", help="bad items, space-separated"
+    )
+    parser.add_argument(
+        "--n-workers", type=int, default=10, help="number of sampling threads"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=100, help="paths sampled ahead at most"
+    )
+    parser.add_argument(
+        "--alias-db",
+        type=str,
+        default=None,
+        help="sqlite3 db to look up aliases in, defaults to database",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="gpt4-turbo-0125",
+        help="OpenAI model to use during generation",
+    )
+    parser.add_argument(
+        "--paths-file", type=str, default=None, help="csv file to tee paths to"
+    )
+    parser.add_argument(
+        "--requests-file", type=str, default=None, help="jsonl file to tee requests to"
+    )
+    parser.add_argument("--max-requests-per-minute", type=float, default=3_000 * 0.5)
+    parser.add_argument("--max-tokens-per-minute", type=float, default=250_000 * 0.5)
+    parser.add_argument("--token-encoding-name", type=str, default="cl100k_base")
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--max-requests-in-flight", type=int, default=100)
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=None,
+        help="endpoint replacing AZURE_OPENAI_ENDPOINT, e.g. a local mock server",
+    )
+    parser.add_argument(
+        "--endpoints-file",
+        type=str,
+        default=None,
+        help="json list of deployments, see api_request_parallel_processor.py",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="sqlite3 completion cache, defaults to LLM_CACHE from .env",
+    )
+    parser.add_argument("--logging-level", type=int, default=logging.INFO)
+    args = parser.parse_args()
+    asyncio.run(main(args))
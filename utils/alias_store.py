@@ -0,0 +1,282 @@
+"""Compact store of Wikidata names and descriptions.
+
+`graph/parse_graph.py` used to keep aliases as a dict of dicts
+(`aliases["Q42"]["name"]`), several hundred bytes of Python objects per
+entity. `AliasStore` keeps the same data in a few flat arrays:
+
+- `codes`: sorted int64 codes of the ids, `Q42` -> 84 and `P31` -> 63
+  (number * 2, plus 1 for properties); the row of an id is its position
+- `names`/`descriptions`: all values concatenated into one utf-8 buffer each,
+  with int64 `*_offsets` (n + 1) delimiting every row's value
+
+Lookups binary search the codes, and values are decoded on access. The store
+is also a read-only mapping with the dict-of-dicts interface,
+`store["Q42"]["name"]`, so code written against the old format keeps working.
+
+The pickle written by `parse_graph.py` holds `store.to_state()`, plain numpy
+arrays and bytes, so it loads without this module; `open_aliases` turns
+either format into something indexable by id.
+
+`parse_alias_dump` parses the output of `graph/parse_dump.py` in parallel,
+over byte ranges of the file.
+"""
+
+import os
+from collections.abc import Mapping
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+PREFIXES = {"Q": 0, "P": 1}
+
+# length of "<http://www.wikidata.org/entity/" and " <http://schema.org/"
+ENTITY_PREFIX_LENGTH = 32
+FIELD_PREFIX_LENGTH = 20
+
+
+def encode_id(entity_id: str) -> int:
+    """Integer code of a `Q`/`P` id, properties and items never collide."""
+    return int(entity_id[1:]) * 2 + PREFIXES[entity_id[0]]
+
+
+def decode_id(code: int) -> str:
+    return ("P" if code & 1 else "Q") + str(code >> 1)
+
+
+def _pack(values: List[bytes]) -> Tuple[bytes, np.ndarray]:
+    """Concatenate values, with the offsets delimiting them."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    return b"".join(values), offsets
+
+
+class AliasStore(Mapping):
+    """Read-only names and descriptions of Wikidata items and properties."""
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        names: bytes,
+        name_offsets: np.ndarray,
+        descriptions: bytes,
+        description_offsets: np.ndarray,
+        has_name: Optional[np.ndarray] = None,
+    ):
+        """Wrap the arrays, see the module docstring; use a `from_*` builder.
+
+        Args:
+        - has_name: whether each row has a name (rows may only have a
+          description), all by default
+        """
+        self.codes = codes
+        self.names = names
+        self.name_offsets = name_offsets
+        self.descriptions = descriptions
+        self.description_offsets = description_offsets
+        self.has_name = (
+            has_name if has_name is not None else np.ones(len(codes), dtype=bool)
+        )
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, str, str]]) -> "AliasStore":
+        """Build the store from (id, field, value) records; later records win."""
+        values: Dict[int, Dict[str, str]] = {}
+        for key, field, value in records:
+            values.setdefault(encode_id(key), {})[field] = value
+        return cls._from_values(values)
+
+    @classmethod
+    def from_dict(cls, aliases: Dict[str, Dict[str, str]]) -> "AliasStore":
+        """Build the store from the old `aliases[id][field]` dict."""
+        return cls._from_values({encode_id(k): v for k, v in aliases.items()})
+
+    @classmethod
+    def _from_values(cls, values: Dict[int, Dict[str, str]]) -> "AliasStore":
+        codes = np.array(sorted(values), dtype=np.int64)
+        rows = [values[code] for code in codes.tolist()]
+        names, name_offsets = _pack([r.get("name", "").encode() for r in rows])
+        descriptions, description_offsets = _pack(
+            [r.get("description", "").encode() for r in rows]
+        )
+        has_name = np.array(["name" in r for r in rows], dtype=bool)
+        return cls(
+            codes, names, name_offsets, descriptions, description_offsets, has_name
+        )
+
+    def to_state(self) -> Dict:
+        """Plain arrays and bytes, to pickle without depending on this module."""
+        return {
+            "format": "alias_store",
+            "codes": self.codes,
+            "names": self.names,
+            "name_offsets": self.name_offsets,
+            "descriptions": self.descriptions,
+            "description_offsets": self.description_offsets,
+            "has_name": self.has_name,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "AliasStore":
+        return cls(
+            state["codes"],
+            state["names"],
+            state["name_offsets"],
+            state["descriptions"],
+            state["description_offsets"],
+            state["has_name"],
+        )
+
+    def row(self, entity_id: str) -> int:
+        """Row of an id, -1 if it isn't in the store."""
+        try:
+            code = encode_id(entity_id)
+        except (KeyError, ValueError):
+            return -1
+        row = int(np.searchsorted(self.codes, code))
+        if row < len(self.codes) and self.codes[row] == code:
+            return row
+        return -1
+
+    def contains_codes(self, codes: np.ndarray) -> np.ndarray:
+        """Mask of the id codes (see `encode_id`) which are in the store."""
+        rows = np.searchsorted(self.codes, codes)
+        found = rows < len(self.codes)
+        found[found] = self.codes[rows[found]] == codes[found]
+        return found
+
+    def name(self, entity_id: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.row(entity_id)
+        if row < 0 or not self.has_name[row]:
+            return default
+        return self.names[self.name_offsets[row] : self.name_offsets[row + 1]].decode()
+
+    def description(self, entity_id: str, default: str = "") -> str:
+        row = self.row(entity_id)
+        if row < 0:
+            return default
+        start, end = self.description_offsets[row], self.description_offsets[row + 1]
+        return self.descriptions[start:end].decode() if end > start else default
+
+    def __getitem__(self, entity_id: str) -> Dict[str, str]:
+        row = self.row(entity_id)
+        if row < 0:
+            raise KeyError(entity_id)
+        out = {}
+        if self.has_name[row]:
+            out["name"] = self.names[
+                self.name_offsets[row] : self.name_offsets[row + 1]
+            ].decode()
+        start, end = self.description_offsets[row], self.description_offsets[row + 1]
+        if end > start:
+            out["description"] = self.descriptions[start:end].decode()
+        return out
+
+    def __contains__(self, entity_id) -> bool:
+        return isinstance(entity_id, str) and self.row(entity_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return (decode_id(code) for code in self.codes.tolist())
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def nbytes(self) -> int:
+        """Memory used by the arrays."""
+        return (
+            self.codes.nbytes
+            + len(self.names)
+            + self.name_offsets.nbytes
+            + len(self.descriptions)
+            + self.description_offsets.nbytes
+            + self.has_name.nbytes
+        )
+
+
+def open_aliases(aliases) -> Mapping:
+    """Aliases loaded from a `parse_graph.py` pickle, in either format.
+
+    Args:
+    - aliases: the pickled `AliasStore` state, or an old dict of dicts
+
+    Returns:
+    - mapping from id to `{"name": ..., "description": ...}`
+    """
+    if isinstance(aliases, dict) and aliases.get("format") == "alias_store":
+        return AliasStore.from_state(aliases)
+    return aliases
+
+
+def parse_line(line: str) -> Tuple[str, str, str]:
+    """Parse a `parse_dump.py` line into (id, field, value)."""
+    splits = line.split(">")
+    key = splits[0][ENTITY_PREFIX_LENGTH:]
+    field = splits[1][FIELD_PREFIX_LENGTH:]
+    value = splits[-1][2:-7]
+    if "\\" in value or not value.isascii():
+        # same decoding as before, only needed when there is something to decode
+        value = value.encode("utf-8").decode("unicode_escape")
+    return key, field, value
+
+
+# ids to keep, inherited by the worker processes of `parse_alias_dump`
+_keep: Optional[Set[str]] = None
+
+
+def _parse_range(args: Tuple[str, int, int]) -> List[Tuple[str, str, str]]:
+    """Parse the lines starting in [start, end) of the file."""
+    path, start, end = args
+    records = []
+    with open(path, "rb") as f:
+        if start > 0:
+            # the line running into the range belongs to the previous one
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            key, field, value = parse_line(line.decode("utf-8"))
+            if _keep is None or key in _keep:
+                records.append((key, field, value))
+    return records
+
+
+def parse_alias_dump(
+    path: str,
+    keep: Optional[Set[str]] = None,
+    n_processes: int = 1,
+    chunk_size: int = 64 * 1024 * 1024,
+) -> AliasStore:
+    """Parse the output of `graph/parse_dump.py` into an `AliasStore`.
+
+    Args:
+    - path: parsed dump, one N-Triples name or description per line
+    - keep: ids to keep, all by default
+    - n_processes: worker processes, each parsing chunks of the file
+    - chunk_size: bytes per chunk
+
+    Returns:
+    - the `AliasStore`; where an id has several values for a field, the last
+      one in the file wins, as with the old dict
+    """
+    global _keep
+    size = os.path.getsize(path)
+    ranges = [
+        (path, start, min(start + chunk_size, size))
+        for start in range(0, size, chunk_size)
+    ]
+    _keep = keep
+    try:
+        if n_processes > 1:
+            # workers are forked after `_keep` is set, so they share it
+            with Pool(n_processes) as pool:
+                chunks = pool.imap(_parse_range, ranges)
+                return AliasStore.from_records(
+                    record for chunk in chunks for record in chunk
+                )
+        return AliasStore.from_records(
+            record for r in ranges for record in _parse_range(r)
+        )
+    finally:
+        _keep = None
@@ -0,0 +1,699 @@
+"""Graph backends shared by the path samplers.
+
+Every sampler in the repo needs the same handful of graph operations: pick a
+random starting item, list the outgoing (property, target) claims of an item
+(or the incoming (property, source) claims, for answer-first walks),
+look up in-degrees to weight the next hop, and resolve ids to labels. This
+module defines that interface once (`GraphBackend`) with three
+implementations:
+
+- `SQLiteBackend`: the Wikidata5m sqlite3 db (`items`/`claims`/`properties`)
+- `CSRBackend`: integer-encoded compressed sparse rows stored as `.npy` files,
+  which can be memory-mapped so several processes share one copy
+- `SPARQLBackend`: the YAGO SPARQL endpoint plus the YAGO sqlite3 fact counts
+
+Ids are always passed around as strings (`Q42`, `P31`, YAGO urls), so a
+sampler written against `GraphBackend` runs unchanged over any of them. See
+`utils/sampling.py` for the sampling engine.
+"""
+
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _ranks(ids: np.ndarray) -> np.ndarray:
+    """Position of each id in sorted order."""
+    ranks = np.empty(len(ids), dtype=np.int64)
+    ranks[np.argsort(ids, kind="stable")] = np.arange(len(ids))
+    return ranks
+
+
+class GraphBackend(ABC):
+    """Read-only view of a knowledge graph used for sampling."""
+
+    @abstractmethod
+    def num_items(self) -> int:
+        """Number of items which can be returned by `random_item`."""
+
+    @abstractmethod
+    def random_item(self, rng: np.random.Generator) -> str:
+        """Get the id of a random item.
+
+        Args:
+        - rng: random generator, so seeded runs are reproducible
+
+        Returns:
+        - id of the item
+        """
+
+    @abstractmethod
+    def out_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        """Get the outgoing claims of an item.
+
+        Args:
+        - item_id: ID of the subject item
+
+        Returns:
+        - list of `(property_id, target_id)`, sorted so every backend returns
+          the same order for the same graph
+        """
+
+    @abstractmethod
+    def in_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        """Get the incoming claims of an item.
+
+        Args:
+        - item_id: ID of the target item
+
+        Returns:
+        - list of `(property_id, subject_id)`, sorted like `out_edges`
+        """
+
+    @abstractmethod
+    def in_degrees(self, item_ids: Sequence[str]) -> np.ndarray:
+        """Get the in-degree of each item.
+
+        Args:
+        - item_ids: IDs of the items
+
+        Returns:
+        - array of in-degrees aligned with `item_ids`
+        """
+
+    def hop_weights(self, item_ids: Sequence[str], c: float) -> np.ndarray:
+        """Get the sampling weight `max(in_degree, 1) ** -c` of each item.
+
+        Args:
+        - item_ids: IDs of the candidate targets
+        - c: constant for the sampling
+
+        Returns:
+        - array of weights aligned with `item_ids`
+        """
+        in_deg = self.in_degrees(item_ids).astype(np.float64)
+        return np.maximum(in_deg, 1.0) ** -c
+
+    @abstractmethod
+    def item_label(self, item_id: str) -> str:
+        """Get the label/alias of an item."""
+
+    @abstractmethod
+    def property_label(self, property_id: str) -> str:
+        """Get the label/alias of a property."""
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteBackend(GraphBackend):
+    """Backend over the Wikidata5m sqlite3 db.
+
+    Expects the schema built in `carter_experiments/setup_db.ipynb`, with the
+    in-degree stored as the fourth column of `items` (as read by
+    `generate.sample`).
+    """
+
+    def __init__(self, db_path: str, check_same_thread: bool = True):
+        """Connect to the database.
+
+        Args:
+        - db_path: path to the sqlite3 db
+        - check_same_thread: passed to `sqlite3.connect`, set to `False` to
+          share one backend between threads that don't use it concurrently
+        """
+        self._conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        self._curr = self._conn.cursor()
+        self._curr.execute("SELECT MAX(rowid) FROM items")
+        self._max_rowid = self._curr.fetchone()[0] or 0
+
+    def num_items(self) -> int:
+        return self._max_rowid
+
+    def random_item(self, rng: np.random.Generator) -> str:
+        # rowid lookup instead of `ORDER BY RANDOM()`, which scans the table
+        # and ignores our seed
+        rowid = int(rng.integers(1, self._max_rowid + 1))
+        self._curr.execute(
+            "SELECT item_id FROM items WHERE rowid >= ? ORDER BY rowid LIMIT 1",
+            (rowid,),
+        )
+        return self._curr.fetchone()[0]
+
+    def out_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        self._curr.execute(
+            "SELECT property_id, target_id FROM claims WHERE subject_id = ?",
+            (item_id,),
+        )
+        return sorted(self._curr.fetchall())
+
+    def create_target_index(self) -> None:
+        """Index claims by target, so `in_edges` doesn't scan `claims`.
+
+        Call it once, before the workers connect: building the index holds
+        the write lock. Does nothing on a read-only db.
+        """
+        try:
+            self._curr.execute(
+                "CREATE INDEX IF NOT EXISTS claims_target_index ON claims(target_id)"
+            )
+            self._conn.commit()
+        except sqlite3.OperationalError as e:
+            if "readonly" not in str(e):
+                raise
+
+    def in_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        # scans `claims` unless `create_target_index` was run on the db
+        self._curr.execute(
+            "SELECT property_id, subject_id FROM claims WHERE target_id = ?",
+            (item_id,),
+        )
+        return sorted(self._curr.fetchall())
+
+    def in_degrees(self, item_ids: Sequence[str]) -> np.ndarray:
+        degrees = {}
+        unique_ids = list(set(item_ids))
+        # stay below SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+        for i in range(0, len(unique_ids), 900):
+            chunk = unique_ids[i : i + 900]
+            self._curr.execute(
+                f"SELECT * FROM items WHERE item_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for row in self._curr.fetchall():
+                degrees[row[0]] = row[3]
+        return np.array([degrees.get(i, 0) for i in item_ids], dtype=np.int64)
+
+    def item_label(self, item_id: str) -> str:
+        self._curr.execute("SELECT item_alias FROM items WHERE item_id = ?", (item_id,))
+        return self._curr.fetchone()[0]
+
+    def property_label(self, property_id: str) -> str:
+        self._curr.execute(
+            "SELECT property_alias FROM properties WHERE property_id = ?",
+            (property_id,),
+        )
+        return self._curr.fetchone()[0]
+
+    def close(self) -> None:
+        self._curr.close()
+        self._conn.close()
+
+
+class CSRBackend(GraphBackend):
+    """Backend over an integer-encoded graph in compressed sparse row format.
+
+    Arrays:
+    - `node_ids`: string id of each node, index = node number
+    - `prop_ids`: string id of each property, index = property number
+    - `indptr`: out-edges of node `i` are `indptr[i]:indptr[i+1]`
+    - `targets`: target node number of each edge
+    - `props`: property number of each edge
+    - `in_degree`: in-degree of each node
+
+    The incoming edges are indexed the same way, in `in_indptr`, `sources`
+    and `in_props`, sorted by (property id, subject id). They are built on
+    the first `in_edges` call (or `build_in_index`), and saved and loaded
+    along with the other arrays when present.
+
+    Edges of each node are sorted by (property id, target id). Use `save` and
+    `load` to store the arrays as `.npy` files; `load(..., mmap=True)` maps the
+    edge arrays instead of reading them, so the graph is shared between
+    processes through the page cache. A `utils.degree_store.DegreeStore`
+    saved in the `degrees` subdirectory is loaded along with them and used
+    for the hop weights.
+    """
+
+    ARRAYS = ("node_ids", "prop_ids", "indptr", "targets", "props", "in_degree")
+    IN_ARRAYS = ("in_indptr", "sources", "in_props")
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        prop_ids: np.ndarray,
+        indptr: np.ndarray,
+        targets: np.ndarray,
+        props: np.ndarray,
+        in_degree: np.ndarray,
+        labels: Optional[Dict[str, str]] = None,
+        degrees=None,
+        in_indptr: Optional[np.ndarray] = None,
+        sources: Optional[np.ndarray] = None,
+        in_props: Optional[np.ndarray] = None,
+    ):
+        """Instantiate the backend from its arrays (see class docstring).
+
+        Args:
+        - labels: optional mapping from item/property id to label
+        - degrees: optional `DegreeStore` aligned with the nodes
+        - in_indptr/sources/in_props: optional incoming edge index
+        """
+        self.node_ids = node_ids
+        self.prop_ids = prop_ids
+        self.indptr = indptr
+        self.targets = targets
+        self.props = props
+        self.in_degree = in_degree
+        self.labels = labels if labels is not None else {}
+        self.degrees = degrees
+        self.in_indptr = in_indptr
+        self.sources = sources
+        self.in_props = in_props
+        self._node_index = {n: i for i, n in enumerate(np.asarray(node_ids).tolist())}
+
+    @classmethod
+    def from_triples(
+        cls,
+        triples: Iterable[Tuple[str, str, str]],
+        node_order: Optional[Iterable[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> "CSRBackend":
+        """Build the backend from `(subject, property, target)` triples.
+
+        Args:
+        - triples: claims of the graph
+        - node_order: optional ids to number first, e.g. the `items` table in
+          rowid order so seeded walks match `SQLiteBackend`
+        - labels: optional mapping from item/property id to label
+
+        Returns:
+        - the `CSRBackend`
+        """
+        node_index: Dict[str, int] = {}
+        prop_index: Dict[str, int] = {}
+        for node in node_order or []:
+            node_index.setdefault(node, len(node_index))
+        subjects, props, targets = [], [], []
+        for s, p, o in triples:
+            subjects.append(node_index.setdefault(s, len(node_index)))
+            props.append(prop_index.setdefault(p, len(prop_index)))
+            targets.append(node_index.setdefault(o, len(node_index)))
+
+        return cls.from_arrays(
+            np.array(list(node_index), dtype=str),
+            np.array(list(prop_index), dtype=str),
+            np.array(subjects, dtype=np.int64),
+            np.array(props, dtype=np.int32),
+            np.array(targets, dtype=np.int32),
+            labels=labels,
+        )
+
+    @classmethod
+    def from_arrays(
+        cls,
+        node_ids: np.ndarray,
+        prop_ids: np.ndarray,
+        subjects: np.ndarray,
+        props: np.ndarray,
+        targets: np.ndarray,
+        labels: Optional[Dict[str, str]] = None,
+        dedup: bool = False,
+    ) -> "CSRBackend":
+        """Build the backend from integer-encoded claims.
+
+        Every claim is kept, so parallel edges (several properties between
+        the same two items) stay separate edges.
+
+        Args:
+        - node_ids: string id of each node number
+        - prop_ids: string id of each property number
+        - subjects/props/targets: node, property and node number of each claim
+        - labels: optional mapping from item/property id to label
+        - dedup: drop repeated identical `(subject, property, target)` claims
+
+        Returns:
+        - the `CSRBackend`
+        """
+        subjects = np.asarray(subjects, dtype=np.int64)
+        props = np.asarray(props, dtype=np.int32)
+        targets = np.asarray(targets, dtype=np.int32)
+
+        # sort by subject, then property id, then target id; ranks of the
+        # string ids, so the order is the same as sorting the strings
+        node_rank, prop_rank = _ranks(node_ids), _ranks(prop_ids)
+        order = np.lexsort((node_rank[targets], prop_rank[props], subjects))
+        subjects, props, targets = subjects[order], props[order], targets[order]
+        if dedup and len(subjects):
+            # identical claims are adjacent once sorted
+            keep = np.ones(len(subjects), dtype=bool)
+            keep[1:] = (
+                (subjects[1:] != subjects[:-1])
+                | (props[1:] != props[:-1])
+                | (targets[1:] != targets[:-1])
+            )
+            subjects, props, targets = subjects[keep], props[keep], targets[keep]
+
+        counts = np.bincount(subjects, minlength=len(node_ids))
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        in_degree = np.bincount(targets, minlength=len(node_ids)).astype(np.int32)
+        return cls(node_ids, prop_ids, indptr, targets, props, in_degree, labels)
+
+    @classmethod
+    def from_sqlite(cls, db_path: str) -> "CSRBackend":
+        """Build the backend from a Wikidata5m sqlite3 db.
+
+        Args:
+        - db_path: path to the sqlite3 db
+
+        Returns:
+        - the `CSRBackend`, with nodes numbered in `items` rowid order
+        """
+        conn = sqlite3.connect(db_path)
+        curr = conn.cursor()
+        labels = {}
+        node_order = []
+        for item_id, alias in curr.execute(
+            "SELECT item_id, item_alias FROM items ORDER BY rowid"
+        ):
+            node_order.append(item_id)
+            labels[item_id] = alias
+        for prop_id, alias in curr.execute(
+            "SELECT property_id, property_alias FROM properties"
+        ):
+            labels[prop_id] = alias
+        backend = cls.from_triples(
+            curr.execute("SELECT subject_id, property_id, target_id FROM claims"),
+            node_order=node_order,
+            labels=labels,
+        )
+        conn.close()
+        return backend
+
+    @classmethod
+    def from_networkx(cls, G, aliases: Optional[Dict[str, Dict[str, str]]] = None):
+        """Build the backend from the graph pickled by `graph/parse_graph.py`.
+
+        Args:
+        - G: NetworkX DiGraph with the property id in the `id` edge attribute
+        - aliases: the pickled aliases, an `AliasStore` state or the old
+          `aliases[id]["name"]` dict (see `utils/alias_store.py`)
+
+        Returns:
+        - the `CSRBackend`
+        """
+        labels = None
+        if aliases is not None:
+            from utils.alias_store import open_aliases
+
+            aliases = open_aliases(aliases)
+            labels = {k: v["name"] for k, v in aliases.items() if "name" in v}
+        return cls.from_triples(
+            ((u, d["id"], v) for u, v, d in G.edges(data=True)),
+            node_order=G.nodes,
+            labels=labels,
+        )
+
+    def build_in_index(self) -> None:
+        """Build the incoming edge arrays, if they aren't there yet."""
+        if self.in_indptr is not None:
+            return
+        n_nodes = len(self.node_ids)
+        indptr = np.asarray(self.indptr)
+        targets = np.asarray(self.targets)
+        props = np.asarray(self.props)
+        subjects = np.repeat(np.arange(n_nodes, dtype=np.int32), np.diff(indptr))
+        # sort by target, then property id, then subject id
+        order = np.lexsort(
+            (_ranks(self.node_ids)[subjects], _ranks(self.prop_ids)[props], targets)
+        )
+        counts = np.bincount(targets, minlength=n_nodes)
+        in_indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=in_indptr[1:])
+        self.sources = subjects[order]
+        self.in_props = props[order]
+        # last, so threads only see a complete index
+        self.in_indptr = in_indptr
+
+    def save(self, directory: str) -> None:
+        """Save the arrays (and labels and degrees) to `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        if self.in_indptr is not None:
+            for name in self.IN_ARRAYS:
+                np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "labels.json"), "w") as f:
+            json.dump(self.labels, f)
+        if self.degrees is not None:
+            from utils.degree_store import DIRECTORY
+
+            self.degrees.save(os.path.join(directory, DIRECTORY))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "CSRBackend":
+        """Load arrays saved with `save`.
+
+        Args:
+        - directory: directory passed to `save`
+        - mmap: memory-map the arrays instead of reading them into memory
+
+        Returns:
+        - the `CSRBackend`
+        """
+        arrays = {
+            name: np.load(
+                os.path.join(directory, f"{name}.npy"),
+                mmap_mode="r" if mmap else None,
+            )
+            for name in cls.ARRAYS
+        }
+        if all(
+            os.path.exists(os.path.join(directory, f"{name}.npy"))
+            for name in cls.IN_ARRAYS
+        ):
+            for name in cls.IN_ARRAYS:
+                arrays[name] = np.load(
+                    os.path.join(directory, f"{name}.npy"),
+                    mmap_mode="r" if mmap else None,
+                )
+        labels_path = os.path.join(directory, "labels.json")
+        labels = None
+        if os.path.exists(labels_path):
+            with open(labels_path, "r") as f:
+                labels = json.load(f)
+        from utils.degree_store import DIRECTORY, DegreeStore
+
+        degrees = None
+        if os.path.isdir(os.path.join(directory, DIRECTORY)):
+            degrees = DegreeStore.load(os.path.join(directory, DIRECTORY), mmap=mmap)
+        return cls(**arrays, labels=labels, degrees=degrees)
+
+    def node_number(self, item_id: str) -> int:
+        """Index of an item in the node arrays, -1 if it isn't in the graph."""
+        return self._node_index.get(item_id, -1)
+
+    def num_items(self) -> int:
+        return len(self.node_ids)
+
+    def random_item(self, rng: np.random.Generator) -> str:
+        # same draw as `SQLiteBackend.random_item`, so a CSR built with
+        # `from_sqlite` starts seeded walks at the same item
+        return str(self.node_ids[int(rng.integers(1, len(self.node_ids) + 1)) - 1])
+
+    def out_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        i = self._node_index.get(item_id)
+        if i is None:
+            return []
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return list(
+            zip(
+                self.prop_ids[self.props[start:end]].tolist(),
+                self.node_ids[self.targets[start:end]].tolist(),
+            )
+        )
+
+    def in_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        self.build_in_index()
+        i = self._node_index.get(item_id)
+        if i is None:
+            return []
+        start, end = self.in_indptr[i], self.in_indptr[i + 1]
+        return list(
+            zip(
+                self.prop_ids[self.in_props[start:end]].tolist(),
+                self.node_ids[self.sources[start:end]].tolist(),
+            )
+        )
+
+    def in_degrees(self, item_ids: Sequence[str]) -> np.ndarray:
+        idx = np.array([self._node_index[i] for i in item_ids], dtype=np.int64)
+        return np.asarray(self.in_degree[idx], dtype=np.int64)
+
+    def hop_weights(self, item_ids: Sequence[str], c: float) -> np.ndarray:
+        if self.degrees is None:
+            return super().hop_weights(item_ids, c)
+        idx = np.array([self._node_index[i] for i in item_ids], dtype=np.int64)
+        return self.degrees.weight(idx, c)
+
+    def item_label(self, item_id: str) -> str:
+        return self.labels.get(item_id, item_id)
+
+    def property_label(self, property_id: str) -> str:
+        return self.labels.get(property_id, property_id)
+
+
+class SPARQLBackend(GraphBackend):
+    """Backend over the YAGO SPARQL endpoint.
+
+    Claims come from the endpoint; random items and in-degrees come from the
+    YAGO sqlite3 db built by `yago/db/insert_entities.py`, where items are
+    keyed by their full url in `item_label` and `count` is the number of facts,
+    the same weighting used by `RandomWalk2`.
+    """
+
+    def __init__(self, yago_db_path: str, endpoint_url: Optional[str] = None):
+        """Connect to the YAGO sqlite3 db and endpoint.
+
+        Args:
+        - yago_db_path: path to the YAGO sqlite3 db
+        - endpoint_url: YAGO SPARQL endpoint, defaults to `YAGO_ENDPOINT_URL`
+        """
+        from yago.db.functions.entity import (
+            get_entity_count_from_label_multiple_query_parameterized,
+        )
+        from yago.kg.query import get_triples_from_response, query_kg
+        from yago.utils.constants import INVALID_PROPERTIES, PREFIXES, YAGO_ENDPOINT_URL
+
+        self._count_query = get_entity_count_from_label_multiple_query_parameterized
+        self._query_kg = query_kg
+        self._get_triples = get_triples_from_response
+        self._prefixes = PREFIXES
+        self._invalid_properties = INVALID_PROPERTIES
+        self._endpoint_url = endpoint_url or YAGO_ENDPOINT_URL
+        self._conn = sqlite3.connect(yago_db_path)
+        self._curr = self._conn.cursor()
+        self._curr.execute("SELECT MAX(rowid) FROM items")
+        self._max_rowid = self._curr.fetchone()[0] or 0
+
+    def _prefix_string(self) -> str:
+        return "\n".join(f"PREFIX {k}: <{v}>" for k, v in self._prefixes.items())
+
+    def num_items(self) -> int:
+        return self._max_rowid
+
+    def random_item(self, rng: np.random.Generator) -> str:
+        rowid = int(rng.integers(1, self._max_rowid + 1))
+        self._curr.execute(
+            "SELECT item_label FROM items WHERE rowid >= ? ORDER BY rowid LIMIT 1",
+            (rowid,),
+        )
+        return self._curr.fetchone()[0]
+
+    def out_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        query = f"""
+        {self._prefix_string()}
+        SELECT ?predicate ?object WHERE {{
+            <{item_id}> ?predicate ?object
+            FILTER (isIRI(?object) && ?predicate not in ({','.join(self._invalid_properties)}))
+        }}
+        """
+        response = self._query_kg(self._endpoint_url, query)
+        if response is None:
+            return []
+        triples = self._get_triples(
+            response, columns_dict={"predicate": "predicate", "object": "object"}
+        )
+        return sorted(zip(triples["predicate"].tolist(), triples["object"].tolist()))
+
+    def in_edges(self, item_id: str) -> List[Tuple[str, str]]:
+        query = f"""
+        {self._prefix_string()}
+        SELECT ?predicate ?subject WHERE {{
+            ?subject ?predicate <{item_id}>
+            FILTER (isIRI(?subject) && ?predicate not in ({','.join(self._invalid_properties)}))
+        }}
+        """
+        response = self._query_kg(self._endpoint_url, query)
+        if response is None:
+            return []
+        triples = self._get_triples(
+            response, columns_dict={"predicate": "predicate", "subject": "subject"}
+        )
+        return sorted(zip(triples["predicate"].tolist(), triples["subject"].tolist()))
+
+    def in_degrees(self, item_ids: Sequence[str]) -> np.ndarray:
+        degrees = {}
+        unique_ids = list(set(item_ids))
+        for i in range(0, len(unique_ids), 900):
+            chunk = unique_ids[i : i + 900]
+            self._curr.execute(self._count_query(entity_labels=chunk), chunk)
+            for _, label, count in self._curr.fetchall():
+                degrees[label] = count
+        return np.array([degrees.get(i, 0) for i in item_ids], dtype=np.int64)
+
+    def _label(self, url: str) -> str:
+        query = f"""
+        SELECT ?label WHERE {{
+            <{url}> <http://www.w3.org/2000/01/rdf-schema#label> ?label
+            FILTER (lang(?label) = 'en')
+        }} LIMIT 1
+        """
+        response = self._query_kg(self._endpoint_url, query)
+        try:
+            return response["results"]["bindings"][0]["label"]["value"]
+        except (TypeError, KeyError, IndexError):
+            return url.rsplit("/", 1)[-1]
+
+    def item_label(self, item_id: str) -> str:
+        return self._label(item_id)
+
+    def property_label(self, property_id: str) -> str:
+        return self._label(property_id)
+
+    def close(self) -> None:
+        self._curr.close()
+        self._conn.close()
+
+
+def open_backend(kind: str, path: str, **kwargs) -> GraphBackend:
+    """Open a backend by name.
+
+    Args:
+    - kind: one of `sqlite`, `csr` or `sparql`
+    - path: sqlite3 db for `sqlite`/`sparql`, array directory for `csr`
+    - kwargs: passed to the backend constructor/loader
+
+    Returns:
+    - the `GraphBackend`
+    """
+    if kind == "sqlite":
+        return SQLiteBackend(path, **kwargs)
+    if kind == "csr":
+        return CSRBackend.load(path, **kwargs)
+    if kind == "sparql":
+        return SPARQLBackend(path, **kwargs)
+    raise ValueError(f"Unknown backend: {kind}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import pickle
+
+    parser = argparse.ArgumentParser(description="Build a CSR backend directory.")
+    parser.add_argument("source", type=str, help="Wikidata5m sqlite3 db or parse_graph.py pickle")
+    parser.add_argument("out_dir", type=str, help="directory to save the CSR arrays in")
+    args = parser.parse_args()
+
+    if args.source.endswith((".pkl", ".pickle")):
+        with open(args.source, "rb") as f:
+            G, aliases = pickle.load(f)
+        csr = CSRBackend.from_networkx(G, aliases)
+    else:
+        csr = CSRBackend.from_sqlite(args.source)
+    from utils.degree_store import DegreeStore
+
+    csr.degrees = DegreeStore.from_csr(csr)
+    csr.build_in_index()
+    csr.save(args.out_dir)
+    print(f"saved {len(csr.node_ids)} nodes and {len(csr.targets)} edges to {args.out_dir}")
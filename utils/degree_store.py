@@ -0,0 +1,183 @@
+"""Precomputed degree statistics of a CSR graph, for weighted sampling.
+
+The samplers weigh every candidate target by `in_degree ** -c` at every hop,
+looking the in-degrees up and raising them to the power each time.
+`DegreeStore` computes the per-node statistics once, at ingest, as dense
+arrays aligned with the node numbers of a `utils.backends.CSRBackend`:
+
+- `in_degree`/`out_degree`: incoming and outgoing claims of each node
+- `out_props`: distinct outgoing properties of each node
+- `functional_out_degree`: outgoing properties with a single target, the
+  ones kept by the samplers' `unique_props` option
+- `weights`: `max(in_degree, 1) ** -c` for each of `c_values`, one row per c
+- `prop_count`/`prop_subjects`: claims and distinct subjects of each property
+  (`prop_count / prop_subjects` is the mean number of values per subject)
+
+A weight lookup is then one array index. The arrays are saved as `.npy` files
+in a `degrees` directory next to the CSR arrays, and `CSRBackend.load` picks
+them up.
+
+Usage (from the repository root):
+`python -m utils.degree_store CSR_DIR [--c-values 0.3 0.5 1.0]`
+"""
+
+import json
+import os
+from typing import Sequence
+
+import numpy as np
+
+DEFAULT_C_VALUES = (0.0, 0.3, 0.5, 1.0)
+
+# directory of the store, inside the CSR directory
+DIRECTORY = "degrees"
+
+
+class DegreeStore:
+    """Degree arrays of a graph, see the module docstring."""
+
+    ARRAYS = (
+        "in_degree",
+        "out_degree",
+        "out_props",
+        "functional_out_degree",
+        "weights",
+        "c_values",
+        "prop_count",
+        "prop_subjects",
+    )
+
+    def __init__(
+        self,
+        in_degree: np.ndarray,
+        out_degree: np.ndarray,
+        out_props: np.ndarray,
+        functional_out_degree: np.ndarray,
+        weights: np.ndarray,
+        c_values: np.ndarray,
+        prop_count: np.ndarray,
+        prop_subjects: np.ndarray,
+    ):
+        """Wrap the arrays; use `from_csr` or `load`."""
+        self.in_degree = in_degree
+        self.out_degree = out_degree
+        self.out_props = out_props
+        self.functional_out_degree = functional_out_degree
+        self.weights = weights
+        self.c_values = c_values
+        self.prop_count = prop_count
+        self.prop_subjects = prop_subjects
+        self._c_rows = {float(c): i for i, c in enumerate(np.asarray(c_values).tolist())}
+
+    @classmethod
+    def from_csr(
+        cls, csr, c_values: Sequence[float] = DEFAULT_C_VALUES
+    ) -> "DegreeStore":
+        """Compute the store of a `CSRBackend`.
+
+        Args:
+        - csr: the graph; its edges are grouped by property within each node
+        - c_values: values of `c` to precompute weights for
+
+        Returns:
+        - the `DegreeStore`
+        """
+        n_nodes = len(csr.node_ids)
+        indptr = np.asarray(csr.indptr)
+        props = np.asarray(csr.props)
+        out_degree = np.diff(indptr).astype(np.int32)
+        in_degree = np.asarray(csr.in_degree, dtype=np.int32)
+
+        # runs of edges with the same subject and property
+        subjects = np.repeat(np.arange(n_nodes), out_degree)
+        starts = np.ones(len(props), dtype=bool)
+        starts[1:] = (subjects[1:] != subjects[:-1]) | (props[1:] != props[:-1])
+        run_starts = np.flatnonzero(starts)
+        run_lengths = np.diff(np.append(run_starts, len(props)))
+        run_subjects = subjects[run_starts]
+        out_props = np.bincount(run_subjects, minlength=n_nodes).astype(np.int32)
+        functional_out_degree = np.bincount(
+            run_subjects[run_lengths == 1], minlength=n_nodes
+        ).astype(np.int32)
+
+        n_props = len(csr.prop_ids)
+        prop_count = np.bincount(props, minlength=n_props).astype(np.int64)
+        prop_subjects = np.bincount(props[run_starts], minlength=n_props).astype(
+            np.int64
+        )
+
+        c_values = np.array(sorted(set(float(c) for c in c_values)), dtype=np.float64)
+        clipped = np.maximum(in_degree, 1).astype(np.float64)
+        weights = np.zeros((len(c_values), n_nodes), dtype=np.float64)
+        for i, c in enumerate(c_values):
+            weights[i] = clipped**-c
+        return cls(
+            in_degree,
+            out_degree,
+            out_props,
+            functional_out_degree,
+            weights,
+            c_values,
+            prop_count,
+            prop_subjects,
+        )
+
+    def weight(self, nodes: np.ndarray, c: float) -> np.ndarray:
+        """Sampling weights `max(in_degree, 1) ** -c` of node numbers."""
+        row = self._c_rows.get(float(c))
+        if row is not None:
+            return np.asarray(self.weights[row][nodes])
+        return np.maximum(self.in_degree[nodes], 1).astype(np.float64) ** -c
+
+    def save(self, directory: str) -> None:
+        """Save the arrays to `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "DegreeStore":
+        """Load arrays saved with `save`, memory-mapped by default."""
+        return cls(
+            **{
+                name: np.load(
+                    os.path.join(directory, f"{name}.npy"),
+                    mmap_mode="r" if mmap else None,
+                )
+                for name in cls.ARRAYS
+            }
+        )
+
+    def summary(self) -> dict:
+        """Distribution of the node degrees, for a quick look at the graph."""
+        out = {"n_nodes": len(self.in_degree), "c_values": self.c_values.tolist()}
+        for name in ("in_degree", "out_degree", "out_props", "functional_out_degree"):
+            values = np.asarray(getattr(self, name))
+            out[name] = {
+                "mean": float(values.mean()) if len(values) else 0.0,
+                "max": int(values.max()) if len(values) else 0,
+                "p50": float(np.percentile(values, 50)) if len(values) else 0.0,
+                "p99": float(np.percentile(values, 99)) if len(values) else 0.0,
+            }
+        return out
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from utils.backends import CSRBackend
+
+    parser = ArgumentParser(description="Precompute the degree store of a CSR directory.")
+    parser.add_argument("csr_dir", type=str, help="directory of CSRBackend arrays")
+    parser.add_argument(
+        "--c-values",
+        type=float,
+        nargs="+",
+        default=list(DEFAULT_C_VALUES),
+        help="values of c to precompute weights for",
+    )
+    args = parser.parse_args()
+
+    store = DegreeStore.from_csr(CSRBackend.load(args.csr_dir), args.c_values)
+    store.save(os.path.join(args.csr_dir, DIRECTORY))
+    print(json.dumps(store.summary(), indent=2))
@@ -0,0 +1,107 @@
+"""Integer-encoded edge arrays of the Wikidata5m claims.
+
+`graph/parse_graph.py` used to add the claims to a NetworkX graph one line at
+a time and then prune it node by node and edge by edge. Here the claim file
+is read straight into three int64 arrays, `subjects`, `props` and `targets`,
+one entry per claim, with ids encoded as in `utils/alias_store.py`
+(`Q42` -> 84, `P31` -> 63). Pruning is then a boolean mask over the edges,
+compacted in one pass, before any graph object is built.
+
+The file is parsed in `chunk_size` byte blocks by numpy's text parser,
+without creating a Python string per id.
+"""
+
+import warnings
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from utils.alias_store import decode_id
+
+# whether each byte value starts an id
+IS_PREFIX = np.zeros(256, dtype=bool)
+IS_PREFIX[ord("A") : ord("Z") + 1] = True
+IS_PREFIX[ord("a") : ord("z") + 1] = True
+
+
+def _read_blocks(path: str, chunk_size: int) -> Iterator[bytes]:
+    """Read blocks of about `chunk_size` bytes, each ending at a line end."""
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            block = rest + data
+            end = block.rfind(b"\n") + 1
+            rest = block[end:]
+            if end:
+                yield block[:end]
+    if rest.strip():
+        yield rest + b"\n"
+
+
+def encode_block(block: bytes) -> np.ndarray:
+    """Codes of the whitespace separated `Q`/`P` ids in a block, in order.
+
+    Raises:
+    - Exception: on an id which doesn't start with P or Q, or isn't numeric
+    """
+    # ids are one letter then digits, so the letters are exactly the prefixes
+    data = np.frombuffer(block, dtype=np.uint8)
+    prefixes = data[IS_PREFIX[data]]
+    is_property = prefixes == ord("P")
+    if not np.all(is_property | (prefixes == ord("Q"))):
+        raise Exception('Element which starts with not P or Q')
+    with warnings.catch_warnings():
+        # numpy warns, then stops, at anything but whitespace and digits
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(
+                block.translate(None, b"QP"), dtype=np.int64, sep=" "
+            )
+        except (DeprecationWarning, ValueError):
+            values = None
+    if values is None or len(values) != len(prefixes):
+        raise Exception('Element without a valid numeric id')
+    return values * 2 + is_property
+
+
+def read_claim_codes(
+    path: str, chunk_size: int = 16 * 1024 * 1024
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read a tab separated Wikidata5m claim file into code arrays.
+
+    Args:
+    - path: claim file, one `subject<TAB>property<TAB>target` per line
+    - chunk_size: bytes parsed at once
+
+    Returns:
+    - (subjects, props, targets), int64 codes in file order
+    """
+    chunks = []
+    for block in _read_blocks(path, chunk_size):
+        codes = encode_block(block)
+        if len(codes) % 3:
+            raise Exception('Claim line without exactly three elements')
+        chunks.append(codes.reshape(-1, 3))
+    claims = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.int64)
+    return claims[:, 0].copy(), claims[:, 1].copy(), claims[:, 2].copy()
+
+
+def is_item(codes: np.ndarray) -> np.ndarray:
+    """Mask of the codes of `Q` ids."""
+    return (codes & 1) == 0
+
+
+def decode_codes(codes: np.ndarray) -> np.ndarray:
+    """String ids of codes, as a list; each distinct id is one string object."""
+    unique, inverse = np.unique(codes, return_inverse=True)
+    ids = [decode_id(code) for code in unique.tolist()]
+    return [ids[i] for i in inverse.tolist()]
+
+
+def first_seen(codes: np.ndarray) -> np.ndarray:
+    """Distinct codes in order of first appearance."""
+    unique, first = np.unique(codes, return_index=True)
+    return unique[np.argsort(first, kind="stable")]
@@ -0,0 +1,209 @@
+"""Persistent cache of LLM chat completions.
+
+Re-running an experiment with the same paths and prompts shouldn't pay for
+the same completions again. `CompletionCache` stores every response in a
+sqlite3 db, keyed by a hash of the request parameters (model/deployment,
+messages and anything else passed, e.g. `temperature`), so every question
+generator can share one cache file, across threads and processes.
+
+- `cache.create(client, **params)` is a drop-in for
+  `client.chat.completions.create(**params)`
+- callers which rate limit their requests look up with `get` first and
+  `put` the response after, so hits don't use up the budget
+- entries older than `max_age_days` are dropped, and above `max_size_mb` the
+  least recently used ones are
+- `report()` gives the hit rate of this session and the size of the cache
+
+Usage (from the repository root):
+`python -m utils.llm_cache CACHE_DB [--max-size-mb N] [--max-age-days N]`
+prints the report after evicting.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from argparse import ArgumentParser
+from typing import Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+# evict every this many insertions, besides when the cache is opened
+EVICT_EVERY = 1000
+
+
+class CompletionCache:
+    """Content-addressed store of chat completion responses."""
+
+    def __init__(
+        self,
+        path: str,
+        max_size_mb: Optional[float] = None,
+        max_age_days: Optional[float] = None,
+    ):
+        """Open (or create) the cache and evict stale entries.
+
+        Args:
+        - path: sqlite3 db file
+        - max_size_mb: total size of the stored responses to keep, unlimited
+          by default
+        - max_age_days: age after which entries are dropped, unlimited by
+          default
+        """
+        self.path = path
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        # one connection shared by every thread, behind the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets other processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def key(params: Dict) -> str:
+        """Hash of the request parameters."""
+        content = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, params: Dict) -> Optional[Dict]:
+        """Look up a response.
+
+        Args:
+        - params: parameters of the `chat.completions.create` call
+
+        Returns:
+        - the response as a dict (`ChatCompletion.model_dump()`), `None` on a
+          miss
+        """
+        key = self.key(params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, params: Dict, response: Dict) -> None:
+        """Store a response.
+
+        Args:
+        - params: parameters of the `chat.completions.create` call
+        - response: the response as a dict (`ChatCompletion.model_dump()`)
+        """
+        data = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (self.key(params), data, len(data), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+        if self._puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def create(self, client, **params) -> ChatCompletion:
+        """`client.chat.completions.create(**params)`, answered from the cache if possible."""
+        response = self.get(params)
+        if response is not None:
+            return ChatCompletion.construct(**response)
+        completion = client.chat.completions.create(**params)
+        self.put(params, completion.model_dump())
+        return completion
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones above the size limit."""
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+                self._conn.execute("DELETE FROM completions WHERE created < ?", (cutoff,))
+            if self.max_size_mb is not None:
+                (total,) = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM completions"
+                ).fetchone()
+                excess = total - self.max_size_mb * 1024 * 1024
+                if excess > 0:
+                    keys = []
+                    for key, size in self._conn.execute(
+                        "SELECT key, size FROM completions ORDER BY last_used"
+                    ):
+                        if excess <= 0:
+                            break
+                        keys.append((key,))
+                        excess -= size
+                    self._conn.executemany("DELETE FROM completions WHERE key = ?", keys)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hits and misses of this session, and entries and size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_mb": size / 1024 / 1024,
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"completion cache {self.path}: {stats['hits']} hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+            f"{stats['entries']} entries, {stats['size_mb']:.1f} MB"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_cache(path: Optional[str], **kwargs) -> Optional[CompletionCache]:
+    """Open the cache at `path`, or `None` if `path` is empty (no caching)."""
+    if not path:
+        return None
+    return CompletionCache(os.path.expanduser(path), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", type=str, help="cache db")
+    parser.add_argument("--max-size-mb", type=float, default=None)
+    parser.add_argument("--max-age-days", type=float, default=None)
+    args = parser.parse_args()
+    cache = CompletionCache(args.path, args.max_size_mb, args.max_age_days)
+    print(cache.report())
+    cache.close()
@@ -1,18 +1,72 @@
-from openai import AzureOpenAI
+import os
+
+from openai import AsyncAzureOpenAI, AzureOpenAI
 from dotenv import dotenv_values
 
-secrets = dotenv_values(".env")
-personal_api_key = secrets['AZURE_OPENAI_KEY']
-azure_endpoint = secrets['AZURE_OPENAI_ENDPOINT']
+from utils.llm_cache import open_cache
+
+API_VERSION = "2024-02-15-preview"
+
+client = None  # created on first use, see `get_client`
+cache = None  # opened on first use, see `open_default_cache`
+
+
+def get_client(base_url=None, use_async=False, **client_args):
+    """Azure OpenAI client configured from `.env`.
+
+    Args:
+    - base_url: endpoint replacing 'AZURE_OPENAI_ENDPOINT', e.g. the url of
+      `benchmarks/mock_openai_server.py`; defaults to 'OPENAI_BASE_URL' from
+      `.env` or the environment when set
+    - use_async: return an `AsyncAzureOpenAI` client
+    - client_args: passed to the client, e.g. `max_retries`
+
+    Returns:
+    - the client
+    """
+    secrets = dotenv_values(".env")
+    if base_url is None:
+        base_url = secrets.get("OPENAI_BASE_URL") or os.environ.get("OPENAI_BASE_URL")
+    api_key = secrets.get("AZURE_OPENAI_KEY")
+    azure_endpoint = base_url or secrets.get("AZURE_OPENAI_ENDPOINT")
+    if base_url and api_key is None:
+        # local servers don't check the key
+        api_key = "local"
+    if azure_endpoint is None or api_key is None:
+        raise Exception(".env values not set - see generate.py header for info")
+    client_class = AsyncAzureOpenAI if use_async else AzureOpenAI
+    return client_class(
+        azure_endpoint=azure_endpoint,
+        api_key=api_key,
+        api_version=API_VERSION,
+        **client_args,
+    )
+
+
+def open_default_cache(path=None):
+    """Completion cache configured from `.env`.
+
+    Args:
+    - path: sqlite3 db of the cache; defaults to 'LLM_CACHE' from `.env` or
+      the environment when set
+
+    Returns:
+    - the `CompletionCache`, or `None` if no path is configured
+    """
+    if path is None:
+        path = dotenv_values(".env").get("LLM_CACHE") or os.environ.get("LLM_CACHE")
+    return open_cache(path)
 
-client = AzureOpenAI(
-  azure_endpoint = azure_endpoint, 
-  api_key=personal_api_key,  
-  api_version="2024-02-15-preview"
-)
 
 def query_openai_model(prompt, model_name = "gpt4-turbo-0125"):
-    response = client.chat.completions.create(
+    global client, cache
+    if client is None:
+        client = get_client()
+        cache = open_default_cache()
+    create = client.chat.completions.create
+    if cache is not None:
+        create = lambda **params: cache.create(client, **params)
+    response = create(
         model=model_name, # model = "deployment_name".
         temperature = 0.7,
         messages=[
@@ -24,5 +78,3 @@ def query_openai_model(prompt, model_name = "gpt4-turbo-0125"):
     usage = response.usage
 
     return response.choices[0].message.content, usage
-
-
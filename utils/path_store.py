@@ -0,0 +1,265 @@
+"""Typed, columnar storage of sampled paths (Parquet).
+
+The samplers write paths as untyped csv rows, item ids followed by property
+ids, which readers split by position. A Parquet path file instead has one
+column per position:
+
+- `item_0` ... `item_{n_hops}`: item ids, `null` past the end of a path cut
+  short by a dead end
+- `prop_1` ... `prop_{n_hops}`: property ids, likewise
+- `n_hops`: hops of the row's path
+
+Id columns are dictionary-encoded, so each distinct id is stored once per row
+group. The file's key-value metadata records `n_hops` and the sampler's
+parameters (`c`, bad ids, backend, ...), so readers don't have to guess them.
+Selecting columns or filtering rows (e.g. every path starting at an item)
+only decodes the columns involved.
+
+Requires `pyarrow` (optional, only imported when a path file is used).
+
+Usage (from the repository root):
+- `python -m utils.path_store to-parquet PATHS_CSV PATHS_PARQUET --n-hops 3`
+- `python -m utils.path_store to-csv PATHS_PARQUET PATHS_CSV`
+- `python -m utils.path_store info PATHS_PARQUET`
+"""
+
+import csv
+import json
+from argparse import ArgumentParser
+from typing import Dict, Iterator, List, Optional, Sequence
+
+# key of the metadata in the Parquet file
+METADATA_KEY = b"claimbench.paths"
+
+
+def is_path_file(path: str) -> bool:
+    """Whether `path` names a Parquet path file rather than a csv file."""
+    return path.endswith(".parquet")
+
+
+def path_schema(n_hops: int, metadata: Optional[Dict] = None):
+    """Arrow schema of a path file.
+
+    Args:
+    - n_hops: hops of the longest path
+    - metadata: sampler parameters to record
+
+    Returns:
+    - the `pyarrow.Schema`
+    """
+    import pyarrow as pa
+
+    ids = pa.dictionary(pa.int32(), pa.string())
+    fields = [pa.field(f"item_{i}", ids) for i in range(n_hops + 1)]
+    fields += [pa.field(f"prop_{i + 1}", ids) for i in range(n_hops)]
+    fields.append(pa.field("n_hops", pa.int8()))
+    metadata = {"n_hops": n_hops, **(metadata or {})}
+    return pa.schema(fields, metadata={METADATA_KEY: json.dumps(metadata)})
+
+
+class PathWriter:
+    """Writes sampled paths to a Parquet file, one row group at a time."""
+
+    def __init__(
+        self,
+        path: str,
+        n_hops: int,
+        metadata: Optional[Dict] = None,
+        row_group_size: int = 100_000,
+    ):
+        """Create the file.
+
+        Args:
+        - path: Parquet file to write
+        - n_hops: hops of the longest path
+        - metadata: sampler parameters to record, must be json serializable
+        - row_group_size: paths buffered per row group
+        """
+        import pyarrow.parquet as pq
+
+        self.n_hops = n_hops
+        self.row_group_size = row_group_size
+        self.schema = path_schema(n_hops, metadata)
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self._columns: List[List] = [[] for _ in self.schema]
+        self.n_rows = 0
+
+    def write(self, items: Sequence[str], props: Sequence[str]) -> None:
+        """Add a path.
+
+        Args:
+        - items: item ids, at most `n_hops + 1`
+        - props: property ids connecting them
+        """
+        if len(props) > self.n_hops or len(items) != len(props) + 1:
+            raise ValueError(
+                f"path of {len(items)} items and {len(props)} properties "
+                f"doesn't fit {self.n_hops} hops"
+            )
+        n_items = self.n_hops + 1
+        for i in range(n_items):
+            self._columns[i].append(items[i] if i < len(items) else None)
+        for i in range(self.n_hops):
+            self._columns[n_items + i].append(props[i] if i < len(props) else None)
+        self._columns[-1].append(len(props))
+        if len(self._columns[-1]) >= self.row_group_size:
+            self.flush()
+
+    def write_row(self, line: Sequence[str]) -> None:
+        """Add a path given as a csv row, item ids followed by property ids."""
+        n_props = len(line) // 2
+        self.write(line[: n_props + 1], line[n_props + 1 :])
+
+    def flush(self) -> None:
+        """Write the buffered paths as one row group."""
+        import pyarrow as pa
+
+        if not self._columns[-1]:
+            return
+        arrays = [
+            pa.array(column, type=field.type.value_type).dictionary_encode()
+            if pa.types.is_dictionary(field.type)
+            else pa.array(column, type=field.type)
+            for column, field in zip(self._columns, self.schema)
+        ]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.n_rows += len(self._columns[-1])
+        self._columns = [[] for _ in self.schema]
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self) -> "PathWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_metadata(path: str) -> Dict:
+    """Sampler parameters recorded in a path file, including `n_hops`."""
+    import pyarrow.parquet as pq
+
+    return json.loads(pq.read_schema(path).metadata[METADATA_KEY])
+
+
+def read_paths(path: str, columns: Optional[List[str]] = None, filters=None):
+    """Read a path file as an Arrow table.
+
+    Args:
+    - path: Parquet path file
+    - columns: columns to read, all by default
+    - filters: row filter, in `pyarrow.parquet.read_table` form, e.g.
+      `[("item_0", "=", "Q42")]` or `[("n_hops", "=", 3)]`
+
+    Returns:
+    - the `pyarrow.Table`
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, columns=columns, filters=filters)
+
+
+def iter_paths(path: str, batch_size: int = 65_536) -> Iterator[List[str]]:
+    """Stream the paths of a path file as csv rows.
+
+    Rows are item ids followed by property ids, as in the csv files, so
+    positional readers (`convert_path_to_query.split_line`) work unchanged.
+
+    Args:
+    - path: Parquet path file
+    - batch_size: rows decoded at a time
+
+    Returns:
+    - csv rows, in file order
+    """
+    import pyarrow.parquet as pq
+
+    file = pq.ParquetFile(path)
+    n_hops = read_metadata(path)["n_hops"]
+    names = [f"item_{i}" for i in range(n_hops + 1)]
+    names += [f"prop_{i + 1}" for i in range(n_hops)]
+    for batch in file.iter_batches(batch_size=batch_size, columns=names + ["n_hops"]):
+        columns = [batch.column(name).to_pylist() for name in names]
+        for row, hops in enumerate(batch.column("n_hops").to_pylist()):
+            items = [columns[i][row] for i in range(hops + 1)]
+            props = [columns[n_hops + 1 + i][row] for i in range(hops)]
+            yield items + props
+
+
+def csv_to_parquet(
+    csv_path: str,
+    parquet_path: str,
+    n_hops: Optional[int] = None,
+    metadata: Optional[Dict] = None,
+) -> int:
+    """Convert a csv path file.
+
+    Args:
+    - csv_path: csv rows of item ids followed by property ids
+    - parquet_path: Parquet file to write
+    - n_hops: hops of the longest path, read from the file by default
+    - metadata: sampler parameters to record
+
+    Returns:
+    - number of paths written
+    """
+    if n_hops is None:
+        with open(csv_path, newline="") as f:
+            n_hops = max((len(line) // 2 for line in csv.reader(f)), default=0)
+    with open(csv_path, newline="") as f, PathWriter(
+        parquet_path, n_hops, metadata=metadata
+    ) as writer:
+        for line in csv.reader(f):
+            writer.write_row(line)
+    return writer.n_rows
+
+
+def parquet_to_csv(parquet_path: str, csv_path: str) -> int:
+    """Convert a path file back to csv rows.
+
+    Returns:
+    - number of paths written
+    """
+    n_rows = 0
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for line in iter_paths(parquet_path):
+            writer.writerow(line)
+            n_rows += 1
+    return n_rows
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    to_parquet = subparsers.add_parser("to-parquet", help="convert a csv path file")
+    to_parquet.add_argument("csv_path", type=str)
+    to_parquet.add_argument("parquet_path", type=str)
+    to_parquet.add_argument(
+        "--n-hops", type=int, default=None, help="hops of the longest path"
+    )
+    to_parquet.add_argument(
+        "--metadata", type=str, default="{}", help="sampler parameters, as json"
+    )
+    to_csv = subparsers.add_parser("to-csv", help="convert a path file to csv")
+    to_csv.add_argument("parquet_path", type=str)
+    to_csv.add_argument("csv_path", type=str)
+    info = subparsers.add_parser("info", help="print a path file's metadata")
+    info.add_argument("parquet_path", type=str)
+    args = parser.parse_args()
+
+    if args.command == "to-parquet":
+        n_rows = csv_to_parquet(
+            args.csv_path, args.parquet_path, args.n_hops, json.loads(args.metadata)
+        )
+        print(f"wrote {n_rows} paths to {args.parquet_path}")
+    elif args.command == "to-csv":
+        n_rows = parquet_to_csv(args.parquet_path, args.csv_path)
+        print(f"wrote {n_rows} paths to {args.csv_path}")
+    else:
+        import pyarrow.parquet as pq
+
+        print(json.dumps(read_metadata(args.parquet_path)))
+        print(f"{pq.ParquetFile(args.parquet_path).metadata.num_rows} paths")
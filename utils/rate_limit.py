@@ -0,0 +1,223 @@
+"""Async rate limiting for LLM requests.
+
+`RateLimiter` keeps two token buckets, one for requests and one for tokens per
+minute, and `acquire` sleeps exactly until both have enough capacity instead
+of polling. The budgets adapt to the server (AIMD): every 429 halves them
+and blocks the limiter for the server's `Retry-After`, and successful
+requests grow them back towards the configured maximum.
+
+`Scheduler` spreads requests over several deployments/endpoints, each with
+its own `RateLimiter`, handing every request to whichever can take it first.
+"""
+
+import asyncio
+import time
+from typing import Dict, Mapping, Optional
+
+
+class RateLimiter:
+    """Adaptive token-bucket limiter for requests and tokens per minute."""
+
+    def __init__(
+        self,
+        max_requests_per_minute: float,
+        max_tokens_per_minute: float = float("inf"),
+        decrease_factor: float = 0.5,
+        additive_increase: float = 0.02,
+        min_rate_fraction: float = 0.05,
+        decrease_interval: float = 1.0,
+    ):
+        """Instantiate the limiter, starting with full buckets.
+
+        Args:
+        - max_requests_per_minute: request budget
+        - max_tokens_per_minute: token budget, unlimited by default
+        - decrease_factor: budgets are multiplied by this on a rate limit error
+        - additive_increase: fraction of the maximum budgets regained per
+          successful request
+        - min_rate_fraction: budgets never drop below this fraction of the
+          maximum
+        - decrease_interval: rate limit errors within this many seconds of a
+          decrease count as the same event (they were already in flight)
+        """
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.decrease_factor = decrease_factor
+        self.additive_increase = additive_increase
+        self.min_rate_fraction = min_rate_fraction
+        self.decrease_interval = decrease_interval
+        self.rate_fraction = 1.0
+        self.available_requests = max_requests_per_minute
+        self.available_tokens = max_tokens_per_minute
+        self._last_update = time.monotonic()
+        self._last_decrease = float("-inf")
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def requests_per_minute(self) -> float:
+        """Current request budget."""
+        return self.max_requests_per_minute * self.rate_fraction
+
+    @property
+    def tokens_per_minute(self) -> float:
+        """Current token budget."""
+        return self.max_tokens_per_minute * self.rate_fraction
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self.available_requests = min(
+            self.available_requests + self.requests_per_minute * elapsed / 60.0,
+            self.requests_per_minute,
+        )
+        if self.max_tokens_per_minute != float("inf"):
+            self.available_tokens = min(
+                self.available_tokens + self.tokens_per_minute * elapsed / 60.0,
+                self.tokens_per_minute,
+            )
+
+    def _seconds_until_available(self, tokens: float) -> float:
+        missing_requests = max(1 - self.available_requests, 0)
+        missing_tokens = max(tokens - self.available_tokens, 0)
+        wait = missing_requests * 60.0 / self.requests_per_minute
+        if missing_tokens > 0:
+            wait = max(wait, missing_tokens * 60.0 / self.tokens_per_minute)
+        return max(wait, self._blocked_until - time.monotonic())
+
+    def try_acquire(self, tokens: float = 0) -> float:
+        """Take capacity for one request if it's available now.
+
+        Doesn't wait or lock, for callers which schedule over several limiters
+        (see `Scheduler`); otherwise use `acquire`.
+
+        Args:
+        - tokens: tokens the request is expected to use
+
+        Returns:
+        - 0 if the request was admitted, otherwise seconds until it could be
+        """
+        # a request larger than the whole bucket would wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+        self._refill()
+        wait = self._seconds_until_available(tokens)
+        if wait > 0:
+            return wait
+        self.available_requests -= 1
+        self.available_tokens -= tokens
+        return 0.0
+
+    async def acquire(self, tokens: float = 0) -> None:
+        """Wait until one request using `tokens` tokens fits in the budget.
+
+        Callers are served in arrival order, so a large request can't be
+        starved by smaller ones.
+
+        Args:
+        - tokens: tokens the request is expected to use
+        """
+        async with self._lock:
+            while True:
+                wait = self.try_acquire(tokens)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+    def on_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        """Back off after a rate limit error (multiplicative decrease).
+
+        Args:
+        - retry_after: seconds the server asked to wait, if it said
+        """
+        now = time.monotonic()
+        self._refill()
+        if now - self._last_decrease >= self.decrease_interval:
+            self._last_decrease = now
+            self.rate_fraction = max(
+                self.rate_fraction * self.decrease_factor, self.min_rate_fraction
+            )
+        # the server's window is full, start refilling from empty
+        self.available_requests = min(self.available_requests, 0)
+        if self.max_tokens_per_minute != float("inf"):
+            self.available_tokens = min(self.available_tokens, 0)
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def record_usage(self, estimated_tokens: float, actual_tokens: float) -> None:
+        """Correct the token bucket once a request's actual usage is known.
+
+        Args:
+        - estimated_tokens: tokens acquired for the request
+        - actual_tokens: tokens the server reported it used
+        """
+        if self.max_tokens_per_minute == float("inf"):
+            return
+        self._refill()
+        self.available_tokens = min(
+            self.available_tokens + estimated_tokens - actual_tokens,
+            self.tokens_per_minute,
+        )
+
+    def on_success(self) -> None:
+        """Grow the budgets back after a successful request (additive increase)."""
+        self.rate_fraction = min(self.rate_fraction + self.additive_increase, 1.0)
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Read how long a rate limited server asked to wait.
+
+    Args:
+    - headers: response headers of the rate limit error
+
+    Returns:
+    - seconds to wait, or `None` if the server didn't say
+    """
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # an HTTP date, fall back to the limiter's own backoff
+    return None
+
+
+class Scheduler:
+    """Spreads requests over several independently rate limited endpoints."""
+
+    def __init__(self, limiters: Dict[str, RateLimiter]):
+        """Instantiate the scheduler.
+
+        Args:
+        - limiters: one limiter per endpoint, by endpoint name; they shouldn't
+          also be used on their own
+        """
+        self.limiters = limiters
+        self._names = list(limiters)
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 0) -> str:
+        """Wait until some endpoint can take one request using `tokens` tokens.
+
+        Endpoints are tried round robin, so load is spread over all of them
+        while they have capacity.
+
+        Args:
+        - tokens: tokens the request is expected to use
+
+        Returns:
+        - name of the endpoint the request was admitted to
+        """
+        async with self._lock:
+            while True:
+                wait = float("inf")
+                for i in range(len(self._names)):
+                    name = self._names[(self._next + i) % len(self._names)]
+                    endpoint_wait = self.limiters[name].try_acquire(tokens)
+                    if endpoint_wait <= 0:
+                        self._next = (self._next + i + 1) % len(self._names)
+                        return name
+                    wait = min(wait, endpoint_wait)
+                await asyncio.sleep(wait)
@@ -0,0 +1,236 @@
+"""Random walk path sampling over any `GraphBackend`.
+
+This is the sampling loop from `generate.py`, `parallel_path_sampling.py` and
+`graph/random_sample.py`, written once against `utils/backends.py`:
+
+- start at a random item
+- at each hop, drop claims with bad or already-used properties and claims to
+  bad or already-seen items
+- weigh the remaining targets by `in_degree ** -c` and pick one
+    - `c` = 1 will have each node weighed by inverse in-degree
+    - `c` = 0 is uniform sampling
+    - backends with a precomputed `utils/degree_store.py` look the weights up
+- all candidate targets are marked as seen (heuristic to prevent double hops)
+
+With `reverse=True` the walk is answer-first: it starts at the answer and
+follows incoming claims (`GraphBackend.in_edges`) back to the starting item,
+with the same filters and weights, and the path is returned in forward order.
+
+Pass a seeded `np.random.Generator` to get the same paths from every backend
+over the same graph (see `compare_backends`).
+"""
+
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from utils.backends import CSRBackend, GraphBackend
+
+
+def sample_path(
+    backend: GraphBackend,
+    n_hops: int,
+    c: float,
+    bad_prop_ids: Set[str] = set(),
+    bad_item_ids: Set[str] = set(),
+    unique_props: bool = False,
+    restart: bool = True,
+    max_restarts: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+    log: Optional[List[str]] = None,
+    start_item: Optional[Callable[[np.random.Generator], str]] = None,
+    prop_weights: Optional[Mapping[str, float]] = None,
+    reverse: bool = False,
+) -> Tuple[List[str], List[str]]:
+    """Sample a path.
+
+    Args:
+    - backend: graph to sample from
+    - n_hops: number of hops
+    - c: constant for the sampling
+    - bad_prop_ids: property ids to avoid sampling
+    - bad_item_ids: item ids to avoid sampling
+    - unique_props: exclude properties which point to multiple items from the
+      current item (as `generate.sample` does)
+    - restart: restart from a new item on a dead end, otherwise return the
+      partial path
+    - max_restarts: give up and return the partial path after this many restarts
+    - rng: random generator, a fresh unseeded one if `None`
+    - log: where to store logging messages
+    - start_item: picks the first item instead of `backend.random_item`, e.g.
+      to start from items with a given property (`utils/quota_sampling.py`)
+    - prop_weights: multiplies the weight of claims with these properties,
+      1 for the others
+    - reverse: walk backwards from the answer (picked by `start_item` if
+      given) along incoming claims
+
+    Returns:
+    - tuple of:
+        - list of sampled item ids
+        - list of property ids connecting them
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if log is None:
+        # no logging will be returned
+        log = []
+
+    for _ in range(max_restarts + 1):
+        path, properties = _walk(
+            backend,
+            n_hops,
+            c,
+            bad_prop_ids,
+            bad_item_ids,
+            unique_props,
+            rng,
+            log,
+            start_item,
+            prop_weights,
+            reverse,
+        )
+        if len(properties) == n_hops or not restart:
+            break
+        log.append("restarting")
+    if reverse:
+        # answer first -> start first
+        return path[::-1], properties[::-1]
+    return path, properties
+
+
+def _walk(
+    backend: GraphBackend,
+    n_hops: int,
+    c: float,
+    bad_prop_ids: Set[str],
+    bad_item_ids: Set[str],
+    unique_props: bool,
+    rng: np.random.Generator,
+    log: List[str],
+    start_item: Optional[Callable[[np.random.Generator], str]] = None,
+    prop_weights: Optional[Mapping[str, float]] = None,
+    reverse: bool = False,
+) -> Tuple[List[str], List[str]]:
+    """Single attempt of `sample_path`, stops at the first dead end."""
+    edges = backend.in_edges if reverse else backend.out_edges
+    if start_item is not None:
+        initial_item = start_item(rng)
+    else:
+        initial_item = backend.random_item(rng)
+
+    path = [initial_item]
+    item_ids = set([initial_item])
+    prev_id = initial_item
+    properties = []
+    prop_ids = set()
+
+    for _ in range(n_hops):
+        # remove duplicate and bad relations
+        outgoing = [
+            (p, t)
+            for p, t in edges(prev_id)
+            if p not in prop_ids and p not in bad_prop_ids
+        ]
+        if unique_props:
+            # exclude any properties which point to multiple items
+            counts = Counter(p for p, _ in outgoing)
+            outgoing = [(p, t) for p, t in outgoing if counts[p] <= 1]
+        # remove duplicate and bad items
+        outgoing = [
+            (p, t) for p, t in outgoing if t not in item_ids and t not in bad_item_ids
+        ]
+
+        if not outgoing:
+            log.append("no possible next hops")
+            return path, properties
+
+        # get probs
+        weights = backend.hop_weights([t for _, t in outgoing], c)
+        if prop_weights:
+            weights = weights * np.array([prop_weights.get(p, 1.0) for p, _ in outgoing])
+        probs = weights / np.sum(weights)
+
+        # sample
+        idx = rng.choice(len(probs), p=probs)
+        prop, target = outgoing[idx]
+        path.append(target)
+        prev_id = target
+
+        # update
+        item_ids.update(t for _, t in outgoing)
+        properties.append(prop)
+        prop_ids.add(prop)
+
+    return path, properties
+
+
+def degree_item_picker(
+    csr: CSRBackend, c: float
+) -> Callable[[np.random.Generator], str]:
+    """Picks items of a CSR graph with probability proportional to
+    `in_degree ** -c`, e.g. answers for reverse walks.
+
+    Items without incoming claims, which can't be answers, are never picked.
+
+    Args:
+    - csr: graph to pick from
+    - c: constant for the weights, 0 for uniform over items with in-edges
+
+    Returns:
+    - function of a random generator returning an item id
+    """
+    in_degree = np.asarray(csr.in_degree, dtype=np.float64)
+    weights = np.where(in_degree > 0, np.maximum(in_degree, 1.0) ** -c, 0.0)
+    cdf = np.cumsum(weights)
+    node_ids = csr.node_ids
+
+    def pick(rng: np.random.Generator) -> str:
+        i = int(np.searchsorted(cdf, rng.random() * cdf[-1], side="right"))
+        return str(node_ids[min(i, len(cdf) - 1)])
+
+    return pick
+
+
+def compare_backends(
+    backends: Dict[str, GraphBackend],
+    n_samples: int,
+    n_hops: int,
+    c: float,
+    seed: int = 0,
+    **sample_args,
+) -> Dict[str, Dict]:
+    """Run the engine over several backends with the same seed.
+
+    Args:
+    - backends: backends to compare, by name
+    - n_samples: number of paths to sample from each backend
+    - n_hops: number of hops
+    - c: constant for the sampling
+    - seed: seed shared by every backend
+    - sample_args: passed to `sample_path`
+
+    Returns:
+    - per backend: `samples_per_sec`, `seconds` and `paths`, plus `matches`
+      (whether its paths equal those of the first backend)
+    """
+    results = {}
+    reference: Optional[Sequence] = None
+    for name, backend in backends.items():
+        rng = np.random.default_rng(seed)
+        t = time.perf_counter()
+        paths = [
+            sample_path(backend, n_hops, c, rng=rng, **sample_args)
+            for _ in range(n_samples)
+        ]
+        seconds = time.perf_counter() - t
+        if reference is None:
+            reference = paths
+        results[name] = {
+            "seconds": seconds,
+            "samples_per_sec": n_samples / seconds if seconds else float("inf"),
+            "matches": paths == reference,
+            "paths": paths,
+        }
+    return results
@@ -0,0 +1,290 @@
+"""Streaming sketches of the sampled-path distribution.
+
+Tuning `c` means comparing which items, properties and degrees the sampler
+visits. Instead of reloading the sampled csv files into pandas, the samplers
+can feed every path to a `SamplingDiagnostics`, which keeps fixed-size
+sketches as paths are generated:
+
+- `CountMinSketch`: approximate item and property frequencies, with the
+  heaviest hitters tracked alongside
+- `HyperLogLog`: approximate number of distinct items (and start items)
+- a log2 histogram of the in-degree of the items at each hop
+
+Memory is a few MB whatever the number of paths, and `report()` is a small
+json-serializable dict, so runs with different `c` can be compared at full
+scale without a second pass over the paths.
+
+Usage (from the repository root), to compare reports side by side:
+`python -m utils.sketches REPORT_JSON [REPORT_JSON ...]`
+"""
+
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def hash64(key: str) -> int:
+    """Stable 64-bit hash of a string, the same in every process and run."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class CountMinSketch:
+    """Count-Min sketch with a bounded list of heavy hitters.
+
+    Estimates never undercount; they overcount by at most `e / width` of the
+    total with probability `1 - exp(-depth)`.
+    """
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4, top_k: int = 20):
+        """Allocate the counters.
+
+        Args:
+        - width: counters per row
+        - depth: rows, each with its own hash
+        - top_k: heavy hitters to report
+        """
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.counts = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._rows = np.arange(depth)
+        # heavy hitter candidates and their estimates, pruned to `top_k`
+        # whenever it grows past `4 * top_k`
+        self._candidates: Dict[str, int] = {}
+
+    def _columns(self, key: str) -> np.ndarray:
+        # double hashing: column i is h1 + i * h2
+        h = hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return (h1 + self._rows * h2) % self.width
+
+    def add(self, key: str, count: int = 1) -> None:
+        columns = self._columns(key)
+        self.counts[self._rows, columns] += count
+        self.total += count
+        if self.top_k <= 0:
+            return
+        self._candidates[key] = int(self.counts[self._rows, columns].min())
+        if len(self._candidates) > 4 * self.top_k:
+            self._candidates = dict(self.heavy_hitters())
+
+    def estimate(self, key: str) -> int:
+        return int(self.counts[self._rows, self._columns(key)].min())
+
+    def heavy_hitters(self) -> List[Tuple[str, int]]:
+        """The `top_k` most frequent keys seen, with their estimates."""
+        candidates = sorted(self._candidates.items(), key=lambda kv: -kv[1])
+        return candidates[: self.top_k]
+
+    def merge(self, other: "CountMinSketch") -> None:
+        """Add the counts of a sketch with the same shape."""
+        self.counts += other.counts
+        self.total += other.total
+        for key in other._candidates:
+            self._candidates[key] = self.estimate(key)
+        self._candidates = dict(self.heavy_hitters())
+
+    def nbytes(self) -> int:
+        return self.counts.nbytes
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter, standard error about `1.04 / sqrt(2 ** p)`."""
+
+    def __init__(self, p: int = 14):
+        """Allocate `2 ** p` registers (16 KB for the default `p`)."""
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, key: str) -> None:
+        h = hash64(key)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        # position of the first 1 bit in the remaining 64 - p bits
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m**2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction: linear counting
+            return float(self.m * np.log(self.m / zeros))
+        return float(estimate)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def nbytes(self) -> int:
+        return self.registers.nbytes
+
+
+class DegreeHistogram:
+    """Counts of in-degrees per hop, in `[2 ** k, 2 ** (k + 1))` buckets."""
+
+    N_BUCKETS = 40
+
+    def __init__(self):
+        # one row per hop, grown as longer paths come in
+        self.counts = np.zeros((0, self.N_BUCKETS), dtype=np.int64)
+
+    def _grow(self, n_hops: int) -> None:
+        if n_hops > len(self.counts):
+            grown = np.zeros((n_hops, self.N_BUCKETS), dtype=np.int64)
+            grown[: len(self.counts)] = self.counts
+            self.counts = grown
+
+    def add(self, degrees: Sequence[int]) -> None:
+        self._grow(len(degrees))
+        for hop, degree in enumerate(degrees):
+            # bucket 0 holds degree 0, bucket k + 1 holds [2 ** k, 2 ** (k + 1))
+            bucket = min(int(degree).bit_length(), self.N_BUCKETS - 1)
+            self.counts[hop, bucket] += 1
+
+    def merge(self, other: "DegreeHistogram") -> None:
+        self._grow(len(other.counts))
+        self.counts[: len(other.counts)] += other.counts
+
+    def report(self) -> Dict[str, List[List[int]]]:
+        """Per hop (0 = starting item), non-empty `[min_degree, count]` buckets."""
+        out = {}
+        for hop, row in enumerate(self.counts):
+            out[str(hop)] = [
+                [0 if bucket == 0 else 1 << (bucket - 1), int(count)]
+                for bucket, count in enumerate(row.tolist())
+                if count
+            ]
+        return out
+
+
+class SamplingDiagnostics:
+    """Sketches of every path a sampler produces, see the module docstring."""
+
+    def __init__(
+        self,
+        params: Optional[Dict] = None,
+        width: int = 1 << 16,
+        depth: int = 4,
+        top_k: int = 20,
+        p: int = 14,
+    ):
+        """Create empty sketches.
+
+        Args:
+        - params: sampler parameters (`c`, `n_hops`, ...) to put in the report
+        - width/depth/top_k: Count-Min sketch shape, see `CountMinSketch`
+        - p: HyperLogLog precision, see `HyperLogLog`
+        """
+        self.params = params or {}
+        self.items = CountMinSketch(width, depth, top_k)
+        self.props = CountMinSketch(width, depth, top_k)
+        self.distinct_items = HyperLogLog(p)
+        self.distinct_start_items = HyperLogLog(p)
+        self.degrees = DegreeHistogram()
+        self.n_paths = 0
+        self.hop_counts: Dict[int, int] = {}
+
+    def observe(
+        self,
+        items: Sequence[str],
+        props: Sequence[str],
+        in_degrees: Optional[Sequence[int]] = None,
+    ) -> None:
+        """Add a sampled path.
+
+        Args:
+        - items: item ids of the path
+        - props: property ids connecting them
+        - in_degrees: in-degree of each item, if known
+        """
+        self.n_paths += 1
+        self.hop_counts[len(props)] = self.hop_counts.get(len(props), 0) + 1
+        if items:
+            self.distinct_start_items.add(items[0])
+        for item in items:
+            self.items.add(item)
+            self.distinct_items.add(item)
+        for prop in props:
+            self.props.add(prop)
+        if in_degrees is not None:
+            self.degrees.add(in_degrees)
+
+    def merge(self, other: "SamplingDiagnostics") -> None:
+        """Add the sketches of another run with the same sketch shapes."""
+        self.items.merge(other.items)
+        self.props.merge(other.props)
+        self.distinct_items.merge(other.distinct_items)
+        self.distinct_start_items.merge(other.distinct_start_items)
+        for hop, count in other.hop_counts.items():
+            self.hop_counts[hop] = self.hop_counts.get(hop, 0) + count
+        self.degrees.merge(other.degrees)
+        self.n_paths += other.n_paths
+
+    def report(self) -> Dict:
+        """Compact json-serializable summary of the run."""
+        distinct_items = self.distinct_items.count()
+        return {
+            "params": self.params,
+            "n_paths": self.n_paths,
+            "hop_counts": {str(k): v for k, v in sorted(self.hop_counts.items())},
+            "item_visits": self.items.total,
+            "prop_visits": self.props.total,
+            "distinct_items": round(distinct_items),
+            "distinct_start_items": round(self.distinct_start_items.count()),
+            # share of visits that went to a not yet visited item
+            "item_novelty": (
+                min(1.0, distinct_items / self.items.total) if self.items.total else 0.0
+            ),
+            "top_items": self.items.heavy_hitters(),
+            "top_props": self.props.heavy_hitters(),
+            "in_degree_histogram": self.degrees.report(),
+            "sketch_bytes": self.items.nbytes()
+            + self.props.nbytes()
+            + self.distinct_items.nbytes()
+            + self.distinct_start_items.nbytes(),
+        }
+
+    def save(self, path: str) -> None:
+        """Write the report as json."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def compare_reports(reports: Iterable[Dict]) -> List[Dict]:
+    """Headline numbers of several reports, one row each."""
+    rows = []
+    for report in reports:
+        n_paths = report["n_paths"] or 1
+        top_props = report["top_props"]
+        rows.append(
+            {
+                **report["params"],
+                "n_paths": report["n_paths"],
+                "distinct_items": report["distinct_items"],
+                "item_novelty": round(report["item_novelty"], 4),
+                "top_prop": top_props[0][0] if top_props else None,
+                "top_prop_share": round(top_props[0][1] / n_paths, 4) if top_props else 0.0,
+            }
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Compare sampling diagnostics reports.")
+    parser.add_argument("reports", type=str, nargs="+", help="report json files")
+    args = parser.parse_args()
+
+    loaded = []
+    for path in args.reports:
+        with open(path, "r") as f:
+            loaded.append(json.load(f))
+    for path, row in zip(args.reports, compare_reports(loaded)):
+        print(path, json.dumps(row))
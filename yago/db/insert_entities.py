@@ -81,7 +81,7 @@ def insert_entities(entities: List[Tuple[str, str, str]], db: YagoDB) -> int:
     int
         The number of entities inserted.
     """
-    items = [Item(*entity) for entity in entities]
+    items = Item.from_rows(entities)
     try:
         return db.insert_items(items)
     except Exception as e:
@@ -105,7 +105,7 @@ def insert_properties(properties: List[Tuple[str, str]], db: YagoDB) -> int:
     int
         The number of properties inserted.
     """
-    properties = [Property(*property) for property in properties]
+    properties = Property.from_rows(properties)
     try:
         return db.insert_properties(properties)
     except Exception as e:
@@ -79,7 +79,7 @@ def insert_properties(properties: List[Tuple[str, str, int]], db: YagoDB) -> int
     int
         The number of properties inserted.
     """
-    properties = [Property(*property_) for property_ in properties]
+    properties = Property.from_rows(properties)
     try:
         return db.insert_properties_with_counts(properties)
     except Exception as e:
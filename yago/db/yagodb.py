@@ -188,7 +188,7 @@ class YagoDB:
         self._curr.execute('''
             SELECT * FROM claims WHERE subject_id = ?
         ''', (subject_id,))
-        return {Claim(*row) for row in self._curr.fetchall()}
+        return set(Claim.from_rows(self._curr.fetchall()))
     
     def random_item(self) -> Item:
         """Get a random item from the database.
@@ -213,7 +213,7 @@ class YagoDB:
         self._curr.execute('''
             SELECT * FROM claims WHERE target_id = ?
         ''', (target_id,))
-        return {Claim(*row) for row in self._curr.fetchall()}
+        return set(Claim.from_rows(self._curr.fetchall()))
 
     def close(self) -> None:
         """Close the connection to the database."""
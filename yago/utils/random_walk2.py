@@ -42,6 +42,17 @@ if __name__=='__main__':
         from .constants import YAGO_ENTITY_STORE_DB_PATH, YAGO_PREFIXES_PATH, YAGO_ENDPOINT_URL, \
             PREFIXES, INVALID_PROPERTIES
         from .prefix import get_prefixes, get_url_from_prefix_and_id
+elif __package__ and __package__.startswith('yago'):
+    # imported as `yago.utils.random_walk2`, e.g. from the repository root
+    from ..db.yagodb import YagoDB
+    from ..db.constants.main import YAGO_ALL_ENTITY_COUNT, YAGO_FACTS_ENTITY_COUNT
+    from ..db.functions.entity import get_random_entities_query, \
+        get_entity_count_from_label_multiple_query_parameterized
+    from ..kg.query import get_triples_multiple_subjects_query, get_description_multiple_entities_query, \
+        query_kg, get_triples_from_response
+    from .constants import YAGO_ENTITY_STORE_DB_PATH, YAGO_PREFIXES_PATH, YAGO_ENDPOINT_URL, \
+        PREFIXES, INVALID_PROPERTIES
+    from .prefix import get_prefixes, get_url_from_prefix_and_id
 else:
     from db.yagodb import YagoDB
     from db.constants.main import YAGO_ALL_ENTITY_COUNT, YAGO_FACTS_ENTITY_COUNT